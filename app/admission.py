@@ -0,0 +1,288 @@
+"""
+Admission Control for the Cats vs Dogs Prediction API
+Bounds the number of requests in inference by the measured model throughput,
+rate limits each client with a token bucket, lets interactive requests
+overtake bulk ones, and rejects requests that would miss their deadline
+before they reach the model, so overload turns into fast 429/503 answers
+instead of an unbounded queue inside TensorFlow
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+
+# Latency a request may spend in inference; with the measured throughput this
+# sets the in-flight limit (Little's law: limit = throughput * latency)
+ADMISSION_TARGET_LATENCY_MS = float(os.getenv('ADMISSION_TARGET_LATENCY_MS', '500'))
+ADMISSION_MIN_IN_FLIGHT = int(os.getenv('ADMISSION_MIN_IN_FLIGHT', '1'))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '64'))
+ADMISSION_INITIAL_IN_FLIGHT = int(os.getenv('ADMISSION_INITIAL_IN_FLIGHT', '4'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))
+
+# Per-client token bucket (0 disables rate limiting)
+ADMISSION_CLIENT_RPS = float(os.getenv('ADMISSION_CLIENT_RPS', '10'))
+ADMISSION_CLIENT_BURST = float(os.getenv('ADMISSION_CLIENT_BURST', '20'))
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '10000'))
+# Header naming the client behind a trusted proxy (e.g. X-Forwarded-For);
+# empty uses the connection's address
+ADMISSION_CLIENT_HEADER = os.getenv('ADMISSION_CLIENT_HEADER', '')
+
+# Fraction of the in-flight limit bulk requests may occupy
+ADMISSION_BULK_SHARE = float(os.getenv('ADMISSION_BULK_SHARE', '0.25'))
+
+# Default time budgets per priority class, overridable per request
+PRIORITIES = {
+    'interactive': float(os.getenv('ADMISSION_DEADLINE_MS', '2000')) / 1000,
+    'bulk': float(os.getenv('ADMISSION_BULK_DEADLINE_MS', '30000')) / 1000,
+}
+_PRIORITY_RANK = {'interactive': 0, 'bulk': 1}
+
+# Weight of the newest sample in the throughput and latency averages
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A request was refused; status_code and retry_after go into the response"""
+
+    def __init__(self, message, status_code=503, retry_after=1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def client_key(request, header=ADMISSION_CLIENT_HEADER):
+    """Rate limiting key of a request"""
+    if header:
+        value = request.headers.get(header)
+        if value:
+            # The first X-Forwarded-For hop is the original client
+            return value.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to burst; each request takes one"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take a token; returns 0, or the seconds until one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Gate in front of inference for one API worker
+
+    Runs entirely on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, target_latency=ADMISSION_TARGET_LATENCY_MS / 1000,
+                 min_in_flight=ADMISSION_MIN_IN_FLIGHT, max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+                 initial_in_flight=ADMISSION_INITIAL_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 client_rps=ADMISSION_CLIENT_RPS, client_burst=ADMISSION_CLIENT_BURST,
+                 bulk_share=ADMISSION_BULK_SHARE, max_clients=ADMISSION_MAX_CLIENTS):
+        """
+        Initialize controller
+
+        Args:
+            target_latency: Seconds a request may spend in inference
+            min_in_flight: Lower bound of the in-flight limit
+            max_in_flight: Upper bound of the in-flight limit
+            initial_in_flight: Limit used until throughput has been measured
+            max_queue: Requests allowed to wait for a slot
+            client_rps: Sustained requests per second per client (0 disables)
+            client_burst: Requests a client may make at once
+            bulk_share: Fraction of the limit available to bulk requests
+            max_clients: Token buckets kept before the least recent is dropped
+        """
+        self.target_latency = target_latency
+        self.min_in_flight = min_in_flight
+        self.max_in_flight = max_in_flight
+        self.limit = max(min_in_flight, min(initial_in_flight, max_in_flight))
+        self.max_queue = max_queue
+        self.client_rps = client_rps
+        self.client_burst = client_burst
+        self.bulk_share = bulk_share
+        self.max_clients = max_clients
+
+        self.in_flight = {'interactive': 0, 'bulk': 0}
+        self.throughput = None
+        self.service_time = None
+        self._buckets = OrderedDict()
+        self._queue = []
+        self._sequence = itertools.count()
+        self.counters = {'admitted': 0, 'rate_limited': 0, 'queue_full': 0,
+                         'shed_deadline': 0, 'queued': 0}
+
+    def _capacity(self, priority):
+        """Slots the priority class may occupy"""
+        if priority == 'bulk':
+            return max(1, int(self.limit * self.bulk_share))
+        return self.limit
+
+    def _has_slot(self, priority):
+        total = self.in_flight['interactive'] + self.in_flight['bulk']
+        return total < self.limit and self.in_flight[priority] < self._capacity(priority)
+
+    def _waiting(self):
+        return sum(1 for entry in self._queue if not entry[2].done())
+
+    def _rate_limit(self, client, now):
+        if self.client_rps <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_rps, self.client_burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        wait = bucket.take(now)
+        if wait:
+            self.counters['rate_limited'] += 1
+            raise AdmissionRejected("Rate limit exceeded", 429, wait)
+
+    def _expected_wait(self, rank):
+        """Seconds until a request of this rank would finish, from the measured throughput"""
+        if not self.throughput:
+            return 0.0
+        ahead = sum(1 for entry in self._queue if entry[0] <= rank and not entry[2].done())
+        in_flight = self.in_flight['interactive'] + self.in_flight['bulk']
+        return (in_flight + ahead + 1) / self.throughput
+
+    def _dispatch(self):
+        """Hand free slots to waiting requests, interactive first"""
+        while self._queue:
+            rank, _, future, priority = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._has_slot(priority):
+                break
+            heapq.heappop(self._queue)
+            self.in_flight[priority] += 1
+            future.set_result(time.monotonic())
+
+    def _evict(self, rank):
+        """Reject the newest waiting request of a lower priority to make room"""
+        live = [entry for entry in self._queue if entry[0] > rank and not entry[2].done()]
+        if not live:
+            return False
+        victim = max(live)
+        victim[2].set_exception(AdmissionRejected("Server overloaded", 503,
+                                                  self._expected_wait(victim[0])))
+        return True
+
+    def _record(self, service_time, concurrency):
+        """Update the throughput estimate and the in-flight limit from one completion"""
+        throughput = concurrency / max(service_time, 1e-6)
+        if self.throughput is None:
+            self.throughput, self.service_time = throughput, service_time
+        else:
+            self.throughput += _EWMA_ALPHA * (throughput - self.throughput)
+            self.service_time += _EWMA_ALPHA * (service_time - self.service_time)
+        limit = math.ceil(self.throughput * self.target_latency)
+        self.limit = max(self.min_in_flight, min(limit, self.max_in_flight))
+
+    @asynccontextmanager
+    async def admit(self, client, priority='interactive', deadline=None):
+        """
+        Hold an inference slot for the duration of the block
+
+        Args:
+            client: Key identifying the caller for rate limiting
+            priority: 'interactive' or 'bulk'
+            deadline: Seconds the caller will wait (default per priority class)
+
+        Yields:
+            Dictionary whose 'record' the block sets to False when it was
+            answered without the model, keeping its timing out of the
+            throughput and service-time estimates
+
+        Raises:
+            AdmissionRejected: 429 when the client is over its rate, 503 when
+                the queue is full or the deadline cannot be met
+        """
+        now = time.monotonic()
+        self._rate_limit(client, now)
+        budget = PRIORITIES[priority] if deadline is None else deadline
+        rank = _PRIORITY_RANK[priority]
+
+        waiting = any(entry[0] <= rank and not entry[2].done() for entry in self._queue)
+        if self._has_slot(priority) and not waiting:
+            if self.service_time is not None and self.service_time > budget:
+                # Even without queueing the request would finish too late
+                self.counters['shed_deadline'] += 1
+                raise AdmissionRejected("Request would miss its deadline", 503,
+                                        self.service_time - budget)
+            self.in_flight[priority] += 1
+            started = now
+        else:
+            if self._waiting() >= self.max_queue and not self._evict(rank):
+                self.counters['queue_full'] += 1
+                raise AdmissionRejected("Server overloaded", 503, self._expected_wait(rank))
+            expected = self._expected_wait(rank)
+            if expected > budget:
+                self.counters['shed_deadline'] += 1
+                raise AdmissionRejected("Request would miss its deadline", 503, expected - budget)
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (rank, next(self._sequence), future, priority))
+            self.counters['queued'] += 1
+            # Give up in time for the request to still be served within budget
+            timeout = budget - (self.service_time or 0.0)
+            try:
+                started = await asyncio.wait_for(future, max(timeout, 0.0))
+            except AdmissionRejected:
+                self.counters['queue_full'] += 1
+                raise
+            except asyncio.TimeoutError:
+                self.counters['shed_deadline'] += 1
+                raise AdmissionRejected("Request would miss its deadline", 503,
+                                        self._expected_wait(rank))
+            except asyncio.CancelledError:
+                # The client went away; hand back a slot granted in the meantime
+                if future.done() and not future.cancelled():
+                    self.in_flight[priority] -= 1
+                    self._dispatch()
+                raise
+
+        self.counters['admitted'] += 1
+        ticket = {'record': True}
+        try:
+            yield ticket
+        finally:
+            concurrency = self.in_flight['interactive'] + self.in_flight['bulk']
+            self.in_flight[priority] -= 1
+            if ticket['record']:
+                self._record(time.monotonic() - started, concurrency)
+            self._dispatch()
+
+    def snapshot(self):
+        """Current limit, load, estimates and rejection counters"""
+        return {
+            'limit': self.limit,
+            'bulk_limit': self._capacity('bulk'),
+            'in_flight': dict(self.in_flight),
+            'waiting': self._waiting(),
+            'throughput_rps': self.throughput,
+            'service_time_ms': self.service_time * 1000 if self.service_time else None,
+            'clients': len(self._buckets),
+            'counters': dict(self.counters)
+        }
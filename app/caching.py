@@ -0,0 +1,250 @@
+"""
+HTTP Caching Helpers for the Cats vs Dogs API
+Pre-rendered pages, in-memory JSON documents and pre-compressed static assets
+served with ETag / If-None-Match and Cache-Control support
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip is always available
+    brotli = None
+
+
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '3600'))
+COMPRESSIBLE_TYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+}
+MIN_COMPRESS_BYTES = 512
+# Encodings we pre-compress, in order of preference at equal quality
+ENCODINGS = ('br', 'gzip')
+# A content hash in the file name (app.3f9a2b1c.js) or a ?v= query marks a
+# versioned asset, which may be cached for STATIC_MAX_AGE without revalidation
+_VERSIONED_NAME = re.compile(r'\.[0-9a-f]{8,}\.[^./]+$')
+_VERSIONED_QUERY = re.compile(r'(^|&)v=')
+
+
+def parse_accept_encoding(header):
+    """
+    Quality value of each encoding named in an Accept-Encoding header
+
+    Args:
+        header: Accept-Encoding header value
+
+    Returns:
+        Dictionary of lowercased encoding to q-value; 'x-gzip' counts as
+        'gzip' and '*' covers encodings that are not listed
+    """
+    accepted = {}
+    for item in header.split(','):
+        token, *params = [part.strip() for part in item.split(';')]
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        token = token.lower()
+        accepted['gzip' if token == 'x-gzip' else token] = quality
+    return accepted
+
+
+def choose_encoding(header, available):
+    """
+    Best encoding of the available ones that the client accepts
+
+    Args:
+        header: Accept-Encoding header value
+        available: Encodings there is a variant for
+
+    Returns:
+        Encoding name, or None for the uncompressed body
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CachedBody:
+    """A response body with its ETag and pre-compressed variants"""
+
+    def __init__(self, body, media_type):
+        """
+        Initialize cached body
+
+        Args:
+            body: Uncompressed response bytes
+            media_type: Content-Type of the body
+        """
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.variants = {}
+
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body)
+
+    def response(self, request, cache_control='no-cache'):
+        """
+        Build a response, honouring If-None-Match and Accept-Encoding
+
+        Args:
+            request: Incoming request
+            cache_control: Cache-Control header value
+
+        Returns:
+            200 response with the best encoding, or 304 if the client copy is current
+        """
+        headers = {'ETag': self.etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+
+        if_none_match = request.headers.get('if-none-match', '')
+        if self.etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers=headers)
+
+        encoding = choose_encoding(request.headers.get('accept-encoding', ''), self.variants)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+class PageCache:
+    """Templates rendered once at startup; they only depend on a static title"""
+
+    def __init__(self, templates):
+        """
+        Initialize page cache
+
+        Args:
+            templates: Jinja2Templates instance
+        """
+        self.templates = templates
+        self.pages = {}
+
+    def render(self, template_name, **context):
+        """Render a template and keep the result"""
+        html = self.templates.get_template(template_name).render(**context)
+        self.pages[template_name] = CachedBody(html.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def response(self, request, template_name):
+        """Serve a pre-rendered page"""
+        return self.pages[template_name].response(request)
+
+
+class CachedJSONFile:
+    """A JSON file held in memory and re-read only when it is invalidated"""
+
+    def __init__(self, path, check_interval=30.0):
+        """
+        Initialize cached JSON file
+
+        Args:
+            path: Path to the JSON file
+            check_interval: Seconds between mtime checks for external edits
+        """
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._cached = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the cached copy, e.g. after the model was replaced"""
+        with self._lock:
+            self._cached = None
+
+    def _load(self):
+        stat = self.path.stat()
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self._cached = (data, CachedBody(json.dumps(data).encode('utf-8'), 'application/json'))
+        self._mtime = stat.st_mtime
+
+    def get(self):
+        """
+        Return (parsed data, CachedBody), or None if the file does not exist
+
+        The file is stat()ed at most once per check_interval so that edits made
+        outside the API (e.g. from the training notebook) are still picked up.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._cached is not None and now - self._checked_at < self.check_interval:
+                return self._cached
+
+            self._checked_at = now
+            if not self.path.exists():
+                self._cached = None
+                return None
+            if self._cached is None or self.path.stat().st_mtime != self._mtime:
+                self._load()
+            return self._cached
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves text assets from memory, pre-compressed, with Cache-Control
+
+    Only versioned URLs are cached for max_age; the dashboard links its
+    scripts and styles by plain name, so those are revalidated with their
+    ETag on every use and a deploy takes effect at once.
+    """
+
+    def __init__(self, *args, max_age=STATIC_MAX_AGE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+        self._cache = {}
+
+    async def get_response(self, path, scope):
+        request = Request(scope)
+        query = scope.get('query_string', b'').decode('latin-1')
+        if _VERSIONED_NAME.search(path) or _VERSIONED_QUERY.search(query):
+            cache_control = f"public, max-age={self.max_age}"
+        else:
+            cache_control = 'no-cache'
+        full_path, stat_result = self.lookup_path(path)
+        suffix = Path(full_path).suffix.lower() if full_path else ''
+
+        if stat_result is not None and suffix in COMPRESSIBLE_TYPES:
+            key = (stat_result.st_mtime, stat_result.st_size)
+            entry = self._cache.get(full_path)
+            if entry is None or entry[0] != key:
+                with open(full_path, 'rb') as f:
+                    entry = (key, CachedBody(f.read(), COMPRESSIBLE_TYPES[suffix]))
+                self._cache[full_path] = entry
+            return entry[1].response(request, cache_control)
+
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers['Cache-Control'] = cache_control
+        return response
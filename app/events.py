@@ -0,0 +1,76 @@
+"""
+Server-Sent Events for the Cats vs Dogs API
+A single producer publishes status, metrics, dataset and retraining updates;
+each message is serialized once and fanned out to every subscriber
+"""
+
+import json
+import asyncio
+
+
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 64
+
+
+class EventBroadcaster:
+    """Fan-out hub for server-sent events"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.latest = {}
+        self.loop = None
+
+    def bind(self, loop):
+        """Remember the event loop so worker threads can publish into it"""
+        self.loop = loop
+
+    @staticmethod
+    def format(event, data):
+        """Encode one SSE message"""
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    def publish(self, event, data):
+        """
+        Send an event to all subscribers (must be called on the event loop)
+
+        Args:
+            event: Event name
+            data: JSON-serializable payload
+        """
+        message = self.format(event, data)
+        self.latest[event] = message
+
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow client: drop its oldest message rather than block everyone
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def publish_threadsafe(self, event, data):
+        """Publish from a worker thread (e.g. a Keras callback during training)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.publish, event, data)
+
+    async def stream(self, request):
+        """
+        Yield SSE messages for one client until it disconnects
+
+        Args:
+            request: Incoming request, polled for disconnects
+
+        Yields:
+            Encoded SSE messages, starting with the latest value of each event
+        """
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        try:
+            for message in list(self.latest.values()):
+                yield message
+
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.subscribers.discard(queue)
@@ -0,0 +1,83 @@
+"""
+Request Body Size Limits for the Cats vs Dogs API
+Rejects oversized uploads from the Content-Length header, or as soon as a
+streamed body passes the limit, before the form parser spools it to disk
+"""
+
+import json
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware enforcing a maximum request body size per path"""
+
+    def __init__(self, app, limits):
+        """
+        Initialize middleware
+
+        Args:
+            app: The wrapped ASGI application
+            limits: Dictionary mapping request paths to maximum body bytes
+        """
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get('path')) if scope['type'] == 'http' else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope['headers']).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        replaced = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    # Stop reading; the parser sees a disconnect and the app's
+                    # error response is swapped for a 413 below
+                    exceeded = True
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def limited_send(message):
+            nonlocal replaced
+            if exceeded and message['type'] == 'http.response.start':
+                replaced = True
+                await self._reject(send, limit)
+                return
+            if replaced:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except Exception:
+            if not exceeded:
+                raise
+            if not replaced:
+                await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit):
+        body = json.dumps({
+            'detail': f"Request body exceeds {limit / 1024 / 1024:.1f} MB"
+        }).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode()),
+                        (b'connection', b'close')]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -5,32 +5,49 @@ Memory-optimized for Render free tier deployment
 
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
+# oneDNN stays off unless the runtime profile enables it (see src/runtime.py)
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '0')
 
 import sys
 import json
-import shutil
-import gc
+import math
+import hashlib
 import time
-import io
+import asyncio
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional
 import numpy as np
-from PIL import Image
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
-import tensorflow as tf
-from tensorflow.keras.preprocessing.image import img_to_array, load_img
 
-# Configure TensorFlow memory - CRITICAL for Render free tier
-tf.config.set_soft_device_placement(True)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.preprocessing import ImagePreprocessor
+from src.inference_server import DEFAULT_SOCKET, InferenceClient
+from src.ingest import StreamingIngestor
+from src.image_store import ImageStore
+from src.dataset_index import DatasetIndex
+from src.retraining import RETRAIN_MODES, interrupted_run, load_retrain_state
+from src.retrain_scheduler import RetrainScheduler
+from app.caching import CachedJSONFile, CachedStaticFiles, PageCache
+from app.events import EventBroadcaster
+from app.limits import BodySizeLimitMiddleware
+from app.admission import PRIORITIES, AdmissionController, AdmissionRejected, client_key
+from app.profiling import PROFILING_ENABLED, ProfilingMiddleware, RequestProfiler, is_admin
+from src.image_guard import IMAGE_MAX_BYTES, ImageRejected, decode_for_model
+from src.image_ring import DECODE_WORKERS, DecodePipeline
+from src.embedding_index import EmbeddingIndex, EmbeddingIndexer, model_signature
+from src.memory import MemoryManager, normalize_batch
+from src.drift import DriftMonitor, image_features, prediction_features
+from src.active_learning import ReviewBuffer, informativeness
+from src.rollout import (ROLLOUT_AUTO, ACTIVE_STATUSES, active_rollout, apply_decision, evaluate,
+                         load_rollout_state)
 
 # Initialize FastAPI app
 app = FastAPI(title="Cats vs Dogs Classification API", version="1.0.0")
@@ -50,10 +67,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Oversized single-image uploads are refused before the multipart body is read;
+# the allowance on top of the image limit covers the form encoding
+PREDICT_MAX_BODY_BYTES = IMAGE_MAX_BYTES + 64 * 1024
+app.add_middleware(BodySizeLimitMiddleware, limits={
+    '/api/predict': PREDICT_MAX_BODY_BYTES,
+    '/api/embed': PREDICT_MAX_BODY_BYTES,
+    '/api/similar': PREDICT_MAX_BODY_BYTES
+})
+
 # Mount static files and templates
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# Text assets are served from memory, pre-compressed, with ETag and Cache-Control
+app.mount("/static", CachedStaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
+# Pages only depend on their title, so render them once instead of per request
+page_cache = PageCache(templates)
+page_cache.render("index.html", title="Cats vs Dogs Classifier")
+page_cache.render("predict.html", title="Make Prediction")
+page_cache.render("retrain.html", title="Retrain Model")
+page_cache.render("monitoring.html", title="Model Monitoring")
+
 # Paths
 BASE_DIR = Path(__file__).parent.parent
 MODEL_DIR = BASE_DIR / 'models'
@@ -61,57 +95,298 @@ DATA_DIR = BASE_DIR / 'data'
 UPLOAD_DIR = BASE_DIR / 'app' / 'uploads'
 RETRAIN_DATA_DIR = DATA_DIR / 'retrain'
 
+# Model served for predictions; set SERVING_MODEL to e.g. models/student_model.h5
+# to serve a distilled student (retraining still updates cats_dogs_model.h5)
+SERVING_MODEL_PATH = Path(os.getenv('SERVING_MODEL', str(MODEL_DIR / 'cats_dogs_model.h5')))
+
+# metrics.json is kept in memory and only re-read after the model changes
+metrics_file = CachedJSONFile(MODEL_DIR / 'metrics.json')
+
+# Serving mode: 'local' loads the model in this process, 'shared' forwards
+# inference to a single model host (see src/inference_server.py) so that
+# additional API workers do not each hold a copy of the weights
+SERVING_MODE = os.getenv('SERVING_MODE', 'local')
+INFERENCE_SOCKET = DEFAULT_SOCKET
+
+# Profiling is opt-in (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS); when off the
+# middleware is not installed at all. TensorFlow can only be traced in the
+# process running the model.
+profiler = None
+if PROFILING_ENABLED:
+    profiler = RequestProfiler(Path(os.getenv('PROFILE_DIR', str(MODEL_DIR / 'profiles'))))
+    if SERVING_MODE == 'shared':
+        profiler.tf_available = False
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
 # Ensure directories exist
 UPLOAD_DIR.mkdir(exist_ok=True)
-RETRAIN_DATA_DIR.mkdir(exist_ok=True)
-for class_dir in ['cats', 'dogs']:
-    (RETRAIN_DATA_DIR / class_dir).mkdir(parents=True, exist_ok=True)
+RETRAIN_DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# Retraining images live in a content-addressed store; images left in the
+# old data/retrain/<class>/ folders are moved into it on startup
+image_store = ImageStore(RETRAIN_DATA_DIR)
+image_store.migrate_class_directories()
+
+# Dataset statistics are answered from an incrementally maintained index
+# rather than by listing the data directories on every request
+DATASET_INDEX_POLL_SECONDS = float(os.getenv('DATASET_INDEX_POLL_SECONDS', '10'))
+dataset_index = DatasetIndex(
+    DATA_DIR / 'dataset_index.sqlite',
+    {'training': DATA_DIR / 'train', 'testing': DATA_DIR / 'test'},
+    store=image_store
+)
 
 # Global state
 app_state = {
     'model_uptime_start': datetime.now(),
     'total_predictions': 0,
-    'total_retrains': 0,
-    'is_retraining': False,
-    'last_retrain': None
+    'retrain_progress': None,
+    'last_retrain_job': None,
+    'prediction_stats': {'cat': 0, 'dog': 0, 'confidence_sum': 0.0, 'latency_sum': 0.0}
 }
 
-# Model variable
-model = None
+# Resumable retraining checkpoints and the record of the last retrain
+RETRAIN_CHECKPOINT_ROOT = Path(os.getenv('RETRAIN_CHECKPOINT_DIR', str(MODEL_DIR / 'retrain_checkpoints')))
+RETRAIN_STATE_FILE = Path(os.getenv('RETRAIN_STATE_PATH', str(MODEL_DIR / 'retrain_state.json')))
+RETRAIN_RESUME_ON_STARTUP = os.getenv('RETRAIN_RESUME_ON_STARTUP', '1') == '1'
+
+# Upper bound on test-time augmentation views per request
+MAX_TTA_VIEWS = int(os.getenv('MAX_TTA_VIEWS', '10'))
+
+# Backbone embeddings of every labeled image, for similarity search and for
+# answering exact duplicates without inference
+EMBEDDING_INDEX_ROOT = Path(os.getenv('EMBEDDING_INDEX_DIR', str(MODEL_DIR / 'embedding_index')))
+embedding_index = EmbeddingIndex(EMBEDDING_INDEX_ROOT)
+MAX_SIMILAR_RESULTS = 50
+
+# Uncertain uploads (and those whose TTA views disagree) wait here for a
+# label before joining the retraining store
+review_buffer = ReviewBuffer(Path(os.getenv('ACTIVE_LEARNING_DIR', str(DATA_DIR / 'review'))))
+
+# Windowed histograms of upload statistics and model outputs, compared with
+# the training reference from `python -m src.drift reference`; every API
+# worker adds its counts to one shared file, so reports cover all workers
+DRIFT_REFERENCE_FILE = Path(os.getenv('DRIFT_REFERENCE_PATH', str(MODEL_DIR / 'drift_reference.json')))
+DRIFT_SHARED_FILE = Path(os.getenv('DRIFT_SHARED_PATH', str(DATA_DIR / 'drift_windows.sqlite')))
+drift_monitor = DriftMonitor(DRIFT_REFERENCE_FILE, shared_path=DRIFT_SHARED_FILE)
+
+# Bounds requests in inference and rate limits clients (per API worker)
+admission = AdmissionController()
+
+# Server-sent events replace per-tab polling of the status endpoints
+EVENTS_INTERVAL_SECONDS = float(os.getenv('EVENTS_INTERVAL_SECONDS', '2'))
+events = EventBroadcaster()
+
+# Model handles: a local Predictor, or a client for the shared inference server
+predictor = None
+inference_client = None
+preprocessor = ImagePreprocessor(img_size=(224, 224), batch_size=32)
+# With DECODE_WORKERS > 0, uploads are decoded by worker processes into a
+# shared-memory ring and scored in batches straight from it
+decode_pipeline = None
+
+# Replaces a full gc.collect() per request (MEMORY_POLICY=collect restores it)
+# with tuned collector thresholds and an RSS budget check (MEMORY_RSS_BUDGET_MB)
+memory_manager = MemoryManager()
+ingestor = StreamingIngestor(staging_dir=UPLOAD_DIR)
+
+
+def load_local_predictor():
+    """Load the model into this process"""
+    import tensorflow as tf
+    from src.prediction import load_predictor
+    
+    # Configure TensorFlow memory - CRITICAL for Render free tier
+    tf.config.set_soft_device_placement(True)
+    
+    # Clear any existing session
+    tf.keras.backend.clear_session()
+    
+    # PREDICTION_MODE=cascade puts a small model in front of the full one
+    return load_predictor(model_path=str(SERVING_MODEL_PATH))
+
+
+def run_inference(images):
+    """
+    Score a uint8 image batch with whichever backend this process uses
+    
+    Args:
+        images: uint8 array of shape (N, 224, 224, 3)
+        
+    Returns:
+        Tuple of (N dog probabilities, N names of the answering model stage)
+    """
+    if inference_client is not None:
+        return inference_client.predict_staged(images)
+    return predictor.predict_staged(normalize_batch(images))
+
+
+def run_embedding(images):
+    """
+    Probabilities and backbone embeddings for a uint8 image batch
+    
+    Returns:
+        Tuple of (N probabilities, (N, D) embeddings)
+    """
+    if inference_client is not None:
+        return inference_client.predict_with_embeddings(images)
+    return predictor.predict_with_embeddings(normalize_batch(images))
+
+
+def serving_signature():
+    """Version of the serving model file, used to validate cached probabilities"""
+    return model_signature(SERVING_MODEL_PATH)
+
+
+# New store images are embedded by whichever worker holds the index's writer lock
+embedding_indexer = EmbeddingIndexer(embedding_index, image_store, run_embedding, serving_signature)
+
+
+def run_tta_inference(images, views):
+    """
+    Score a uint8 image batch with test-time augmentation
+    
+    Args:
+        images: uint8 array of shape (N, 224, 224, 3)
+        views: Number of augmented views per image
+        
+    Returns:
+        Tuple of (N averaged probabilities, (N, views) per-view probabilities)
+    """
+    if inference_client is not None:
+        return inference_client.predict_tta(images, views)
+    return predictor.predict_tta(normalize_batch(images), views)
+
 
 # Load model on startup
 @app.on_event("startup")
 async def startup_event():
     """Load model with memory optimization"""
-    global model
+    global predictor, inference_client, decode_pipeline
+    
+    memory_manager.configure()
+    dataset_index.start_watcher(interval=DATASET_INDEX_POLL_SECONDS)
+    drift_monitor.start()
+    events.bind(asyncio.get_running_loop())
+    asyncio.create_task(publish_updates())
+    if profiler is not None:
+        profiler.start()
+    
+    # One worker runs retraining jobs (and resumes an interrupted one)
+    retrain_scheduler.start()
+    
+    if DECODE_WORKERS > 0:
+        decode_pipeline = DecodePipeline(run_inference, workers=DECODE_WORKERS,
+                                         observe_fn=drift_monitor.observe)
+        print(f"Decoding uploads in {DECODE_WORKERS} worker processes")
+    
+    if SERVING_MODE == 'shared':
+        inference_client = InferenceClient(address=INFERENCE_SOCKET)
+        print(f"Forwarding inference to shared model server at {INFERENCE_SOCKET}")
+        embedding_indexer.start()
+        memory_manager.settle()
+        return
     
-    model_path = MODEL_DIR / 'cats_dogs_model.h5'
+    model_path = SERVING_MODEL_PATH
     
     if model_path.exists():
         try:
-            # Clear any existing session
-            tf.keras.backend.clear_session()
-            gc.collect()
-            
-            # Load model without compiling
-            model = tf.keras.models.load_model(str(model_path), compile=False)
-            
-            # Recompile with minimal optimizer
-            model.compile(
-                optimizer='adam',
-                loss='binary_crossentropy',
-                metrics=['accuracy']
-            )
-            
+            predictor = load_local_predictor()
+            memory_manager.settle()
             print(f"Model loaded successfully from {model_path}")
             print(f"Memory optimized for deployment")
+            embedding_indexer.start()
         except Exception as e:
             print(f"Error loading model: {e}")
-            model = None
+            predictor = None
     else:
         print(f"Model file not found at {model_path}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background worker pools"""
+    retrain_scheduler.stop()
+    embedding_indexer.stop()
+    ingestor.shutdown()
+    dataset_index.close()
+    drift_monitor.stop()
+    if profiler is not None:
+        profiler.stop()
+    if decode_pipeline is not None:
+        decode_pipeline.close()
+
+
+def prediction_summary():
+    """Aggregate prediction counters into the published statistics"""
+    stats = app_state['prediction_stats']
+    total = stats['cat'] + stats['dog']
+    return {
+        'total_predictions': total,
+        'cats_predicted': stats['cat'],
+        'dogs_predicted': stats['dog'],
+        'average_confidence': stats['confidence_sum'] / total if total else None,
+        'average_latency': stats['latency_sum'] / total if total else None
+    }
+
+
+async def publish_updates():
+    """
+    Single producer for server-sent events
+    
+    Each payload is computed once per interval and published only when it
+    changed, however many dashboards are subscribed.
+    """
+    last = {}
+    
+    while True:
+        try:
+            if not retrain_scheduler.leader:
+                await run_in_threadpool(follow_retrain_jobs)
+            await run_in_threadpool(follow_rollout)
+            status = {
+                'model_loaded': await run_in_threadpool(is_model_loaded),
+                'total_predictions': app_state['total_predictions'],
+                **retrain_overview()
+            }
+            cached_metrics = metrics_file.get()
+            updates = {
+                'status': status,
+                'predictions': prediction_summary(),
+                'metrics': cached_metrics[0] if cached_metrics else None,
+                'dataset': {
+                    'training': dataset_index.statistics('training'),
+                    'testing': dataset_index.statistics('testing'),
+                    'retraining': dataset_index.statistics('retraining')
+                },
+                # Merging the workers' histograms reads a shared SQLite file
+                'drift': await run_in_threadpool(drift_monitor.snapshot)
+            }
+            
+            for event, data in updates.items():
+                if data is not None and last.get(event) != data:
+                    last[event] = data
+                    if event == 'status':
+                        data = dict(data, uptime=get_uptime(),
+                                    uptime_seconds=(datetime.now() - app_state['model_uptime_start']).total_seconds())
+                    events.publish(event, data)
+        except Exception as e:
+            print(f"Error publishing updates: {e}")
+        
+        await asyncio.sleep(EVENTS_INTERVAL_SECONDS)
+
+
+def is_model_loaded():
+    """Check whether a model is available for inference"""
+    if inference_client is not None:
+        try:
+            inference_client.ping()
+            return True
+        except Exception:
+            return False
+    return predictor is not None
+
+
 # Pydantic models
 class PredictionResponse(BaseModel):
     predicted_class: str
@@ -147,284 +422,688 @@ def get_uptime():
     return f"{hours}h {minutes}m {seconds}s"
 
 
-def save_uploaded_file(upload_file: UploadFile, destination: Path):
-    """Save uploaded file to disk"""
-    with open(destination, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
-
-
 # Routes
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Render home page"""
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "title": "Cats vs Dogs Classifier"
-    })
+    return page_cache.response(request, "index.html")
 
 
 @app.get("/predict-page", response_class=HTMLResponse)
 async def predict_page(request: Request):
     """Render prediction page"""
-    return templates.TemplateResponse("predict.html", {
-        "request": request,
-        "title": "Make Prediction"
-    })
+    return page_cache.response(request, "predict.html")
 
 
 @app.get("/retrain-page", response_class=HTMLResponse)
 async def retrain_page(request: Request):
     """Render retraining page"""
-    return templates.TemplateResponse("retrain.html", {
-        "request": request,
-        "title": "Retrain Model"
-    })
+    return page_cache.response(request, "retrain.html")
 
 
 @app.get("/monitoring", response_class=HTMLResponse)
 async def monitoring_page(request: Request):
     """Render monitoring page"""
-    return templates.TemplateResponse("monitoring.html", {
-        "request": request,
-        "title": "Model Monitoring"
-    })
+    return page_cache.response(request, "monitoring.html")
 
 
 @app.get("/api/status", response_model=StatusResponse)
 async def get_status():
     """Get API status and uptime"""
+    overview = retrain_overview()
     return StatusResponse(
         status="running",
-        model_loaded=predictor is not None,
+        model_loaded=is_model_loaded(),
         uptime=get_uptime(),
         total_predictions=app_state['total_predictions'],
-        total_retrains=app_state['total_retrains'],
-        is_retraining=app_state['is_retraining']
+        total_retrains=overview['total_retrains'],
+        is_retraining=overview['is_retraining']
     )
 
 
 @app.get("/api/metrics")
-async def get_metrics():
+async def get_metrics(request: Request):
     """Get model performance metrics"""
-    metrics_path = MODEL_DIR / 'metrics.json'
+    cached = metrics_file.get()
     
-    if not metrics_path.exists():
+    if cached is None:
         raise HTTPException(status_code=404, detail="Metrics not found")
     
-    with open(metrics_path, 'r') as f:
-        metrics = json.load(f)
+    return cached[1].response(request)
+
+
+@app.get("/api/cascade-stats")
+async def get_cascade_stats():
+    """
+    Per-stage traffic and latency of the cascade, with the offline
+    per-threshold accuracy report from `python -m src.cascade evaluate`
+    """
+    if inference_client is not None:
+        try:
+            live = (await run_in_threadpool(inference_client.ping)).get('cascade')
+        except ConnectionError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    else:
+        live = predictor.stage_statistics() if hasattr(predictor, 'stage_statistics') else None
+    
+    if live is None:
+        raise HTTPException(status_code=404, detail="Cascade mode is not enabled")
+    
+    report_path = MODEL_DIR / 'cascade_report.json'
+    report = None
+    if report_path.exists():
+        with open(report_path, 'r') as f:
+            report = json.load(f)
     
-    return metrics
+    return {"live": live, "evaluation": report}
+
+
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """
+    Server-sent event stream
+    
+    Events: status, predictions, metrics, dataset, drift and retrain
+    (per-batch and per-epoch loss, accuracy and ETA while a retrain is running).
+    """
+    return StreamingResponse(
+        events.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/dataset-stats")
 async def get_dataset_stats():
     """Get dataset statistics"""
-    train_stats = get_dataset_statistics(DATA_DIR / 'train')
-    test_stats = get_dataset_statistics(DATA_DIR / 'test')
-    
-    # Check retrain data
-    retrain_stats = {}
-    if RETRAIN_DATA_DIR.exists():
-        retrain_stats = get_dataset_statistics(RETRAIN_DATA_DIR)
-    
     return {
-        "training": train_stats,
-        "testing": test_stats,
-        "retraining": retrain_stats
+        "training": dataset_index.statistics('training'),
+        "testing": dataset_index.statistics('testing'),
+        "retraining": dataset_index.statistics('retraining')
     }
 
 
+@app.get("/api/dataset-stats/details")
+async def get_dataset_stats_details():
+    """Get image size, aspect ratio and class balance statistics"""
+    return dataset_index.detailed_statistics()
+
+
 @app.post("/api/predict")
-async def predict_image(file: UploadFile = File(...)):
-    """Predict class for uploaded image"""
-    global model
+async def predict_image(request: Request, file: UploadFile = File(...), tta_views: int = 0):
+    """
+    Predict class for uploaded image
+    
+    With tta_views > 1 the prediction averages that many flipped, cropped and
+    rescaled views (up to MAX_TTA_VIEWS), scored together in one batch.
     
-    if model is None:
+    The X-Priority header ('interactive' or 'bulk') and X-Request-Deadline-Ms
+    header select the admission class and time budget; requests over the
+    client's rate get 429 and requests that cannot be served in time get 503,
+    both with Retry-After.
+    """
+    if predictor is None and inference_client is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     # Validate file type
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    priority, deadline = admission_options(request)
+    
+    start_time = time.time()
+    contents = await file.read()
+    
+    digest = hashlib.sha256(contents).hexdigest()
+    # Index reads take its lock and read newly appended rows; keep them off the loop
+    known = await run_in_threadpool(embedding_index.lookup, digest) if tta_views <= 1 else None
     try:
-        start_time = time.time()
-        
-        # Read and preprocess image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert('RGB')
-        image = image.resize((224, 224))  # VGG16 input size
-        
-        # Convert to array and normalize
-        img_array = img_to_array(image)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0  # Normalize to [0, 1]
-        
-        # Make prediction
-        prediction = model.predict(img_array, verbose=0)[0][0]
-        
-        # Determine class
-        predicted_class = "dog" if prediction > 0.5 else "cat"
-        confidence = prediction if prediction > 0.5 else 1 - prediction
+        async with admission.admit(client_key(request), priority, deadline) as ticket:
+            # An upload identical to an indexed image reuses the probability
+            # cached for the serving model instead of running inference; it
+            # still counts against the client's rate and the drift statistics,
+            # but not towards the model's measured service time
+            if known is not None and known['model'] == serving_signature():
+                ticket['record'] = False
+                await observe_upload(contents)
+                result = record_prediction(known['probability'], 'duplicate', start_time)
+                result['duplicate_of'] = {'id': digest, 'label': known['label']}
+                return result
+            result = await classify_image(contents, tta_views, start_time)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    
+    if known is not None:
+        # Cached probability was from an older model; keep the fresh one
+        await run_in_threadpool(embedding_index.update_prediction, digest,
+                                result['probability'], serving_signature())
+    
+    score = informativeness(result['probability'], result.get('tta', {}).get('agreement'))
+    if review_buffer.wants(score):
+        # Written in the background; the response does not wait for the disk
+        asyncio.get_running_loop().run_in_executor(
+            None, buffer_for_review, contents, digest, result, score
+        )
+    return result
+
+
+def buffer_for_review(contents, digest, result, score):
+    """Offer a prediction's upload to the active-learning review buffer"""
+    try:
+        review_buffer.add(contents, digest, result['probability'], score, image_store,
+                          predicted_class=result['predicted_class'], stage=result['stage'],
+                          tta_agreement=result.get('tta', {}).get('agreement'))
+    except Exception as e:
+        print(f"Error buffering upload for review: {e}")
+
+
+def admission_options(request):
+    """Priority class and deadline (seconds or None) from the request headers"""
+    priority = request.headers.get('x-priority', 'interactive').lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"X-Priority must be one of {list(PRIORITIES)}")
+    deadline = request.headers.get('x-request-deadline-ms')
+    try:
+        deadline = float(deadline) / 1000 if deadline is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Deadline-Ms must be a number")
+    return priority, deadline
+
+
+def admission_error(e):
+    """HTTP error for a request refused by admission control"""
+    return HTTPException(status_code=e.status_code, detail=str(e),
+                         headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))})
+
+
+async def embed_upload(request, file):
+    """
+    Decode an uploaded image and compute its probability and embedding
+    
+    Returns:
+        Tuple of (probability, (D,) embedding)
+    """
+    if predictor is None and inference_client is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    priority, deadline = admission_options(request)
+    contents = await file.read()
+    try:
+        async with admission.admit(client_key(request), priority, deadline):
+            image = await run_in_threadpool(decode_for_model, contents, (224, 224))
+            probabilities, embeddings = await run_in_threadpool(
+                run_embedding, np.expand_dims(np.asarray(image, dtype=np.uint8), axis=0)
+            )
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return float(probabilities[0]), embeddings[0]
+
+
+@app.post("/api/embed")
+async def embed_image(request: Request, file: UploadFile = File(...)):
+    """Backbone embedding (the pooled features the classifier head starts from) of an image"""
+    probability, embedding = await embed_upload(request, file)
+    return {
+        "embedding": [float(value) for value in embedding],
+        "dim": len(embedding),
+        "probability": probability
+    }
+
+
+@app.post("/api/similar")
+async def similar_images(request: Request, file: UploadFile = File(...), k: int = 5):
+    """Nearest training and retraining images to an uploaded image"""
+    probability, embedding = await embed_upload(request, file)
+    k = max(1, min(k, MAX_SIMILAR_RESULTS))
+    neighbours = await run_in_threadpool(embedding_index.search, embedding[None], k)
+    index_size = await run_in_threadpool(len, embedding_index)
+    return {
+        "probability": probability,
+        "neighbours": neighbours[0],
+        "index_size": index_size
+    }
+
+
+@app.get("/api/embedding-index")
+async def get_embedding_index():
+    """Size, storage format and label counts of the embedding index"""
+    return await run_in_threadpool(embedding_index.statistics)
+
+
+async def observe_upload(contents):
+    """Record the drift features of an upload that is answered without inference"""
+    try:
+        image = await run_in_threadpool(decode_for_model, contents, (224, 224))
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    drift_monitor.observe(image_features(*image.info['source_size'],
+                                         np.asarray(image, dtype=np.uint8)))
+
+
+async def classify_image(contents, tta_views, start_time):
+    """Decode an uploaded image and score it; runs while holding an admission slot"""
+    if decode_pipeline is not None and tta_views <= 1:
+        try:
+            # submit() may wait for a free ring slot, so keep it off the loop
+            future = await run_in_threadpool(decode_pipeline.submit, contents)
+            probability, stage = await asyncio.wrap_future(future)
+        except ImageRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        memory_manager.after_request()
+        return record_prediction(probability, stage, start_time)
+    
+    try:
+        # Header checks reject bombs and oversized images before decoding;
+        # the decode itself runs off the event loop at reduced JPEG scale
+        image = await run_in_threadpool(decode_for_model, contents, (224, 224))
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    try:
+        # Convert to a uint8 batch; normalization happens next to the model
+        img_array = np.expand_dims(np.asarray(image, dtype=np.uint8), axis=0)
+        drift_monitor.observe(image_features(*image.info['source_size'], img_array[0]))
         
-        result = {
-            "predicted_class": predicted_class,
-            "confidence": float(confidence),
-            "confidence_percentage": f"{confidence * 100:.2f}%",
-            "probability": float(prediction),
-            "prediction_time": time.time() - start_time,
-            "timestamp": datetime.now().isoformat(),
-            "is_valid": True
-        }
+        # Make prediction off the event loop so other requests keep flowing
+        tta = None
+        if tta_views > 1:
+            views = min(tta_views, MAX_TTA_VIEWS)
+            probabilities, view_probabilities = await run_in_threadpool(
+                run_tta_inference, img_array, views
+            )
+            view_probabilities = [float(p) for p in view_probabilities[0]]
+            stages = ['tta']
+            tta = {
+                "views": views,
+                "view_probabilities": view_probabilities,
+                "agreement": float(np.mean(
+                    [(p > 0.5) == (probabilities[0] > 0.5) for p in view_probabilities]
+                ))
+            }
+        else:
+            probabilities, stages = await run_in_threadpool(run_inference, img_array)
         
-        # Update stats
-        app_state['total_predictions'] += 1
+        result = record_prediction(float(probabilities[0]), stages[0], start_time)
+        if tta is not None:
+            result["tta"] = tta
         
-        # Clear memory
         del img_array, image
-        gc.collect()
+        memory_manager.after_request()
         
         return result
         
     except Exception as e:
-        gc.collect()
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+def record_prediction(prediction, stage, start_time):
+    """Build the response for a dog probability and update the prediction stats"""
+    # Determine class
+    predicted_class = "dog" if prediction > 0.5 else "cat"
+    confidence = prediction if prediction > 0.5 else 1 - prediction
+    
+    result = {
+        "predicted_class": predicted_class,
+        "confidence": float(confidence),
+        "confidence_percentage": f"{confidence * 100:.2f}%",
+        "probability": float(prediction),
+        "prediction_time": time.time() - start_time,
+        "timestamp": datetime.now().isoformat(),
+        "stage": stage,
+        "is_valid": True
+    }
+    
+    # Update stats
+    app_state['total_predictions'] += 1
+    stats = app_state['prediction_stats']
+    stats[predicted_class] += 1
+    stats['confidence_sum'] += float(confidence)
+    stats['latency_sum'] += result['prediction_time']
+    drift_monitor.observe(prediction_features(float(prediction)))
+    return result
+
+
 @app.post("/api/upload-training-data")
-async def upload_training_data(
-    files: List[UploadFile] = File(...),
-    class_name: str = "cats"
-):
-    """Upload multiple images for retraining"""
+async def upload_training_data(request: Request, class_name: str = "cats"):
+    """
+    Upload multiple images (or .zip/.tar archives of images) for retraining
+    
+    The multipart body is consumed as a stream: each part is written to disk
+    as it arrives, then validated, de-duplicated by content hash and resized
+    in a background worker pool, so memory use does not grow with upload size.
+    """
     if class_name not in ['cats', 'dogs']:
         raise HTTPException(status_code=400, detail="Class must be 'cats' or 'dogs'")
     
-    # Create class directory
-    class_dir = RETRAIN_DATA_DIR / class_name
-    class_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        result = await ingestor.ingest(request, image_store, class_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    saved_files = []
-    errors = []
+    await run_in_threadpool(dataset_index.sync_store)
+    embedding_indexer.request_sync()
     
-    for file in files:
-        if not file.content_type.startswith('image/'):
-            errors.append(f"{file.filename}: Not an image")
-            continue
-        
+    result["class"] = class_name
+    return result
+
+
+@app.get("/api/review-queue")
+async def get_review_queue(limit: int = 50):
+    """
+    Uploads awaiting a label, most informative first
+    
+    Informativeness is 1 - |2p - 1| (or the TTA views' disagreement, if
+    higher), halved every ACTIVE_LEARNING_HALF_LIFE_HOURS of age.
+    """
+    items = await run_in_threadpool(review_buffer.pending, max(1, min(limit, 200)))
+    for item in items:
+        item['image_url'] = f"/api/review-queue/{item['id']}/image"
+    return dict(await run_in_threadpool(review_buffer.statistics), items=items)
+
+
+@app.get("/api/review-queue/{item_id}/image")
+async def get_review_image(item_id: str):
+    """Buffered image awaiting review"""
+    path = await run_in_threadpool(review_buffer.image_path, item_id)
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="Image not in the review queue")
+    return FileResponse(path)
+
+
+@app.post("/api/review-queue/{item_id}")
+async def label_review_item(item_id: str, label: str):
+    """
+    Label a buffered upload ('cats' or 'dogs') into the retraining store, or
+    discard it ('skip')
+    """
+    try:
+        outcome = await run_in_threadpool(review_buffer.label, item_id, label, image_store)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image not in the review queue")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if outcome == 'stored':
+        await run_in_threadpool(dataset_index.sync_store)
+        embedding_indexer.request_sync()
+    return {"id": item_id, "label": label, "outcome": outcome}
+
+
+def report_retrain_progress(progress):
+    """Publish retraining progress from the training thread"""
+    progress = dict(progress, timestamp=datetime.now().isoformat())
+    app_state['retrain_progress'] = progress
+    events.publish_threadsafe('retrain', progress)
+
+
+def reload_serving_model():
+    """Serve the model a retraining job just wrote"""
+    global predictor
+    
+    if inference_client is not None:
+        inference_client.reload()
+    else:
+        predictor = load_local_predictor()
+    metrics_file.invalidate()
+    memory_manager.settle()
+
+
+def retrain_job_finished(job):
+    """Scheduler callback (leader worker): swap in the new model and report the outcome"""
+    app_state['last_retrain_job'] = job['id']
+    
+    if job['status'] == 'completed':
+        reload_serving_model()
+        print("Model retraining completed successfully")
+        report_retrain_progress({'stage': 'completed', 'summary': job['summary']})
+    elif job['status'] == 'skipped':
+        report_retrain_progress({'stage': 'completed', 'summary': None})
+    else:
+        print(f"Error during retraining: {job.get('error')}")
+        report_retrain_progress({'stage': 'failed', 'error': job.get('error')})
+
+
+def follow_retrain_jobs():
+    """
+    Mirror the leader worker's retraining jobs in this worker
+    
+    Relays progress to this worker's event subscribers and, in local
+    serving mode, reloads the model once a job completes.
+    """
+    jobs = retrain_scheduler.snapshot()
+    
+    running = jobs['running']
+    if running and running.get('progress') and running['progress'] != app_state['retrain_progress']:
+        app_state['retrain_progress'] = running['progress']
+        events.publish('retrain', running['progress'])
+    
+    latest = jobs['history'][0] if jobs['history'] else None
+    if latest is None or latest['id'] == app_state['last_retrain_job']:
+        return
+    if app_state['last_retrain_job'] is None:
+        # Jobs that finished before this worker started need no reload
+        app_state['last_retrain_job'] = latest['id']
+        return
+    
+    app_state['last_retrain_job'] = latest['id']
+    if latest['status'] == 'completed' and inference_client is None:
+        reload_serving_model()
+    if latest['status'] == 'failed':
+        progress = {'stage': 'failed', 'error': latest.get('error')}
+    else:
+        progress = {'stage': 'completed', 'summary': latest.get('summary')}
+    app_state['retrain_progress'] = dict(progress, timestamp=datetime.now().isoformat())
+    events.publish('retrain', app_state['retrain_progress'])
+
+
+def rollout_statistics():
+    """Live candidate comparison from whichever process serves the model, or None"""
+    if inference_client is not None:
         try:
-            # Save file
-            file_path = class_dir / file.filename
-            save_uploaded_file(file, file_path)
-            saved_files.append(file.filename)
-        except Exception as e:
-            errors.append(f"{file.filename}: {str(e)}")
+            return inference_client.ping().get('rollout')
+        except ConnectionError:
+            return None
+    if hasattr(predictor, 'rollout_statistics'):
+        return predictor.rollout_statistics()
+    return None
+
+
+def follow_rollout():
+    """
+    Judge the candidate model from its live statistics, and keep this
+    worker's model in line with the rollout record
+    
+    Every worker may judge; the record only changes once per step.
+    """
+    state = active_rollout(SERVING_MODEL_PATH)
+    stats = rollout_statistics() if state is not None else None
+    if ROLLOUT_AUTO and stats is not None and stats['id'] == state['id'] \
+            and stats['step'] == state['step']:
+        decision, reasons = evaluate(stats)
+        if decision != 'hold':
+            status = apply_decision(SERVING_MODEL_PATH, state['id'], state['step'],
+                                    decision, stats, reasons)
+            if status in ('promoted', 'rejected'):
+                reload_serving_model()
+                return
     
+    # A local model that no longer matches the record (candidate promoted,
+    # rejected or started by another worker) is reloaded
+    if inference_client is None and predictor is not None:
+        state = active_rollout(SERVING_MODEL_PATH)
+        expected = state['id'] if state is not None else None
+        if getattr(predictor, 'rollout_id', None) != expected:
+            reload_serving_model()
+
+
+def retrain_overview():
+    """Retraining counters for the status endpoints, from the shared job history"""
+    jobs = retrain_scheduler.snapshot()
+    completed = [job for job in jobs['history'] if job['status'] == 'completed']
     return {
-        "uploaded": len(saved_files),
-        "files": saved_files,
-        "errors": errors,
-        "class": class_name
+        'is_retraining': jobs['running'] is not None,
+        'total_retrains': len(completed),
+        'last_retrain': completed[0]['finished_at'] if completed else None
     }
 
 
-async def retrain_model_task():
-    """Background task to retrain model"""
-    global predictor, app_state
-    
-    try:
-        app_state['is_retraining'] = True
-        print("Starting model retraining...")
-        
-        # Clear memory before retraining
-        tf.keras.backend.clear_session()
-        gc.collect()
-        
-        # Check if retrain data exists
-        if not RETRAIN_DATA_DIR.exists() or not any(RETRAIN_DATA_DIR.iterdir()):
-            print("No retraining data available")
-            return
-        
-        # Initialize model
-        model_trainer = CatsDogsModel(img_size=(224, 224), learning_rate=0.0001)
-        
-        # Create data generators
-        train_gen, val_gen = preprocessor.create_data_generators(
-            str(RETRAIN_DATA_DIR),
-            validation_split=0.2
-        )
-        
-        # Load pretrained model and retrain
-        pretrained_path = MODEL_DIR / 'cats_dogs_model.h5'
-        
-        if pretrained_path.exists():
-            history = model_trainer.retrain(
-                train_gen, val_gen,
-                str(pretrained_path),
-                epochs=15,
-                model_save_path=str(MODEL_DIR / 'retrained_model.h5')
-            )
-        else:
-            # Train from scratch if no pretrained model
-            model_trainer.build_model(use_pretrained=True)
-            history = model_trainer.train(
-                train_gen, val_gen,
-                epochs=15,
-                model_save_path=str(MODEL_DIR / 'retrained_model.h5')
-            )
-        
-        # Replace current model with retrained one
-        shutil.copy(
-            MODEL_DIR / 'retrained_model.h5',
-            MODEL_DIR / 'cats_dogs_model.h5'
-        )
-        
-        # Clear session and reload predictor
-        tf.keras.backend.clear_session()
-        gc.collect()
-        predictor = Predictor(model_path=str(MODEL_DIR / 'cats_dogs_model.h5'))
-        
-        # Update state
-        app_state['total_retrains'] += 1
-        app_state['last_retrain'] = datetime.now().isoformat()
-        
-        print("Model retraining completed successfully")
-        
-        # Final cleanup
-        gc.collect()
-        
-    except Exception as e:
-        print(f"Error during retraining: {e}")
-        gc.collect()
-    finally:
-        app_state['is_retraining'] = False
+retrain_scheduler = RetrainScheduler(
+    image_store,
+    model_path=MODEL_DIR / 'cats_dogs_model.h5',
+    output_path=MODEL_DIR / 'retrained_model.h5',
+    state_dir=MODEL_DIR,
+    checkpoint_root=RETRAIN_CHECKPOINT_ROOT,
+    retrain_state_path=RETRAIN_STATE_FILE,
+    on_progress=report_retrain_progress,
+    on_finish=retrain_job_finished,
+    serving_count=lambda: app_state['total_predictions'],
+    resume_interrupted=RETRAIN_RESUME_ON_STARTUP
+)
 
 
 @app.post("/api/retrain")
-async def trigger_retrain(background_tasks: BackgroundTasks):
-    """Trigger model retraining"""
-    if app_state['is_retraining']:
-        raise HTTPException(status_code=409, detail="Retraining already in progress")
+async def trigger_retrain(mode: Optional[str] = None):
+    """
+    Queue a model retrain
+    
+    mode is 'full', 'incremental' (new images plus a replay sample) or
+    'auto'; it defaults to RETRAIN_MODE. A request made while a job is
+    still queued is merged into it instead of starting another run.
+    """
+    if mode is not None and mode not in RETRAIN_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRAIN_MODES)}")
+    
+    job = retrain_scheduler.request(mode, reason='on_demand')
     
-    # Add retraining task to background
-    background_tasks.add_task(retrain_model_task)
+    # Replace the previous run's final event before anyone subscribes
+    app_state['retrain_progress'] = {'stage': 'queued', 'timestamp': datetime.now().isoformat()}
+    events.publish('retrain', app_state['retrain_progress'])
     
     return {
-        "message": "Retraining started",
-        "status": "processing"
+        "message": "Retraining merged into queued job" if job.get('coalesced') else "Retraining queued",
+        "status": job['status'],
+        "job": job
     }
 
 
 @app.get("/api/retrain-status")
 async def get_retrain_status():
     """Get retraining status"""
+    jobs = retrain_scheduler.snapshot()
+    running = jobs['running']
+    return {
+        **retrain_overview(),
+        "progress": (running or {}).get('progress') or app_state['retrain_progress'],
+        "queued": len(jobs['queue']),
+        "last_run": load_retrain_state(RETRAIN_STATE_FILE),
+        "interrupted_run": interrupted_run(RETRAIN_CHECKPOINT_ROOT)
+    }
+
+
+@app.get("/api/retrain-jobs")
+async def get_retrain_jobs():
+    """Running job, queue and history of retraining jobs with their durations"""
+    return retrain_scheduler.snapshot()
+
+
+@app.get("/api/drift")
+async def get_drift(histograms: bool = False):
+    """
+    Drift of the current and recent windows against the training reference
+    
+    Per feature: PSI, binned KS statistic and p-value, window and reference
+    means; histograms=true adds the bin edges and counts.
+    """
+    return await run_in_threadpool(drift_monitor.snapshot, histograms=histograms)
+
+
+@app.get("/api/rollout")
+async def get_rollout():
+    """
+    Candidate model rollout: the record (status, canary percentage, step
+    history) and the live comparison with the serving model
+    """
+    state = await run_in_threadpool(load_rollout_state, SERVING_MODEL_PATH)
+    if not state:
+        raise HTTPException(status_code=404, detail="No candidate model has been rolled out")
+    live = await run_in_threadpool(rollout_statistics) if state['status'] in ACTIVE_STATUSES else None
     return {
-        "is_retraining": app_state['is_retraining'],
-        "total_retrains": app_state['total_retrains'],
-        "last_retrain": app_state['last_retrain']
+        "rollout": state,
+        "live": live,
+        "evaluation": dict(zip(('decision', 'reasons'), evaluate(live))) if live else None,
+        "automatic": ROLLOUT_AUTO
     }
 
 
+@app.post("/api/rollout/{action}")
+async def change_rollout(action: str, percent: Optional[int] = None):
+    """
+    Override the rollout: 'canary' (with ?percent=), 'promote' or 'reject'
+    """
+    if action not in ('canary', 'promote', 'reject'):
+        raise HTTPException(status_code=404, detail="Action must be canary, promote or reject")
+    if action == 'canary' and (percent is None or not 0 <= percent <= 100):
+        raise HTTPException(status_code=400, detail="percent must be between 0 and 100")
+    
+    state = await run_in_threadpool(active_rollout, SERVING_MODEL_PATH)
+    if state is None:
+        raise HTTPException(status_code=409, detail="No candidate model is being rolled out")
+    live = await run_in_threadpool(rollout_statistics)
+    status = await run_in_threadpool(
+        apply_decision, SERVING_MODEL_PATH, state['id'], state['step'], action, live,
+        ['manual'], percent
+    )
+    if status is None:
+        raise HTTPException(status_code=409, detail="Rollout changed; reload and retry")
+    if status in ('promoted', 'rejected'):
+        await run_in_threadpool(reload_serving_model)
+    return {"id": state['id'], "status": status}
+
+
+def require_profiles(request: Request):
+    """Profiles must be enabled and the caller an administrator"""
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not is_admin(request.headers, request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/api/profiles")
+async def list_profiles(request: Request):
+    """Stored request profiles, newest first, with their metadata"""
+    require_profiles(request)
+    return {"profiles": await run_in_threadpool(profiler.list)}
+
+
+@app.get("/api/profiles/{profile_id}")
+async def download_profile(profile_id: str, request: Request):
+    """A stored profile (meta.json, stacks.folded, TensorFlow trace) as .tar.gz"""
+    require_profiles(request)
+    archive = await run_in_threadpool(profiler.archive, profile_id)
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(archive, media_type="application/gzip",
+                    headers={"Content-Disposition": f'attachment; filename="{profile_id}.tar.gz"'})
+
+
+@app.get("/api/memory")
+async def get_memory():
+    """Memory policy, RSS against the budget, collector state and reclaim counters"""
+    return memory_manager.snapshot()
+
+
+@app.get("/api/admission")
+async def get_admission():
+    """In-flight limit, measured throughput, queue and rejection counters"""
+    return admission.snapshot()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,384 @@
+"""
+Opt-in Request Profiling for the Cats vs Dogs API
+Captures where a slow or sampled request spent its time: a sampled Python
+stack profile of every busy thread (event loop, thread pool, batching
+threads), garbage collection pauses, event-loop lag and, for sampled
+requests, a TensorFlow profiler trace. Profiles are written with the
+request's metadata to a bounded directory. Nothing here is installed unless
+PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set.
+"""
+
+import io
+import os
+import gc
+import sys
+import hmac
+import json
+import time
+import random
+import shutil
+import asyncio
+import tarfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import Counter, deque
+
+
+# Fraction of requests profiled in full, TensorFlow trace included
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+# Requests slower than this keep their stack profile (0 disables)
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '0'))
+PROFILE_PATHS = tuple(os.getenv('PROFILE_PATHS', '/api/predict').split(','))
+PROFILE_MAX_ENTRIES = int(os.getenv('PROFILE_MAX_ENTRIES', '50'))
+PROFILE_MAX_BYTES = int(float(os.getenv('PROFILE_MAX_MB', '200')) * 1024 * 1024)
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_TF_TRACE = os.getenv('PROFILE_TF_TRACE', '1') == '1'
+# Required in the X-Admin-Token header of the profile endpoints; when unset
+# they only answer requests from this machine
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+# Seconds of stack samples, GC pauses and loop lag kept for slow requests
+_HISTORY_SECONDS = 120
+# Top frames of threads that are waiting rather than working
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('selectors.py', 'select'), ('thread.py', '_worker'),
+    ('queue.py', 'get'), ('connection.py', '_recv'), ('connection.py', 'accept'),
+}
+
+
+def is_admin(headers, client_host):
+    """
+    Whether a request may read profiles
+
+    Args:
+        headers: Request headers
+        client_host: Address of the client
+
+    Returns:
+        True with the right X-Admin-Token, or from this machine when no
+        token is configured
+    """
+    if PROFILE_ADMIN_TOKEN:
+        return hmac.compare_digest(headers.get('x-admin-token', ''), PROFILE_ADMIN_TOKEN)
+    return client_host in ('127.0.0.1', '::1')
+
+
+class RequestProfiler:
+    """
+    Continuous low-rate stack sampler and per-request profile writer
+
+    While any profiled path is in flight, a thread records the stacks of all
+    non-idle threads every PROFILE_INTERVAL_MS. A request's profile is the
+    samples taken between its start and end, so it also shows what other
+    requests were doing at the time, which is what contention looks like.
+    """
+
+    def __init__(self, root, sample_rate=PROFILE_SAMPLE_RATE, slow_ms=PROFILE_SLOW_MS,
+                 max_entries=PROFILE_MAX_ENTRIES, max_bytes=PROFILE_MAX_BYTES,
+                 interval=PROFILE_INTERVAL_MS / 1000, tf_trace=PROFILE_TF_TRACE):
+        """
+        Initialize profiler
+
+        Args:
+            root: Directory profiles are written to
+            sample_rate: Fraction of requests profiled in full
+            slow_ms: Latency above which a request's profile is kept
+            max_entries: Profiles kept before the oldest is deleted
+            max_bytes: Total size kept before the oldest is deleted
+            interval: Seconds between stack samples
+            tf_trace: Capture a TensorFlow trace of sampled requests
+        """
+        self.root = Path(root)
+        self.sample_rate = sample_rate
+        self.slow = slow_ms / 1000 if slow_ms > 0 else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.tf_trace = tf_trace
+        self.tf_available = True
+
+        # (time, thread name, stack id), evicted after _HISTORY_SECONDS; the
+        # stacks themselves are interned, since busy threads repeat them
+        self._samples = deque()
+        self._stack_ids = {}
+        self._stacks = {}
+        self._next_stack_id = 0
+        self._samples_lock = threading.Lock()
+        self._gc_pauses = deque(maxlen=4096)
+        self._loop_lag = deque(maxlen=int(_HISTORY_SECONDS / 0.05))
+        self._gc_started = None
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._busy = threading.Event()
+        self._tracing = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stopped = False
+        self._sampler = None
+
+    def start(self):
+        """Start sampling; call from the event loop"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        gc.callbacks.append(self._gc_callback)
+        self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._sampler.start()
+        asyncio.get_running_loop().create_task(self._watch_loop())
+
+    def stop(self):
+        self._stopped = True
+        self._busy.set()
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self._gc_pauses.append((self._gc_started, time.perf_counter() - self._gc_started,
+                                    info['generation']))
+            self._gc_started = None
+
+    async def _watch_loop(self):
+        """Record how late the event loop wakes from a short sleep"""
+        period = 0.05
+        while not self._stopped:
+            before = time.perf_counter()
+            await asyncio.sleep(period)
+            self._loop_lag.append((before, time.perf_counter() - before - period))
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while not self._stopped:
+            self._busy.wait()
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                self._add_sample(now, names.get(ident, str(ident)), tuple(stack))
+            self._evict_samples(now - _HISTORY_SECONDS)
+            time.sleep(self.interval)
+
+    def _add_sample(self, when, thread_name, stack):
+        with self._samples_lock:
+            stack_id = self._stack_ids.get(stack)
+            if stack_id is None:
+                stack_id = self._next_stack_id
+                self._next_stack_id += 1
+                self._stack_ids[stack] = stack_id
+                self._stacks[stack_id] = [stack, 0]
+            self._stacks[stack_id][1] += 1
+            self._samples.append((when, thread_name, stack_id))
+
+    def _evict_samples(self, cutoff):
+        """Drop samples taken before cutoff and stacks no sample refers to"""
+        with self._samples_lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                _, _, stack_id = self._samples.popleft()
+                entry = self._stacks[stack_id]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._stacks[stack_id]
+                    del self._stack_ids[entry[0]]
+
+    def _samples_between(self, start, end):
+        """(thread name, stack) of every sample taken in [start, end]"""
+        with self._samples_lock:
+            return [(thread_name, self._stacks[stack_id][0])
+                    for when, thread_name, stack_id in self._samples if start <= when <= end]
+
+    def begin(self):
+        """
+        Note a request starting
+
+        Returns:
+            Tuple of (monotonic start time, wall-clock start time, whether
+            the request is sampled in full)
+        """
+        with self._active_lock:
+            self._active += 1
+            self._busy.set()
+        return time.perf_counter(), datetime.now(), random.random() < self.sample_rate
+
+    def start_tf_trace(self, directory):
+        """Start the TensorFlow profiler if no other request is being traced"""
+        if not (self.tf_trace and self.tf_available) or not self._tracing.acquire(blocking=False):
+            return False
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.start(str(directory))
+            return True
+        except Exception as e:
+            print(f"TensorFlow trace unavailable: {e}")
+            self._tracing.release()
+            return False
+
+    def stop_tf_trace(self):
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+        except Exception as e:
+            print(f"Could not stop TensorFlow trace: {e}")
+        finally:
+            self._tracing.release()
+
+    def end(self, start, started_at, sampled, traced, directory, request_info):
+        """
+        Finish a request; write its profile if it was sampled or slow
+
+        Runs off the event loop.
+        """
+        end = time.perf_counter()
+        with self._active_lock:
+            self._active -= 1
+            if self._active == 0:
+                self._busy.clear()
+        if traced:
+            self.stop_tf_trace()
+
+        duration = end - start
+        slow = self.slow is not None and duration >= self.slow
+        if not (sampled or slow):
+            if traced:
+                shutil.rmtree(directory, ignore_errors=True)
+            return None
+
+        stacks = Counter()
+        for thread_name, stack in self._samples_between(start, end):
+            frames = ';'.join(f"{code.co_name} ({os.path.basename(code.co_filename)}:{line})"
+                              for code, line in reversed(stack))
+            stacks[f"{thread_name};{frames}"] += 1
+        own = Counter()
+        for folded, count in stacks.items():
+            own[folded.rsplit(';', 1)[-1]] += count
+
+        pauses = [(duration_, generation) for when, duration_, generation in list(self._gc_pauses)
+                  if start <= when <= end]
+        lags = [lag for when, lag in list(self._loop_lag) if start - 0.05 <= when <= end]
+
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / 'stacks.folded', 'w') as f:
+            for folded, count in stacks.most_common():
+                f.write(f"{folded} {count}\n")
+        meta = dict(request_info,
+                    id=directory.name,
+                    reason='sampled' if sampled else 'slow',
+                    duration_ms=duration * 1000,
+                    started_at=started_at.isoformat(),
+                    sample_interval_ms=self.interval * 1000,
+                    stack_samples=sum(stacks.values()),
+                    top_frames=[{'frame': frame, 'samples': count} for frame, count in own.most_common(10)],
+                    gc={'collections': len(pauses),
+                        'pause_ms': sum(pause for pause, _ in pauses) * 1000,
+                        'generations': dict(Counter(generation for _, generation in pauses))},
+                    event_loop_lag_ms={'max': max(lags) * 1000 if lags else None,
+                                       'mean': sum(lags) / len(lags) * 1000 if lags else None},
+                    tf_trace='tf' if traced else None,
+                    tf_trace_skipped=None if traced else self._trace_skipped(sampled))
+        with open(directory / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=4)
+        self._enforce_bounds()
+        return meta
+
+    def _trace_skipped(self, sampled):
+        if not sampled:
+            return 'slow requests are only known to be slow once they have finished'
+        if not (self.tf_trace and self.tf_available):
+            return 'TensorFlow tracing is disabled'
+        return 'another request was being traced'
+
+    def _entries(self):
+        """Profile directories, oldest first"""
+        if not self.root.exists():
+            return []
+        return sorted((path for path in self.root.iterdir() if (path / 'meta.json').exists()),
+                      key=lambda path: path.name)
+
+    def _enforce_bounds(self):
+        with self._write_lock:
+            entries = self._entries()
+            sizes = {path: sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+                     for path in entries}
+            total = sum(sizes.values())
+            while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+                oldest = entries.pop(0)
+                total -= sizes[oldest]
+                shutil.rmtree(oldest, ignore_errors=True)
+
+    def new_directory(self):
+        """Directory name for a request's profile, sortable by time"""
+        return self.root / f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+
+    def list(self):
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for path in reversed(self._entries()):
+            try:
+                with open(path / 'meta.json', 'r') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def archive(self, profile_id):
+        """
+        A stored profile as a .tar.gz
+
+        Returns:
+            Archive bytes, or None if there is no such profile
+        """
+        path = self.root / profile_id
+        if path not in self._entries():
+            return None
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            tar.add(path, arcname=profile_id)
+        return buffer.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests to the configured paths"""
+
+    def __init__(self, app, profiler, paths=PROFILE_PATHS):
+        self.app = app
+        self.profiler = profiler
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('path') not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        start, started_at, sampled = self.profiler.begin()
+        directory = self.profiler.new_directory()
+        traced = False
+        if sampled:
+            traced = await loop.run_in_executor(None, self.profiler.start_tf_trace, directory / 'tf')
+
+        status = None
+
+        async def record_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        info = {'method': scope['method'], 'path': scope['path'],
+                'client': scope['client'][0] if scope.get('client') else None}
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            info['status'] = status
+            # Written after the response has gone out
+            loop.run_in_executor(None, self.profiler.end, start, started_at, sampled, traced,
+                                 directory, info)
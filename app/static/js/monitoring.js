@@ -6,222 +6,324 @@ let testChart = null;
 
 async function loadMonitoringData() {
   await loadSystemHealth();
-  await loadMetricsChart();
+  await loadMetrics();
   await loadDatasetCharts();
-  await loadMetricsTable();
+  await loadDrift();
 }
 
 async function loadSystemHealth() {
   try {
     const response = await fetch("/api/status");
-    const data = await response.json();
-
-    document.getElementById("uptimeValue").textContent = data.uptime;
-    document.getElementById("modelStatusValue").textContent = data.model_loaded
-      ? "Loaded"
-      : "Not Loaded";
-    document.getElementById("totalPredictionsValue").textContent =
-      data.total_predictions;
-    document.getElementById("totalRetrainsValue").textContent =
-      data.total_retrains;
-
-    const indicator = document.getElementById("healthIndicator");
-    if (data.model_loaded) {
-      indicator.className = "health-indicator online";
-      indicator.innerHTML = '<span class="pulse"></span> Online';
-    } else {
-      indicator.className = "health-indicator offline";
-      indicator.innerHTML = "Offline";
-    }
+    renderSystemHealth(await response.json());
   } catch (error) {
     console.error("Error loading system health:", error);
   }
 }
 
-async function loadMetricsChart() {
+function renderSystemHealth(data) {
+  document.getElementById("uptimeValue").textContent = data.uptime;
+  document.getElementById("modelStatusValue").textContent = data.model_loaded
+    ? "Loaded"
+    : "Not Loaded";
+  document.getElementById("totalPredictionsValue").textContent =
+    data.total_predictions;
+  document.getElementById("totalRetrainsValue").textContent =
+    data.total_retrains;
+
+  const indicator = document.getElementById("healthIndicator");
+  if (data.model_loaded) {
+    indicator.className = "health-indicator online";
+    indicator.innerHTML = '<span class="pulse"></span> Online';
+  } else {
+    indicator.className = "health-indicator offline";
+    indicator.innerHTML = "Offline";
+  }
+}
+
+async function loadMetrics() {
   try {
     const response = await fetch("/api/metrics");
     const data = await response.json();
+    renderMetricsChart(data);
+    renderMetricsTable(data);
+  } catch (error) {
+    console.error("Error loading metrics:", error);
+  }
+}
 
-    const ctx = document.getElementById("metricsChart");
+function renderMetricsChart(data) {
+  const ctx = document.getElementById("metricsChart");
 
-    if (metricsChart) {
-      metricsChart.destroy();
-    }
+  if (metricsChart) {
+    metricsChart.destroy();
+  }
 
-    metricsChart = new Chart(ctx, {
-      type: "bar",
-      data: {
-        labels: ["Accuracy", "Precision", "Recall", "F1 Score", "ROC-AUC"],
-        datasets: [
-          {
-            label: "Performance Metrics",
-            data: [
-              data.accuracy * 100,
-              data.precision * 100,
-              data.recall * 100,
-              data.f1_score * 100,
-              data.roc_auc * 100,
-            ],
-            backgroundColor: [
-              "rgba(99, 102, 241, 0.7)",
-              "rgba(139, 92, 246, 0.7)",
-              "rgba(16, 185, 129, 0.7)",
-              "rgba(245, 158, 11, 0.7)",
-              "rgba(239, 68, 68, 0.7)",
-            ],
-            borderColor: [
-              "rgb(99, 102, 241)",
-              "rgb(139, 92, 246)",
-              "rgb(16, 185, 129)",
-              "rgb(245, 158, 11)",
-              "rgb(239, 68, 68)",
-            ],
-            borderWidth: 2,
-          },
-        ],
-      },
-      options: {
-        responsive: true,
-        maintainAspectRatio: true,
-        scales: {
-          y: {
-            beginAtZero: true,
-            max: 100,
-            ticks: {
-              callback: function (value) {
-                return value + "%";
-              },
+  metricsChart = new Chart(ctx, {
+    type: "bar",
+    data: {
+      labels: ["Accuracy", "Precision", "Recall", "F1 Score", "ROC-AUC"],
+      datasets: [
+        {
+          label: "Performance Metrics",
+          data: [
+            data.accuracy * 100,
+            data.precision * 100,
+            data.recall * 100,
+            data.f1_score * 100,
+            data.roc_auc * 100,
+          ],
+          backgroundColor: [
+            "rgba(99, 102, 241, 0.7)",
+            "rgba(139, 92, 246, 0.7)",
+            "rgba(16, 185, 129, 0.7)",
+            "rgba(245, 158, 11, 0.7)",
+            "rgba(239, 68, 68, 0.7)",
+          ],
+          borderColor: [
+            "rgb(99, 102, 241)",
+            "rgb(139, 92, 246)",
+            "rgb(16, 185, 129)",
+            "rgb(245, 158, 11)",
+            "rgb(239, 68, 68)",
+          ],
+          borderWidth: 2,
+        },
+      ],
+    },
+    options: {
+      responsive: true,
+      maintainAspectRatio: true,
+      scales: {
+        y: {
+          beginAtZero: true,
+          max: 100,
+          ticks: {
+            callback: function (value) {
+              return value + "%";
             },
           },
         },
-        plugins: {
-          legend: {
-            display: false,
-          },
-          tooltip: {
-            callbacks: {
-              label: function (context) {
-                return context.parsed.y.toFixed(2) + "%";
-              },
+      },
+      plugins: {
+        legend: {
+          display: false,
+        },
+        tooltip: {
+          callbacks: {
+            label: function (context) {
+              return context.parsed.y.toFixed(2) + "%";
             },
           },
         },
       },
-    });
-  } catch (error) {
-    console.error("Error loading metrics chart:", error);
-  }
+    },
+  });
 }
 
 async function loadDatasetCharts() {
   try {
     const response = await fetch("/api/dataset-stats");
-    const data = await response.json();
+    renderDatasetCharts(await response.json());
+  } catch (error) {
+    console.error("Error loading dataset charts:", error);
+  }
+}
 
-    // Training data chart
-    const trainCtx = document.getElementById("trainChart");
-    if (trainChart) {
-      trainChart.destroy();
-    }
+function renderDatasetCharts(data) {
+  // Training data chart
+  const trainCtx = document.getElementById("trainChart");
+  if (trainChart) {
+    trainChart.destroy();
+  }
 
-    const trainData = data.training;
-    trainChart = new Chart(trainCtx, {
-      type: "doughnut",
-      data: {
-        labels: Object.keys(trainData).filter((k) => k !== "total"),
-        datasets: [
-          {
-            data: Object.entries(trainData)
-              .filter(([k, v]) => k !== "total")
-              .map(([k, v]) => v),
-            backgroundColor: [
-              "rgba(99, 102, 241, 0.7)",
-              "rgba(139, 92, 246, 0.7)",
-            ],
-            borderColor: ["rgb(99, 102, 241)", "rgb(139, 92, 246)"],
-            borderWidth: 2,
-          },
-        ],
-      },
-      options: {
-        responsive: true,
-        plugins: {
-          legend: {
-            position: "bottom",
-          },
+  const trainData = data.training;
+  trainChart = new Chart(trainCtx, {
+    type: "doughnut",
+    data: {
+      labels: Object.keys(trainData).filter((k) => k !== "total"),
+      datasets: [
+        {
+          data: Object.entries(trainData)
+            .filter(([k, v]) => k !== "total")
+            .map(([k, v]) => v),
+          backgroundColor: [
+            "rgba(99, 102, 241, 0.7)",
+            "rgba(139, 92, 246, 0.7)",
+          ],
+          borderColor: ["rgb(99, 102, 241)", "rgb(139, 92, 246)"],
+          borderWidth: 2,
+        },
+      ],
+    },
+    options: {
+      responsive: true,
+      plugins: {
+        legend: {
+          position: "bottom",
         },
       },
-    });
+    },
+  });
 
-    // Testing data chart
-    const testCtx = document.getElementById("testChart");
-    if (testChart) {
-      testChart.destroy();
-    }
+  // Testing data chart
+  const testCtx = document.getElementById("testChart");
+  if (testChart) {
+    testChart.destroy();
+  }
 
-    const testData = data.testing;
-    testChart = new Chart(testCtx, {
-      type: "doughnut",
-      data: {
-        labels: Object.keys(testData).filter((k) => k !== "total"),
-        datasets: [
-          {
-            data: Object.entries(testData)
-              .filter(([k, v]) => k !== "total")
-              .map(([k, v]) => v),
-            backgroundColor: [
-              "rgba(16, 185, 129, 0.7)",
-              "rgba(245, 158, 11, 0.7)",
-            ],
-            borderColor: ["rgb(16, 185, 129)", "rgb(245, 158, 11)"],
-            borderWidth: 2,
-          },
-        ],
-      },
-      options: {
-        responsive: true,
-        plugins: {
-          legend: {
-            position: "bottom",
-          },
+  const testData = data.testing;
+  testChart = new Chart(testCtx, {
+    type: "doughnut",
+    data: {
+      labels: Object.keys(testData).filter((k) => k !== "total"),
+      datasets: [
+        {
+          data: Object.entries(testData)
+            .filter(([k, v]) => k !== "total")
+            .map(([k, v]) => v),
+          backgroundColor: [
+            "rgba(16, 185, 129, 0.7)",
+            "rgba(245, 158, 11, 0.7)",
+          ],
+          borderColor: ["rgb(16, 185, 129)", "rgb(245, 158, 11)"],
+          borderWidth: 2,
+        },
+      ],
+    },
+    options: {
+      responsive: true,
+      plugins: {
+        legend: {
+          position: "bottom",
         },
       },
-    });
+    },
+  });
+}
+
+function renderMetricsTable(data) {
+  const metrics = [
+    { id: "Accuracy", value: data.accuracy },
+    { id: "Precision", value: data.precision },
+    { id: "Recall", value: data.recall },
+    { id: "F1", value: data.f1_score },
+    { id: "ROC", value: data.roc_auc },
+  ];
+
+  metrics.forEach((metric) => {
+    const valueElement = document.getElementById(`table${metric.id}`);
+    const barElement = document.getElementById(`bar${metric.id}`);
+
+    if (valueElement && barElement) {
+      valueElement.textContent = (metric.value * 100).toFixed(2) + "%";
+      barElement.style.width = metric.value * 100 + "%";
+    }
+  });
+}
+
+async function loadDrift() {
+  try {
+    const response = await fetch("/api/drift");
+    renderDrift(await response.json());
   } catch (error) {
-    console.error("Error loading dataset charts:", error);
+    console.error("Error loading drift:", error);
   }
 }
 
-async function loadMetricsTable() {
-  try {
-    const response = await fetch("/api/metrics");
-    const data = await response.json();
+const DRIFT_FEATURES = {
+  brightness: "Brightness",
+  width: "Width (px)",
+  height: "Height (px)",
+  aspect_ratio: "Aspect Ratio",
+  probability: "Dog Probability",
+  confidence: "Confidence",
+};
 
-    const metrics = [
-      { id: "Accuracy", value: data.accuracy },
-      { id: "Precision", value: data.precision },
-      { id: "Recall", value: data.recall },
-      { id: "F1", value: data.f1_score },
-      { id: "ROC", value: data.roc_auc },
-    ];
-
-    metrics.forEach((metric) => {
-      const valueElement = document.getElementById(`table${metric.id}`);
-      const barElement = document.getElementById(`bar${metric.id}`);
-
-      if (valueElement && barElement) {
-        valueElement.textContent = (metric.value * 100).toFixed(2) + "%";
-        barElement.style.width = metric.value * 100 + "%";
-      }
-    });
-  } catch (error) {
-    console.error("Error loading metrics table:", error);
+function formatDriftValue(value, digits) {
+  return value === null || value === undefined ? "--" : value.toFixed(digits);
+}
+
+function renderDrift(data) {
+  const current = data.current;
+  const count = Math.max(
+    ...Object.values(current.features).map((feature) => feature.count),
+  );
+  const summary = document.getElementById("driftSummary");
+  if (!data.reference) {
+    summary.textContent =
+      "No training reference; run python -m src.drift reference";
+  } else if (count === 0) {
+    summary.textContent = "No predictions in the current window";
+  } else {
+    summary.textContent =
+      `${count} uploads since ${new Date(current.start).toLocaleTimeString()}` +
+      ` compared with ${data.reference.images} training images`;
   }
+
+  const rows = Object.entries(DRIFT_FEATURES).map(([name, label]) => {
+    const feature = current.features[name] || {};
+    let status = '<span class="health-value">--</span>';
+    if (feature.psi !== null && feature.psi !== undefined) {
+      if (feature.drift) {
+        status = '<span class="health-value error">Drift</span>';
+      } else if (feature.count < data.thresholds.min_samples) {
+        status = '<span class="health-value">Too few samples</span>';
+      } else if (feature.psi > 0.1) {
+        status = '<span class="health-value warning">Moderate</span>';
+      } else {
+        status = '<span class="health-value success">Stable</span>';
+      }
+    }
+    return `<tr>
+      <td>${label}</td>
+      <td>${formatDriftValue(feature.mean, 2)}</td>
+      <td>${formatDriftValue(feature.reference_mean, 2)}</td>
+      <td>${formatDriftValue(feature.psi, 3)}</td>
+      <td>${formatDriftValue(feature.p_value, 4)}</td>
+      <td>${status}</td>
+    </tr>`;
+  });
+  document.getElementById("driftTableBody").innerHTML = rows.join("");
 }
 
-// Auto-refresh every 10 seconds
-setInterval(loadMonitoringData, 10000);
+// Live updates: the server pushes status, metrics and dataset changes over
+// server-sent events; browsers without EventSource fall back to polling
+function subscribeToEvents() {
+  const source = new EventSource("/api/events");
+  let uptimeBase = null;
+
+  source.addEventListener("status", (e) => {
+    const data = JSON.parse(e.data);
+    uptimeBase = Date.now() - data.uptime_seconds * 1000;
+    renderSystemHealth(data);
+  });
+  source.addEventListener("metrics", (e) => {
+    const data = JSON.parse(e.data);
+    renderMetricsChart(data);
+    renderMetricsTable(data);
+  });
+  source.addEventListener("dataset", (e) => renderDatasetCharts(JSON.parse(e.data)));
+  source.addEventListener("drift", (e) => renderDrift(JSON.parse(e.data)));
+  source.onerror = () => {
+    document.getElementById("healthIndicator").className =
+      "health-indicator offline";
+  };
 
-// Initial load
-loadMonitoringData();
+  // Status is only pushed when it changes, so tick the uptime locally
+  setInterval(() => {
+    if (uptimeBase === null) return;
+    const total = Math.floor((Date.now() - uptimeBase) / 1000);
+    const hours = Math.floor(total / 3600);
+    const minutes = Math.floor((total % 3600) / 60);
+    document.getElementById("uptimeValue").textContent =
+      `${hours}h ${minutes}m ${total % 60}s`;
+  }, 1000);
+}
+
+if (window.EventSource) {
+  subscribeToEvents();
+} else {
+  // Auto-refresh every 10 seconds
+  setInterval(loadMonitoringData, 10000);
+  loadMonitoringData();
+}
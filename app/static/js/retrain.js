@@ -146,11 +146,11 @@ document
 
       const result = await response.json();
       showSuccess(
-        "Retraining started successfully. This will continue in the background."
+        result.message + ". This will continue in the background."
       );
 
-      // Start polling for retrain status
-      pollRetrainStatus();
+      // Follow retraining progress
+      watchRetrainStatus();
     } catch (error) {
       showError("Error starting retraining: " + error.message);
     } finally {
@@ -158,26 +158,90 @@ document
     }
   });
 
+function showRetrainProgress(progress) {
+  const message = document.getElementById("retrainMessage");
+
+  if (progress.stage === "batch" || progress.stage === "epoch") {
+    const eta =
+      progress.eta_seconds != null
+        ? ` - about ${Math.ceil(progress.eta_seconds / 60)} min left`
+        : "";
+    const step =
+      progress.stage === "batch" ? ` (step ${progress.step}/${progress.steps})` : "";
+    message.textContent =
+      `Epoch ${progress.epoch}/${progress.total_epochs}${step}: ` +
+      `loss ${progress.loss.toFixed(4)}, ` +
+      `accuracy ${(progress.accuracy * 100).toFixed(1)}%${eta}`;
+  } else if (progress.stage === "queued" || progress.stage === "started") {
+    message.textContent = "Model is currently being retrained...";
+  }
+}
+
+function setRetrainIndicator(inProgress, failed) {
+  const indicator = document.getElementById("retrainIndicator");
+
+  if (inProgress) {
+    indicator.textContent = "In Progress";
+    indicator.style.background = "#fef3c7";
+    indicator.style.color = "#f59e0b";
+  } else if (failed) {
+    indicator.textContent = "Failed";
+    indicator.style.background = "#fee2e2";
+    indicator.style.color = "#ef4444";
+  } else {
+    indicator.textContent = "Completed";
+    indicator.style.background = "#d1fae5";
+    indicator.style.color = "#10b981";
+  }
+}
+
+// Follow retraining through server-sent events (per-epoch loss, accuracy
+// and ETA); browsers without EventSource poll the status endpoint instead
+function watchRetrainStatus() {
+  if (!window.EventSource) {
+    pollRetrainStatus();
+    return;
+  }
+
+  setRetrainIndicator(true);
+  const source = new EventSource("/api/events");
+
+  source.addEventListener("retrain", (e) => {
+    const progress = JSON.parse(e.data);
+    const message = document.getElementById("retrainMessage");
+
+    if (progress.stage === "completed") {
+      setRetrainIndicator(false);
+      message.textContent = "Retraining completed successfully";
+      source.close();
+    } else if (progress.stage === "failed") {
+      setRetrainIndicator(false, true);
+      message.textContent = "Retraining failed: " + progress.error;
+      source.close();
+    } else {
+      setRetrainIndicator(true);
+      showRetrainProgress(progress);
+    }
+  });
+}
+
 async function pollRetrainStatus() {
   const checkStatus = async () => {
     try {
       const response = await fetch("/api/retrain-status");
       const data = await response.json();
 
-      const indicator = document.getElementById("retrainIndicator");
       const message = document.getElementById("retrainMessage");
+      setRetrainIndicator(data.is_retraining);
 
       if (data.is_retraining) {
-        indicator.textContent = "In Progress";
-        indicator.style.background = "#fef3c7";
-        indicator.style.color = "#f59e0b";
         message.textContent = "Model is currently being retrained...";
+        if (data.progress) {
+          showRetrainProgress(data.progress);
+        }
 
         setTimeout(checkStatus, 5000);
       } else {
-        indicator.textContent = "Completed";
-        indicator.style.background = "#d1fae5";
-        indicator.style.color = "#10b981";
         message.textContent = "Retraining completed successfully";
       }
     } catch (error) {
@@ -251,7 +315,7 @@ async function loadRetrainStatus() {
       indicator.style.background = "#fef3c7";
       indicator.style.color = "#f59e0b";
       message.textContent = "Model is currently being retrained...";
-      pollRetrainStatus();
+      watchRetrainStatus();
     } else {
       indicator.textContent = "Idle";
       message.textContent = "Ready to retrain with new data";
@@ -261,4 +325,57 @@ async function loadRetrainStatus() {
   }
 }
 
+// Active-learning review queue: uncertain predictions waiting for a label
+async function loadReviewQueue() {
+  try {
+    const response = await fetch("/api/review-queue?limit=24");
+    renderReviewQueue(await response.json());
+  } catch (error) {
+    console.error("Error loading review queue:", error);
+  }
+}
+
+function renderReviewQueue(data) {
+  const grid = document.getElementById("reviewGrid");
+  if (data.items.length === 0) {
+    grid.innerHTML = '<p class="empty-state">No images awaiting review</p>';
+    return;
+  }
+
+  grid.innerHTML = data.items
+    .map(
+      (item) => `
+        <div class="review-item" id="review-${item.id}">
+          <img src="${item.image_url}" alt="Image awaiting review" loading="lazy" />
+          <p>Predicted ${item.predicted_class} (${(
+            Math.max(item.probability, 1 - item.probability) * 100
+          ).toFixed(0)}%)</p>
+          <div class="button-group">
+            <button class="btn btn-primary" onclick="labelReviewItem('${item.id}', 'cats')">Cat</button>
+            <button class="btn btn-primary" onclick="labelReviewItem('${item.id}', 'dogs')">Dog</button>
+            <button class="btn btn-secondary" onclick="labelReviewItem('${item.id}', 'skip')">Skip</button>
+          </div>
+        </div>`
+    )
+    .join("");
+}
+
+async function labelReviewItem(id, label) {
+  try {
+    const response = await fetch(`/api/review-queue/${id}?label=${label}`, {
+      method: "POST",
+    });
+    if (!response.ok) {
+      throw new Error((await response.json()).detail);
+    }
+    document.getElementById(`review-${id}`).remove();
+    if (!document.querySelector(".review-item")) {
+      loadReviewQueue();
+    }
+  } catch (error) {
+    showError("Error labeling image: " + error.message);
+  }
+}
+
 loadRetrainStatus();
+loadReviewQueue();
@@ -0,0 +1,309 @@
+"""
+Active-Learning Review Buffer for Cats vs Dogs Retraining
+Keeps the most informative recent uploads (low confidence, or views that
+disagree under test-time augmentation) in a bounded on-disk buffer, and
+moves them into the retraining image store once a reviewer has labeled
+them, so retraining spends its compute on images the model gets wrong
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+from src.image_guard import sniff_format
+from src.ingest import INGEST_MAX_SIDE, prepare_staged_file
+
+
+ACTIVE_LEARNING_DIR = Path(os.getenv('ACTIVE_LEARNING_DIR', 'data/review'))
+# Images kept awaiting review; the least informative is evicted first
+ACTIVE_LEARNING_CAPACITY = int(os.getenv('ACTIVE_LEARNING_CAPACITY', '500'))
+# Uploads scoring below this are never kept (0.3 keeps confidence below 85%)
+ACTIVE_LEARNING_MIN_SCORE = float(os.getenv('ACTIVE_LEARNING_MIN_SCORE', '0.3'))
+# A buffered image's score halves over this many hours, so the buffer favours recent traffic
+ACTIVE_LEARNING_HALF_LIFE_HOURS = float(os.getenv('ACTIVE_LEARNING_HALF_LIFE_HOURS', '24'))
+
+# queue.jsonl is rewritten once it holds this many records per live entry
+_COMPACT_RATIO = 4
+
+
+def informativeness(probability, tta_agreement=None):
+    """
+    How much a labeled copy of an input would teach the model, in [0, 1]
+
+    Args:
+        probability: Dog probability of the prediction
+        tta_agreement: Fraction of TTA views agreeing with the averaged
+            prediction, when test-time augmentation was used
+
+    Returns:
+        The larger of the prediction's uncertainty (1 at p = 0.5, 0 at
+        p = 0 or 1) and the views' disagreement (1 when half disagree)
+    """
+    score = 1 - abs(2 * probability - 1)
+    if tta_agreement is not None:
+        score = max(score, min(1.0, 2 * (1 - tta_agreement)))
+    return float(score)
+
+
+class ReviewBuffer:
+    """
+    Bounded buffer of uploads awaiting a label
+
+    Images live in root/objects/ (downscaled like training uploads) and
+    root/queue.jsonl is an append-only log of additions and removals, so
+    every API worker shares one buffer. Changes are made under an flock on
+    root/.lock and each worker replays the log's tail before using its view.
+    """
+
+    def __init__(self, root=ACTIVE_LEARNING_DIR, capacity=ACTIVE_LEARNING_CAPACITY,
+                 min_score=ACTIVE_LEARNING_MIN_SCORE,
+                 half_life_hours=ACTIVE_LEARNING_HALF_LIFE_HOURS, max_side=INGEST_MAX_SIDE):
+        """
+        Initialize buffer
+
+        Args:
+            root: Buffer directory
+            capacity: Most images kept awaiting review
+            min_score: Lowest informativeness kept
+            half_life_hours: Age at which a buffered image's priority has halved
+            max_side: Longest side buffered images are downscaled to
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.staging_dir = self.root / 'staging'
+        self.log_path = self.root / 'queue.jsonl'
+        self.capacity = capacity
+        self.min_score = min_score
+        self.half_life = half_life_hours * 3600
+        self.max_side = max_side
+
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+        self._thread_lock = threading.Lock()
+        self.entries = {}
+        self._records = 0
+        self._offset = 0
+        self._inode = None
+        self.counters = {'offered': 0, 'buffered': 0, 'evicted': 0, 'labeled': 0, 'skipped': 0}
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self):
+        """Hold the buffer lock (across threads and workers) with an up-to-date view"""
+        with self._thread_lock, open(self.root / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Replay records appended (or a log rewritten) by another worker"""
+        try:
+            stat = self.log_path.stat()
+        except OSError:
+            self.entries, self._records, self._offset, self._inode = {}, 0, 0, None
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self.entries, self._records, self._offset = {}, 0, 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.splitlines():
+            self._apply(json.loads(line))
+        self._offset += len(data)
+
+    def _apply(self, record):
+        self._records += 1
+        if record.get('removed'):
+            self.entries.pop(record['id'], None)
+        else:
+            self.entries[record['id']] = record
+
+    def _write(self, record):
+        """Append a record; called with the lock held"""
+        line = (json.dumps(record) + '\n').encode()
+        with open(self.log_path, 'ab') as f:
+            f.write(line)
+        if self._inode is None:
+            self._inode = self.log_path.stat().st_ino
+        self._offset += len(line)
+        self._apply(record)
+
+    def _compact(self):
+        """Rewrite the log with only the live entries; called with the lock held"""
+        if self._records <= _COMPACT_RATIO * max(len(self.entries), 16):
+            return
+        temporary = self.log_path.with_suffix('.tmp')
+        with open(temporary, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temporary, self.log_path)
+        stat = self.log_path.stat()
+        self._inode, self._offset, self._records = stat.st_ino, stat.st_size, len(self.entries)
+
+    def priority(self, entry, now=None):
+        """Informativeness discounted by age"""
+        age = (time.time() if now is None else now) - entry['buffered_at']
+        return entry['score'] * 0.5 ** (max(age, 0.0) / self.half_life)
+
+    def _lowest(self, now):
+        return min(list(self.entries.values()), key=lambda entry: self.priority(entry, now))
+
+    def wants(self, score):
+        """
+        Cheap pre-check from this worker's last view, for the request path
+
+        A True answer is confirmed by add() under the lock.
+        """
+        if self.capacity <= 0 or score < self.min_score:
+            return False
+        if len(self.entries) < self.capacity:
+            return True
+        return score > self.priority(self._lowest(time.time()))
+
+    def add(self, contents, digest, probability, score, store, **details):
+        """
+        Buffer an upload if it outranks the least informative buffered image
+
+        Args:
+            contents: Uploaded image bytes
+            digest: SHA-256 of contents
+            probability: Dog probability the model gave it
+            score: informativeness() of the prediction
+            store: ImageStore for retraining; images it already holds are
+                not buffered
+            **details: Extra fields kept with the entry (e.g. tta_agreement)
+
+        Returns:
+            'buffered', 'present', 'known', 'rejected' or 'error'
+        """
+        self.counters['offered'] += 1
+        if self.capacity <= 0 or score < self.min_score:
+            return 'rejected'
+        if digest in self.entries:
+            return 'present'
+
+        # Validate and downscale outside the lock, exactly as training uploads are
+        staged = self.staging_dir / f"{digest}.{os.getpid()}.upload"
+        staged.write_bytes(contents)
+        extension = '.png' if sniff_format(bytes(contents[:16])) == 'PNG' else '.jpg'
+        status, detail = prepare_staged_file(staged, digest, extension, store.objects_dir,
+                                             self.max_side)
+        if status == 'existing':
+            return 'known'
+        if status == 'error':
+            return 'error'
+
+        prepared = Path(detail['path'])
+        try:
+            now = time.time()
+            with self._locked():
+                if digest in self.entries:
+                    return 'present'
+                if len(self.entries) >= self.capacity:
+                    lowest = self._lowest(now)
+                    if self.priority(lowest, now) >= score:
+                        return 'rejected'
+                    self._remove(lowest['id'], 'evicted')
+                    self.counters['evicted'] += 1
+
+                destination = self.objects_dir / f"{digest}{prepared.suffix}"
+                os.replace(prepared, destination)
+                self._write(dict(details, id=digest, file=destination.name, score=score,
+                                 probability=float(probability), buffered_at=now,
+                                 added_at=datetime.now().isoformat(),
+                                 phash=f"{detail['phash']:016x}"))
+                self._compact()
+                self.counters['buffered'] += 1
+                return 'buffered'
+        finally:
+            prepared.unlink(missing_ok=True)
+
+    def _remove(self, entry_id, reason):
+        """Drop an entry and its image; called with the lock held"""
+        entry = self.entries[entry_id]
+        (self.objects_dir / entry['file']).unlink(missing_ok=True)
+        self._write({'id': entry_id, 'removed': True, 'reason': reason})
+
+    def image_path(self, entry_id):
+        """Path of a buffered image, or None"""
+        with self._locked():
+            entry = self.entries.get(entry_id)
+        return self.objects_dir / entry['file'] if entry is not None else None
+
+    def pending(self, limit=50):
+        """
+        Buffered images, most informative first
+
+        Returns:
+            List of entry dictionaries with their current priority
+        """
+        now = time.time()
+        with self._locked():
+            entries = list(self.entries.values())
+        entries.sort(key=lambda entry: self.priority(entry, now), reverse=True)
+        return [dict(entry, priority=self.priority(entry, now)) for entry in entries[:limit]]
+
+    def label(self, entry_id, label, store):
+        """
+        Resolve a buffered image: add it to the store under label, or discard it
+
+        Args:
+            entry_id: SHA-256 of the buffered image
+            label: One of the store's class names, or 'skip'
+            store: ImageStore receiving labeled images
+
+        Returns:
+            Outcome of store.add_file ('stored', 'duplicate', 'near_duplicate',
+            'conflict') or 'skipped'
+
+        Raises:
+            KeyError: If the image is not in the buffer
+            ValueError: If the label is unknown
+        """
+        if label != 'skip' and label not in store.class_names:
+            raise ValueError(f"Label must be one of {store.class_names + ['skip']}")
+
+        with self._locked():
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                raise KeyError(entry_id)
+            if label == 'skip':
+                self._remove(entry_id, 'skipped')
+                self.counters['skipped'] += 1
+                return 'skipped'
+
+            path = self.objects_dir / entry['file']
+            outcome, _ = store.add_file(path, label, digest=entry_id, phash=int(entry['phash'], 16),
+                                        source_name=f"review-{entry_id[:12]}{path.suffix}")
+            self._remove(entry_id, 'labeled')
+            self._compact()
+            self.counters['labeled'] += 1
+            return outcome
+
+    def statistics(self):
+        """Buffer size, bounds and this worker's counters"""
+        with self._locked():
+            size = len(self.entries)
+            scores = [entry['score'] for entry in self.entries.values()]
+        return {
+            'pending': size,
+            'capacity': self.capacity,
+            'min_score': self.min_score,
+            'mean_score': sum(scores) / size if size else None,
+            'counters': dict(self.counters)
+        }
@@ -0,0 +1,155 @@
+"""
+Cascade Model Training and Evaluation for Cats vs Dogs Classification
+Trains the small first-stage model and measures per-stage accuracy, traffic
+and latency across confidence thresholds so the threshold can be tuned
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+
+DEFAULT_THRESHOLDS = (0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99)
+CASCADE_REPORT_PATH = 'models/cascade_report.json'
+
+
+def train_small_model(train_dir='data/train', model_path=None, epochs=15):
+    """
+    Train the custom CNN used as the cascade's first stage
+
+    Args:
+        train_dir: Directory of class folders
+        model_path: Where to save the model (default: CASCADE_MODEL_PATH)
+        epochs: Number of training epochs
+
+    Returns:
+        Training history
+    """
+    from src.model import CatsDogsModel
+    from src.prediction import CASCADE_MODEL_PATH
+    from src.preprocessing import ImagePreprocessor
+
+    model_path = model_path or CASCADE_MODEL_PATH
+    train_gen, val_gen = ImagePreprocessor().create_data_generators(train_dir)
+
+    model_trainer = CatsDogsModel(img_size=(224, 224), learning_rate=0.001)
+    model_trainer.build_model(use_pretrained=False)
+    return model_trainer.train(train_gen, val_gen, epochs=epochs, model_save_path=model_path)
+
+
+def _score_test_set(predictor, test_generator):
+    """Probabilities of one model over a test generator, with seconds per image"""
+    probabilities = []
+    seconds = 0.0
+    for i in range(len(test_generator)):
+        images, _ = test_generator[i]
+        start = time.perf_counter()
+        probabilities.append(predictor.predict_proba(images))
+        seconds += time.perf_counter() - start
+    probabilities = np.concatenate(probabilities)
+    return probabilities, seconds / max(len(probabilities), 1)
+
+
+def evaluate_cascade(test_dir='data/test', model_path='models/cats_dogs_model.h5',
+                     small_model_path=None, thresholds=DEFAULT_THRESHOLDS,
+                     report_path=CASCADE_REPORT_PATH):
+    """
+    Measure the cascade on the labeled test set for a range of thresholds
+
+    Both models score every test image once; each threshold is then
+    evaluated from those scores without further inference.
+
+    Args:
+        test_dir: Directory of class folders
+        model_path: Path to the full model
+        small_model_path: Path to the small model (default: CASCADE_MODEL_PATH)
+        thresholds: Confidence thresholds to evaluate
+        report_path: Where to save the JSON report
+
+    Returns:
+        Report dictionary
+    """
+    from src.prediction import CASCADE_MODEL_PATH, Predictor
+    from src.preprocessing import ImagePreprocessor
+
+    test_generator = ImagePreprocessor().create_test_generator(test_dir)
+    labels = np.asarray(test_generator.classes)
+
+    small_probs, small_seconds = _score_test_set(
+        Predictor(small_model_path or CASCADE_MODEL_PATH), test_generator
+    )
+    full_probs, full_seconds = _score_test_set(Predictor(model_path), test_generator)
+
+    small_correct = (small_probs > 0.5).astype(int) == labels
+    full_correct = (full_probs > 0.5).astype(int) == labels
+    small_confidence = np.maximum(small_probs, 1.0 - small_probs)
+
+    results = []
+    for threshold in thresholds:
+        escalated = small_confidence < threshold
+        answered = ~escalated
+        seconds_per_image = small_seconds + escalated.mean() * full_seconds
+        results.append({
+            'threshold': threshold,
+            'accuracy': float(np.where(escalated, full_correct, small_correct).mean()),
+            'small_traffic_share': float(answered.mean()),
+            'small_accuracy': float(small_correct[answered].mean()) if answered.any() else None,
+            'full_traffic_share': float(escalated.mean()),
+            'full_accuracy': float(full_correct[escalated].mean()) if escalated.any() else None,
+            'seconds_per_image': float(seconds_per_image),
+            'speedup': float(full_seconds / seconds_per_image) if seconds_per_image else None
+        })
+
+    report = {
+        'images': int(len(labels)),
+        'small_model': {'accuracy': float(small_correct.mean()), 'seconds_per_image': small_seconds},
+        'full_model': {'accuracy': float(full_correct.mean()), 'seconds_per_image': full_seconds},
+        'thresholds': results,
+        'created_at': datetime.now().isoformat()
+    }
+
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Cascade report saved to {report_path}")
+
+    return report
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Train and evaluate the cascade's small model")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Train the first-stage model")
+    train_parser.add_argument('--train-dir', default='data/train')
+    train_parser.add_argument('--model-path', default=None)
+    train_parser.add_argument('--epochs', type=int, default=15)
+
+    eval_parser = subparsers.add_parser('evaluate', help="Sweep thresholds on the test set")
+    eval_parser.add_argument('--test-dir', default='data/test')
+    eval_parser.add_argument('--model-path', default='models/cats_dogs_model.h5')
+    eval_parser.add_argument('--small-model-path', default=None)
+    eval_parser.add_argument('--thresholds', type=float, nargs='+', default=list(DEFAULT_THRESHOLDS))
+
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train_small_model(args.train_dir, args.model_path, args.epochs)
+    else:
+        report = evaluate_cascade(args.test_dir, args.model_path, args.small_model_path,
+                                  args.thresholds)
+        print(f"{'threshold':>9} {'accuracy':>8} {'small %':>8} {'speedup':>7}")
+        for row in report['thresholds']:
+            print(f"{row['threshold']:>9.2f} {row['accuracy']:>8.4f} "
+                  f"{row['small_traffic_share'] * 100:>7.1f}% {row['speedup']:>6.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+"""
+Model Compression for Cats vs Dogs Classification
+Structured filter pruning, magnitude pruning and weight clustering with a
+short fine-tune, exporting a smaller model and a report against the baseline
+"""
+
+import os
+import sys
+import gzip
+import json
+import shutil
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers, models
+from tensorflow.keras.callbacks import Callback
+from tensorflow.keras.optimizers import Adam
+
+from src.model import compare_models, find_backbone
+
+
+# Layers that combine branches cannot have their channels sliced independently
+MERGE_LAYERS = ('Add', 'Concatenate', 'Multiply', 'Subtract', 'Average', 'Maximum', 'Minimum')
+# Fixed input conversion layer added by backbone_preprocessing(); never pruned
+PREPROCESSING_LAYER = 'backbone_preprocessing'
+
+
+def _strongest(scores, fraction):
+    """Indices of the channels to keep after removing the weakest fraction"""
+    keep = max(1, int(round(len(scores) * (1.0 - fraction))))
+    return np.sort(np.argsort(scores)[-keep:])
+
+
+def _prunable(layer):
+    """Kernels that magnitude pruning and clustering operate on"""
+    return isinstance(layer, (layers.Conv2D, layers.Dense)) and layer.name != PREPROCESSING_LAYER
+
+
+def _iter_layers(model):
+    """All layers of a model, descending into nested models"""
+    for layer in model.layers:
+        if isinstance(layer, keras.Model):
+            yield from _iter_layers(layer)
+        else:
+            yield layer
+
+
+class _ChainPruner:
+    """Rebuilds a chain of layers with filters and units removed"""
+
+    def __init__(self, conv_targets, filter_fraction, dense_targets, unit_fraction):
+        self.conv_targets = set(conv_targets)
+        self.filter_fraction = filter_fraction
+        self.dense_targets = set(dense_targets)
+        self.unit_fraction = unit_fraction
+        self.weights = {}
+        self.pruned = []
+
+    def rebuild(self, chain, keep):
+        """
+        Clone a chain of layers, slicing weights to the surviving channels
+
+        Args:
+            chain: Layers applied one after another
+            keep: Indices of the input channels that survive (None for all)
+
+        Returns:
+            Tuple of (new layers, surviving output channels)
+        """
+        new_layers = []
+        for layer in chain:
+            kind = type(layer).__name__
+            if kind in MERGE_LAYERS:
+                raise ValueError(
+                    f"Structured pruning needs a chain of layers; {layer.name} merges branches "
+                    "(use a VGG16 or custom CNN model, or magnitude pruning only)"
+                )
+
+            if isinstance(layer, keras.Model):
+                inner = [l for l in layer.layers if not isinstance(l, layers.InputLayer)]
+                sub_layers, keep = self.rebuild(inner, keep)
+                inputs = layers.Input(shape=layer.input.shape[1:])
+                x = inputs
+                for sub_layer in sub_layers:
+                    x = sub_layer(x)
+                new_layers.append(models.Model(inputs, x, name=layer.name))
+                continue
+
+            config = layer.get_config()
+            weights = layer.get_weights()
+
+            if isinstance(layer, (layers.Conv2D, layers.Dense)) and layer.name != PREPROCESSING_LAYER:
+                kernel, bias = weights if len(weights) == 2 else (weights[0], None)
+                if keep is not None:
+                    kernel = kernel[..., keep, :]
+
+                targets = self.conv_targets if isinstance(layer, layers.Conv2D) else self.dense_targets
+                fraction = self.filter_fraction if isinstance(layer, layers.Conv2D) else self.unit_fraction
+                if layer.name in targets:
+                    out_keep = _strongest(np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0), fraction)
+                    kernel = kernel[..., out_keep]
+                    bias = bias[out_keep] if bias is not None else None
+                    original = layer.filters if isinstance(layer, layers.Conv2D) else layer.units
+                    self.pruned.append((layer.name, int(kernel.shape[-1]), int(original)))
+                    keep = out_keep
+                else:
+                    keep = None
+
+                config['filters' if isinstance(layer, layers.Conv2D) else 'units'] = int(kernel.shape[-1])
+                weights = [kernel] if bias is None else [kernel, bias]
+            elif isinstance(layer, layers.BatchNormalization):
+                if keep is not None:
+                    weights = [w[keep] for w in weights]
+            elif isinstance(layer, layers.Flatten):
+                if keep is not None:
+                    height, width, channels = layer.input.shape[1:]
+                    keep = np.array([position * channels + c
+                                     for position in range(height * width) for c in keep])
+            elif weights and layer.name != PREPROCESSING_LAYER:
+                raise ValueError(f"Cannot prune through {kind} layer {layer.name}")
+
+            new_layers.append(type(layer).from_config(config))
+            if weights:
+                self.weights[layer.name] = weights
+        return new_layers, keep
+
+
+def prune_filters(model, conv_layers=3, filter_fraction=0.5, unit_fraction=0.5):
+    """
+    Remove whole filters from the last conv layers and units from the dense head
+
+    Filters and units are ranked by the L1 norm of their weights; the
+    following layer's input channels are sliced to match, so the result is a
+    physically smaller model with the same architecture.
+
+    Args:
+        model: Sequential Keras model (optionally with a nested backbone)
+        conv_layers: Number of final Conv2D layers to prune (3 = VGG16 block5)
+        filter_fraction: Fraction of filters removed from each pruned conv layer
+        unit_fraction: Fraction of units removed from each hidden Dense layer
+
+    Returns:
+        Tuple of (pruned model, list of (layer, kept, original) tuples)
+    """
+    all_layers = list(_iter_layers(model))
+    convs = [l.name for l in all_layers if isinstance(l, layers.Conv2D)]
+    denses = [l.name for l in all_layers if _prunable(l) and isinstance(l, layers.Dense)]
+
+    pruner = _ChainPruner(
+        conv_targets=convs[-conv_layers:] if conv_layers else [],
+        filter_fraction=filter_fraction,
+        # The output unit is never pruned
+        dense_targets=denses[:-1] if unit_fraction else [],
+        unit_fraction=unit_fraction
+    )
+    new_layers, _ = pruner.rebuild(model.layers, None)
+
+    pruned = models.Sequential([layers.Input(shape=model.inputs[0].shape[1:])] + new_layers,
+                               name=model.name)
+    for layer in _iter_layers(pruned):
+        if layer.name in pruner.weights:
+            layer.set_weights(pruner.weights[layer.name])
+    return pruned, pruner.pruned
+
+
+def magnitude_masks(model, sparsity):
+    """
+    Zero the smallest-magnitude weights of every Conv2D and Dense kernel
+
+    Args:
+        model: Keras model, modified in place
+        sparsity: Fraction of each kernel's weights set to zero
+
+    Returns:
+        Dictionary of layer name to boolean keep-mask
+    """
+    masks = {}
+    for layer in _iter_layers(model):
+        if not _prunable(layer) or sparsity <= 0:
+            continue
+        weights = layer.get_weights()
+        threshold = np.quantile(np.abs(weights[0]), sparsity)
+        mask = np.abs(weights[0]) > threshold
+        weights[0] = weights[0] * mask
+        layer.set_weights(weights)
+        masks[layer.name] = mask
+    return masks
+
+
+class PruningMaskCallback(Callback):
+    """Keeps pruned weights at zero while fine-tuning"""
+
+    def __init__(self, masks):
+        super().__init__()
+        self.masks = masks
+        self.targets = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.targets is None:
+            self.targets = [l for l in _iter_layers(self.model) if l.name in self.masks]
+        for layer in self.targets:
+            layer.kernel.assign(layer.kernel * self.masks[layer.name])
+
+
+def cluster_weights(model, clusters=16, iterations=10):
+    """
+    Snap each kernel's non-zero weights to a small set of shared values
+
+    One-dimensional k-means per layer, with pruned zeros left untouched, so
+    the saved weights compress to roughly log2(clusters) bits each.
+
+    Args:
+        model: Keras model, modified in place
+        clusters: Number of distinct non-zero values per kernel
+        iterations: k-means iterations
+    """
+    for layer in _iter_layers(model):
+        if not _prunable(layer):
+            continue
+        weights = layer.get_weights()
+        kernel = weights[0]
+        nonzero = kernel != 0
+        values = kernel[nonzero]
+        if values.size <= clusters:
+            continue
+
+        centroids = np.linspace(values.min(), values.max(), clusters)
+        for _ in range(iterations):
+            assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, values)
+            sums = np.bincount(assignment, weights=values, minlength=clusters)
+            counts = np.bincount(assignment, minlength=clusters)
+            centroids = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+            centroids.sort()
+
+        assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, values)
+        kernel[nonzero] = centroids[assignment].astype(kernel.dtype)
+        weights[0] = kernel
+        layer.set_weights(weights)
+
+
+def sparsity(model):
+    """Fraction of zero weights across all Conv2D and Dense kernels"""
+    total = zeros = 0
+    for layer in _iter_layers(model):
+        if _prunable(layer):
+            kernel = layer.get_weights()[0]
+            total += kernel.size
+            zeros += int(np.sum(kernel == 0))
+    return zeros / total if total else 0.0
+
+
+def fine_tune(model, train_dir='data/train', epochs=2, steps_per_epoch=None,
+              learning_rate=1e-5, masks=None):
+    """
+    Briefly fine-tune a compressed model
+
+    Pruned conv layers are unfrozen; the rest of the backbone stays frozen.
+
+    Args:
+        model: Keras model
+        train_dir: Directory of class folders
+        epochs: Number of fine-tuning epochs
+        steps_per_epoch: Limit on batches per epoch (None for the full set)
+        learning_rate: Learning rate for optimizer
+        masks: Magnitude-pruning masks to keep applied
+
+    Returns:
+        Training history
+    """
+    from src.preprocessing import ImagePreprocessor
+
+    train_gen, val_gen = ImagePreprocessor().create_data_generators(train_dir)
+
+    model.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='binary_crossentropy',
+        metrics=['accuracy']
+    )
+    callbacks = [PruningMaskCallback(masks)] if masks else []
+
+    return model.fit(
+        train_gen,
+        steps_per_epoch=steps_per_epoch or train_gen.samples // train_gen.batch_size,
+        epochs=epochs,
+        validation_data=val_gen,
+        validation_steps=val_gen.samples // val_gen.batch_size,
+        callbacks=callbacks,
+        verbose=1
+    )
+
+
+def compress_model(model_path='models/cats_dogs_model.h5', output_path='models/pruned_model.h5',
+                   conv_layers=3, filter_fraction=0.5, unit_fraction=0.5, weight_sparsity=0.0,
+                   clusters=0, train_dir='data/train', test_dir='data/test', epochs=2,
+                   steps_per_epoch=None, metrics_path='models/metrics.json',
+                   report_path='models/compression_report.json'):
+    """
+    Prune, fine-tune, optionally cluster, export and report
+
+    Args:
+        model_path: Baseline model
+        output_path: Where to save the compressed model
+        conv_layers: Final Conv2D layers to prune filters from (0 to skip)
+        filter_fraction: Fraction of filters removed per pruned conv layer
+        unit_fraction: Fraction of units removed per hidden Dense layer
+        weight_sparsity: Additional magnitude-pruning sparsity (0 to skip)
+        clusters: Shared weight values per kernel (0 to skip clustering)
+        train_dir: Directory of class folders for fine-tuning
+        test_dir: Directory of class folders for evaluation
+        epochs: Fine-tuning epochs (0 to skip)
+        steps_per_epoch: Limit on fine-tuning batches per epoch
+        metrics_path: Baseline metrics.json
+        report_path: Where to save the JSON report
+
+    Returns:
+        Report dictionary
+    """
+    model = keras.models.load_model(model_path, compile=False)
+
+    pruned_layers = []
+    if conv_layers or unit_fraction:
+        model, pruned_layers = prune_filters(model, conv_layers, filter_fraction, unit_fraction)
+        for name, kept, original in pruned_layers:
+            print(f"Pruned {name}: kept {kept} of {original}")
+
+        # Let the pruned filters adapt; everything else in the backbone stays frozen
+        pruned_names = {name for name, _, _ in pruned_layers}
+        try:
+            for layer in find_backbone(model).layers:
+                layer.trainable = layer.name in pruned_names
+        except ValueError:
+            pass
+
+    masks = magnitude_masks(model, weight_sparsity) if weight_sparsity else None
+
+    if epochs:
+        fine_tune(model, train_dir, epochs, steps_per_epoch, masks=masks)
+
+    if clusters:
+        cluster_weights(model, clusters)
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    model.save(output_path)
+
+    # Zeroed and clustered weights only shrink on disk once compressed
+    compressed_path = Path(str(output_path) + '.gz')
+    with open(output_path, 'rb') as src, gzip.open(compressed_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+    final_sparsity = sparsity(model)
+    del model
+    tf.keras.backend.clear_session()
+
+    baseline, compressed = compare_models([model_path, str(output_path)], test_dir, report_path=None)
+    baseline_metrics = None
+    if Path(metrics_path).exists():
+        with open(metrics_path, 'r') as f:
+            baseline_metrics = json.load(f)
+
+    report = {
+        'baseline': dict(baseline, reported_metrics=baseline_metrics),
+        'compressed': dict(
+            compressed,
+            sparsity=final_sparsity,
+            compressed_file_size_mb=os.path.getsize(compressed_path) / (1024 * 1024)
+        ),
+        'settings': {
+            'conv_layers': conv_layers,
+            'filter_fraction': filter_fraction,
+            'unit_fraction': unit_fraction,
+            'weight_sparsity': weight_sparsity,
+            'clusters': clusters,
+            'fine_tune_epochs': epochs
+        },
+        'pruned_layers': [
+            {'layer': name, 'kept': kept, 'original': original}
+            for name, kept, original in pruned_layers
+        ],
+        'accuracy_change': (
+            compressed['accuracy'] - baseline['accuracy']
+            if compressed['accuracy'] is not None and baseline['accuracy'] is not None else None
+        ),
+        'size_ratio': compressed['file_size_mb'] / baseline['file_size_mb'],
+        'speedup': baseline['latency_ms'] / compressed['latency_ms'],
+        'created_at': datetime.now().isoformat()
+    }
+
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Compression report saved to {report_path}")
+
+    return report
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Prune and cluster a trained model")
+    parser.add_argument('--model', default='models/cats_dogs_model.h5')
+    parser.add_argument('--output', default='models/pruned_model.h5')
+    parser.add_argument('--conv-layers', type=int, default=3,
+                        help="Final conv layers to remove filters from (3 = VGG16 block5)")
+    parser.add_argument('--filter-fraction', type=float, default=0.5)
+    parser.add_argument('--unit-fraction', type=float, default=0.5)
+    parser.add_argument('--sparsity', type=float, default=0.0,
+                        help="Additional magnitude-pruning sparsity per kernel")
+    parser.add_argument('--clusters', type=int, default=0,
+                        help="Shared weight values per kernel (0 disables clustering)")
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--steps-per-epoch', type=int, default=None)
+    parser.add_argument('--train-dir', default='data/train')
+    parser.add_argument('--test-dir', default='data/test')
+    args = parser.parse_args()
+
+    report = compress_model(
+        args.model, args.output, args.conv_layers, args.filter_fraction, args.unit_fraction,
+        args.sparsity, args.clusters, args.train_dir, args.test_dir, args.epochs,
+        args.steps_per_epoch
+    )
+    baseline, compressed = report['baseline'], report['compressed']
+    print(f"Accuracy: {baseline['accuracy']:.4f} -> {compressed['accuracy']:.4f}")
+    print(f"Size: {baseline['file_size_mb']:.1f} MB -> {compressed['file_size_mb']:.1f} MB "
+          f"({compressed['compressed_file_size_mb']:.1f} MB gzipped)")
+    print(f"Latency: {baseline['latency_ms']:.1f} ms -> {compressed['latency_ms']:.1f} ms")
+    print(f"Sparsity: {compressed['sparsity']:.1%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
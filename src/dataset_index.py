@@ -0,0 +1,394 @@
+"""
+Dataset Index for Cats vs Dogs Classification
+SQLite manifest of image files, classes, sizes and dimensions, kept up to date
+incrementally so dataset statistics are served without touching the filesystem
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from src.image_store import IMAGE_EXTENSIONS
+
+
+# Upper bounds (exclusive) of the image side-length buckets, in pixels
+SIZE_BUCKETS = (128, 256, 512, 1024)
+ASPECT_BUCKETS = (0.75, 1.0, 1.34)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    split TEXT NOT NULL,
+    class TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (path, split, class)
+);
+CREATE INDEX IF NOT EXISTS files_split_class ON files (split, class);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+
+def read_image_header(path):
+    """
+    Read image dimensions without decoding pixel data
+
+    Args:
+        path: Path to image file
+
+    Returns:
+        (width, height), or (None, None) if the header is unreadable
+    """
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+def _bucket(value, bounds):
+    """Index of the first bound greater than value"""
+    for i, bound in enumerate(bounds):
+        if value < bound:
+            return i
+    return len(bounds)
+
+
+class DatasetIndex:
+    """Incrementally maintained index of the training, test and retraining images"""
+
+    def __init__(self, db_path, splits, store=None, store_split='retraining'):
+        """
+        Initialize dataset index
+
+        Args:
+            db_path: SQLite database file
+            splits: Mapping of split name to a directory of class folders
+            store: Optional ImageStore indexed as its own split
+            store_split: Split name used for the image store
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.splits = {name: Path(path) for name, path in splits.items()}
+        self.store = store
+        self.store_split = store_split
+        self._lock = threading.RLock()
+        self._summary = None
+        self._data_version = None
+        self._watcher = None
+        self._stop = threading.Event()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        """Stop the watcher and close the database"""
+        self.stop_watcher()
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _source_changed(self, path):
+        """Return the new mtime of a directory or manifest if it changed since the last scan"""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = 0.0
+        row = self._conn.execute(
+            "SELECT mtime FROM sources WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is not None and row[0] == mtime:
+            return None
+        return mtime
+
+    def _mark_source(self, path, mtime):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources (path, mtime) VALUES (?, ?)", (str(path), mtime)
+        )
+
+    def _sync_entries(self, split, class_name, current):
+        """
+        Reconcile one (split, class) with the files that currently exist
+
+        Args:
+            split: Split name
+            class_name: Class name
+            current: Mapping of path to os.stat_result
+
+        Returns:
+            Number of rows added, updated or removed
+        """
+        known = dict(self._conn.execute(
+            "SELECT path, mtime FROM files WHERE split = ? AND class = ?", (split, class_name)
+        ).fetchall())
+
+        removed = [(path, split, class_name) for path in known if path not in current]
+        changed = []
+        for path, stat in current.items():
+            if known.get(path) != stat.st_mtime:
+                width, height = read_image_header(path)
+                changed.append((path, split, class_name, stat.st_size, width, height, stat.st_mtime))
+
+        if removed:
+            self._conn.executemany(
+                "DELETE FROM files WHERE path = ? AND split = ? AND class = ?", removed
+            )
+        if changed:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", changed
+            )
+        return len(removed) + len(changed)
+
+    def _scan_directory(self, split, class_dir):
+        """Rescan one class directory if its mtime changed"""
+        mtime = self._source_changed(class_dir)
+        if mtime is None:
+            return 0
+
+        current = {}
+        if class_dir.is_dir():
+            with os.scandir(class_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS:
+                        current[entry.path] = entry.stat()
+
+        changes = self._sync_entries(split, class_dir.name, current)
+        self._mark_source(class_dir, mtime)
+        return changes
+
+    def sync_store(self):
+        """
+        Index the image store from its manifests
+
+        Stored objects are immutable (named by content hash), so only hashes
+        that appeared or disappeared since the last sync are examined. The
+        manifests are re-read from disk, since other workers append to them.
+        """
+        if self.store is None:
+            return 0
+
+        changes = 0
+        with self._lock:
+            stale = {}
+            for class_name in self.store.manifests:
+                manifest = self.store.manifests_dir / f"{class_name}.jsonl"
+                mtime = self._source_changed(manifest)
+                if mtime is not None:
+                    stale[class_name] = (manifest, mtime)
+            if not stale:
+                return 0
+
+            manifests = self.store.snapshot()
+            for class_name, (manifest, mtime) in stale.items():
+                known = {row[0] for row in self._conn.execute(
+                    "SELECT path FROM files WHERE split = ? AND class = ?",
+                    (self.store_split, class_name)
+                )}
+                listed = {
+                    str(self.store.object_path(digest, entry['ext']))
+                    for digest, entry in manifests.get(class_name, {}).items()
+                }
+
+                removed = [(path, self.store_split, class_name) for path in known - listed]
+                added = []
+                for path in listed - known:
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    width, height = read_image_header(path)
+                    added.append((path, self.store_split, class_name, stat.st_size,
+                                  width, height, stat.st_mtime))
+
+                self._conn.executemany(
+                    "DELETE FROM files WHERE path = ? AND split = ? AND class = ?", removed
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", added
+                )
+                self._mark_source(manifest, mtime)
+                changes += len(removed) + len(added)
+
+            self._conn.commit()
+            self._summary = None
+        return changes
+
+    def refresh(self):
+        """
+        Bring the index up to date
+
+        Only directories whose mtime changed are listed, so an idle dataset
+        costs one stat() per class directory.
+
+        Returns:
+            Number of rows that changed
+        """
+        changes = 0
+        with self._lock:
+            # data_version moves when another process commits to the shared
+            # database, which leaves this process's cached summary stale
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._summary = None
+
+            for split, root in self.splits.items():
+                if not root.is_dir():
+                    continue
+                for class_dir in sorted(root.iterdir()):
+                    if class_dir.is_dir():
+                        changes += self._scan_directory(split, class_dir)
+
+            self._conn.commit()
+            if changes:
+                self._summary = None
+
+        return changes + self.sync_store()
+
+    def add_file(self, path, split, class_name):
+        """
+        Record a single new file without rescanning its directory
+
+        Args:
+            path: Path to the image
+            split: Split name
+            class_name: Class name
+        """
+        stat = os.stat(path)
+        width, height = read_image_header(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(path), split, class_name, stat.st_size, width, height, stat.st_mtime)
+            )
+            self._conn.commit()
+            self._summary = None
+
+    # ------------------------------------------------------------------
+    # Watcher
+    # ------------------------------------------------------------------
+
+    def start_watcher(self, interval=5.0):
+        """
+        Poll for filesystem changes in a background thread
+
+        Args:
+            interval: Seconds between polls
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Dataset index refresh failed: {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, name='dataset-index-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        """Stop the background watcher"""
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _build_summary(self):
+        """Aggregate the index into per-split statistics"""
+        summary = {}
+        rows = self._conn.execute(
+            "SELECT split, class, width, height, size FROM files"
+        ).fetchall()
+
+        for split, class_name, width, height, size in rows:
+            split_stats = summary.setdefault(split, {
+                'counts': {},
+                'bytes': 0,
+                'size_distribution': [0] * (len(SIZE_BUCKETS) + 1),
+                'aspect_distribution': [0] * (len(ASPECT_BUCKETS) + 1),
+                'width_sum': 0,
+                'height_sum': 0,
+                'measured': 0,
+                'unreadable': 0
+            })
+            split_stats['counts'][class_name] = split_stats['counts'].get(class_name, 0) + 1
+            split_stats['bytes'] += size
+
+            if width and height:
+                split_stats['size_distribution'][_bucket(max(width, height), SIZE_BUCKETS)] += 1
+                split_stats['aspect_distribution'][_bucket(width / height, ASPECT_BUCKETS)] += 1
+                split_stats['width_sum'] += width
+                split_stats['height_sum'] += height
+                split_stats['measured'] += 1
+            else:
+                split_stats['unreadable'] += 1
+
+        for split_stats in summary.values():
+            counts = split_stats['counts']
+            measured = split_stats.pop('measured')
+            width_sum = split_stats.pop('width_sum')
+            height_sum = split_stats.pop('height_sum')
+            split_stats['mean_width'] = width_sum / measured if measured else None
+            split_stats['mean_height'] = height_sum / measured if measured else None
+            split_stats['class_balance'] = (
+                min(counts.values()) / max(counts.values()) if counts and max(counts.values()) else None
+            )
+
+        summary['_generated_at'] = time.time()
+        return summary
+
+    def summary(self):
+        """Cached aggregate statistics, rebuilt only after the index changes"""
+        summary = self._summary
+        if summary is None:
+            with self._lock:
+                if self._summary is None:
+                    self._summary = self._build_summary()
+                summary = self._summary
+        return summary
+
+    def statistics(self, split):
+        """
+        Per-class image counts for a split, in the format of get_dataset_statistics
+
+        Args:
+            split: Split name
+
+        Returns:
+            Dictionary of class counts plus 'total'
+        """
+        counts = self.summary().get(split, {}).get('counts', {})
+        stats = dict(counts)
+        stats['total'] = sum(counts.values())
+        return stats
+
+    def detailed_statistics(self):
+        """Size, aspect ratio and class balance statistics for every split"""
+        summary = self.summary()
+        return {
+            'size_buckets': [f"<{b}" for b in SIZE_BUCKETS] + [f">={SIZE_BUCKETS[-1]}"],
+            'aspect_buckets': [f"<{b}" for b in ASPECT_BUCKETS] + [f">={ASPECT_BUCKETS[-1]}"],
+            'splits': {k: v for k, v in summary.items() if not k.startswith('_')},
+            'generated_at': summary['_generated_at']
+        }
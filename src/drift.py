@@ -0,0 +1,531 @@
+"""
+Data-Drift Monitor for Cats vs Dogs Inference
+Keeps fixed-bin histograms of input statistics (brightness, size, aspect
+ratio) and of the model's output per time window, and compares each window
+with a reference built from the training images using PSI and a binned
+Kolmogorov-Smirnov test. A histogram is a few dozen counters, so an update
+costs one bisect per feature and memory does not grow with traffic. Counts
+are additive, so API workers can merge theirs in a shared SQLite file.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import bisect
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import deque
+
+import numpy as np
+
+
+DRIFT_REFERENCE_PATH = Path(os.getenv('DRIFT_REFERENCE_PATH', 'models/drift_reference.json'))
+DRIFT_WINDOW_SECONDS = float(os.getenv('DRIFT_WINDOW_SECONDS', '300'))
+DRIFT_WINDOWS = int(os.getenv('DRIFT_WINDOWS', '12'))
+DRIFT_BINS = int(os.getenv('DRIFT_BINS', '10'))
+# Windows with fewer observations are reported but never flagged; PSI of a
+# sample from the reference distribution itself is about bins / samples
+DRIFT_MIN_SAMPLES = int(os.getenv('DRIFT_MIN_SAMPLES', '100'))
+# Conventional PSI reading: < 0.1 stable, 0.1-0.25 moderate, > 0.25 major shift
+DRIFT_PSI_ALERT = float(os.getenv('DRIFT_PSI_ALERT', '0.25'))
+DRIFT_KS_ALPHA = float(os.getenv('DRIFT_KS_ALPHA', '0.01'))
+# Seconds between merges of a worker's new counts into the shared histograms
+DRIFT_FLUSH_SECONDS = float(os.getenv('DRIFT_FLUSH_SECONDS', '5'))
+
+# Bin edges used for a feature the reference does not cover; the window
+# histograms are still kept so they can be inspected
+DEFAULT_EDGES = {
+    'brightness': list(np.linspace(0, 255, DRIFT_BINS + 1)[1:-1]),
+    'width': [64, 128, 192, 256, 320, 384, 448, 512, 640, 800, 1024, 1600, 2400, 4000],
+    'height': [64, 128, 192, 256, 320, 384, 448, 512, 640, 800, 1024, 1600, 2400, 4000],
+    'aspect_ratio': [0.5, 0.6, 0.7, 0.75, 0.8, 0.9, 1.0, 1.1, 1.25, 1.34, 1.5, 1.78, 2.0],
+    'probability': list(np.linspace(0, 1, DRIFT_BINS + 1)[1:-1]),
+    'confidence': list(np.linspace(0.5, 1, DRIFT_BINS + 1)[1:-1]),
+}
+FEATURES = tuple(DEFAULT_EDGES)
+
+# Share of a bin given to empty bins so PSI stays finite
+_PSI_EPSILON = 1e-4
+
+# Shared histograms, keyed by the bin edges they were counted into
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bins (
+    edges TEXT NOT NULL,
+    start REAL NOT NULL,
+    feature TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (edges, start, feature, bin)
+);
+CREATE TABLE IF NOT EXISTS sums (
+    edges TEXT NOT NULL,
+    start REAL NOT NULL,
+    feature TEXT NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (edges, start, feature)
+);
+"""
+
+
+def image_brightness(pixels):
+    """Mean pixel value (0-255) of an (H, W, 3) array, from every 8th row and column"""
+    return float(pixels[::8, ::8].mean())
+
+
+def image_features(width, height, pixels):
+    """
+    Input statistics of one image
+
+    Args:
+        width: Width of the uploaded image, from its header
+        height: Height of the uploaded image
+        pixels: (H, W, 3) array of the image as the model sees it
+
+    Returns:
+        Dictionary of feature values
+    """
+    return {'width': width, 'height': height, 'aspect_ratio': width / height,
+            'brightness': image_brightness(pixels)}
+
+
+def prediction_features(probability):
+    """Output statistics of one prediction"""
+    return {'probability': probability, 'confidence': max(probability, 1 - probability)}
+
+
+def psi(expected, actual):
+    """Population stability index between two histograms over the same bins"""
+    p = np.maximum(np.asarray(expected, dtype=np.float64) / max(sum(expected), 1), _PSI_EPSILON)
+    q = np.maximum(np.asarray(actual, dtype=np.float64) / max(sum(actual), 1), _PSI_EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks_test(expected, actual):
+    """
+    Two-sample Kolmogorov-Smirnov test on binned data
+
+    The statistic is the largest CDF gap at the bin edges, so it never
+    exceeds the exact one; the p-value uses the asymptotic Kolmogorov
+    distribution.
+
+    Returns:
+        Tuple of (statistic, p-value)
+    """
+    n, m = sum(expected), sum(actual)
+    if not n or not m:
+        return None, None
+    gap = np.abs(np.cumsum(expected) / n - np.cumsum(actual) / m)
+    statistic = float(gap.max())
+    effective = math.sqrt(n * m / (n + m))
+    lam = (effective + 0.12 + 0.11 / effective) * statistic
+    if lam < 1e-3:
+        return statistic, 1.0
+    p_value = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k * k * lam * lam) for k in range(1, 101))
+    return statistic, float(min(max(p_value, 0.0), 1.0))
+
+
+def _edges_key(edges):
+    """Short identifier of a set of bin edges; shared counts are only merged over equal bins"""
+    return hashlib.sha1(json.dumps(edges, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class _Window:
+    """Histograms and running sums of every feature over one time window"""
+
+    def __init__(self, start, edges):
+        self.start = start
+        self.counts = {name: [0] * (len(feature_edges) + 1) for name, feature_edges in edges.items()}
+        self.sums = dict.fromkeys(edges, 0.0)
+
+
+class DriftMonitor:
+    """
+    Windowed feature histograms compared against a training reference
+
+    observe() is safe to call from any thread; it holds a lock for a few
+    counter increments. With a shared path, each process adds its new counts
+    to a SQLite file every few seconds and reports the merged histograms of
+    all processes.
+    """
+
+    def __init__(self, reference_path=DRIFT_REFERENCE_PATH, window_seconds=DRIFT_WINDOW_SECONDS,
+                 windows=DRIFT_WINDOWS, min_samples=DRIFT_MIN_SAMPLES,
+                 psi_alert=DRIFT_PSI_ALERT, ks_alpha=DRIFT_KS_ALPHA, shared_path=None):
+        """
+        Initialize monitor
+
+        Args:
+            reference_path: JSON reference written by `python -m src.drift reference`
+            window_seconds: Length of one window
+            windows: Completed windows kept besides the current one
+            min_samples: Observations a window needs before it can be flagged
+            psi_alert: PSI above which a feature is flagged
+            ks_alpha: KS p-value below which a feature is flagged
+            shared_path: SQLite file merging the histograms of several
+                processes (default: this process only)
+        """
+        self.reference_path = Path(reference_path)
+        self.window_seconds = window_seconds
+        self.windows = windows
+        self.min_samples = min_samples
+        self.psi_alert = psi_alert
+        self.ks_alpha = ks_alpha
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=windows)
+        self._reference_mtime = None
+        self.reference = None
+        self.edges = dict(DEFAULT_EDGES)
+        self._edges_key = _edges_key(self.edges)
+        self._load_reference()
+        self._window = _Window(self._window_start(time.time()), self.edges)
+
+        # Counts not yet merged into the shared file, by window start
+        self._pending = {}
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        if shared_path is not None:
+            Path(shared_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(shared_path), timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def _window_start(self, now):
+        return math.floor(now / self.window_seconds) * self.window_seconds
+
+    def _load_reference(self):
+        """(Re)load the reference when its file changed; returns True if it did"""
+        try:
+            mtime = self.reference_path.stat().st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._reference_mtime:
+            return False
+        self._reference_mtime = mtime
+
+        reference = None
+        if mtime is not None:
+            try:
+                with open(self.reference_path, 'r') as f:
+                    reference = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read drift reference {self.reference_path}: {e}")
+        self.reference = reference
+        self.edges = dict(DEFAULT_EDGES)
+        if reference is not None:
+            for name, feature in reference['features'].items():
+                self.edges[name] = feature['edges']
+        self._edges_key = _edges_key(self.edges)
+        return True
+
+    def observe(self, features, now=None):
+        """
+        Add one input's feature values to the current window
+
+        Args:
+            features: Dictionary of feature name to value; unknown names are ignored
+            now: Observation time (default: time.time())
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._conn is not None:
+                start = self._window_start(now)
+                window = self._pending.get(start)
+                if window is None:
+                    window = self._pending[start] = _Window(start, self.edges)
+            else:
+                window = self._window
+                if now >= window.start + self.window_seconds:
+                    window = self._rotate(now)
+            for name, value in features.items():
+                counts = window.counts.get(name)
+                if counts is not None:
+                    counts[bisect.bisect_right(self.edges[name], value)] += 1
+                    window.sums[name] += value
+
+    def _rotate(self, now):
+        """Close the current window; called with the lock held"""
+        if any(sum(counts) for counts in self._window.counts.values()):
+            self._history.append(self._window)
+        self._window = _Window(self._window_start(now), self.edges)
+        return self._window
+
+    # ------------------------------------------------------------------
+    # Shared histograms
+    # ------------------------------------------------------------------
+
+    def start(self, interval=DRIFT_FLUSH_SECONDS):
+        """
+        Merge new counts into the shared file in a background thread
+
+        Args:
+            interval: Seconds between merges
+        """
+        if self._conn is None or self._flusher is not None:
+            return
+
+        def flush_loop():
+            while not self._stop.wait(interval):
+                self.flush()
+
+        self._stop.clear()
+        self._flusher = threading.Thread(target=flush_loop, name='drift-flush', daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stop the background thread and merge the remaining counts"""
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush()
+
+    def flush(self):
+        """Add the counts observed since the last flush to the shared file"""
+        if self._conn is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            key = self._edges_key
+        if not pending:
+            return
+
+        bins, sums = [], []
+        for start, window in pending.items():
+            for name, counts in window.counts.items():
+                bins.extend((key, start, name, i, count) for i, count in enumerate(counts) if count)
+                if any(counts):
+                    sums.append((key, start, name, window.sums[name]))
+        oldest = self._window_start(time.time()) - self.windows * self.window_seconds
+
+        with self._db_lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO bins VALUES (?, ?, ?, ?, ?) ON CONFLICT (edges, start, feature, bin) "
+                    "DO UPDATE SET count = count + excluded.count", bins
+                )
+                self._conn.executemany(
+                    "INSERT INTO sums VALUES (?, ?, ?, ?) ON CONFLICT (edges, start, feature) "
+                    "DO UPDATE SET total = total + excluded.total", sums
+                )
+                self._conn.execute("DELETE FROM bins WHERE start < ?", (oldest,))
+                self._conn.execute("DELETE FROM sums WHERE start < ?", (oldest,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                print(f"Could not merge drift histograms: {e}")
+                self._restore(pending, key)
+
+    def _restore(self, pending, key):
+        """Put counts that could not be written back in the pending windows"""
+        with self._lock:
+            if key != self._edges_key:
+                return
+            for start, window in pending.items():
+                current = self._pending.setdefault(start, _Window(start, self.edges))
+                for name, counts in window.counts.items():
+                    for i, count in enumerate(counts):
+                        current.counts[name][i] += count
+                    current.sums[name] += window.sums[name]
+
+    def _shared_windows(self, key, now):
+        """Merged current and retained windows from the shared file, newest first"""
+        current = self._window_start(now)
+        with self._db_lock:
+            bins = self._conn.execute(
+                "SELECT start, feature, bin, count FROM bins WHERE edges = ? AND start >= ?",
+                (key, current - self.windows * self.window_seconds)
+            ).fetchall()
+            sums = self._conn.execute(
+                "SELECT start, feature, total FROM sums WHERE edges = ? AND start >= ?",
+                (key, current - self.windows * self.window_seconds)
+            ).fetchall()
+
+        windows = {current: _Window(current, self.edges)}
+        for start, name, i, count in bins:
+            window = windows.setdefault(start, _Window(start, self.edges))
+            if name in window.counts and i < len(window.counts[name]):
+                window.counts[name][i] = count
+        for start, name, total in sums:
+            if start in windows and name in windows[start].sums:
+                windows[start].sums[name] = total
+
+        history = sorted((start for start in windows if start < current), reverse=True)
+        return [windows[current]] + [windows[start] for start in history[:self.windows]]
+
+    def _compare(self, window):
+        """Per-feature statistics of one window"""
+        features = {}
+        flagged = []
+        for name, counts in window.counts.items():
+            n = sum(counts)
+            feature = {'count': n, 'mean': window.sums[name] / n if n else None,
+                       'psi': None, 'ks': None, 'p_value': None, 'drift': False}
+            reference = (self.reference or {}).get('features', {}).get(name)
+            if n and reference is not None and len(reference['counts']) == len(counts):
+                feature['psi'] = psi(reference['counts'], counts)
+                feature['ks'], feature['p_value'] = ks_test(reference['counts'], counts)
+                feature['reference_mean'] = reference['mean']
+                feature['drift'] = n >= self.min_samples and (
+                    feature['psi'] > self.psi_alert or feature['p_value'] < self.ks_alpha
+                )
+                if feature['drift']:
+                    flagged.append(name)
+            features[name] = feature
+        return {
+            'start': datetime.fromtimestamp(window.start).isoformat(),
+            'end': datetime.fromtimestamp(window.start + self.window_seconds).isoformat(),
+            'features': features,
+            'drifted_features': flagged
+        }
+
+    def snapshot(self, histograms=False):
+        """
+        Drift statistics of the current and retained windows, newest first
+
+        Args:
+            histograms: Include the bin edges and counts of every window
+
+        Returns:
+            Dictionary with the reference summary and one report per window
+        """
+        with self._lock:
+            if self._load_reference():
+                # Bins changed; windows over the old bins cannot be compared
+                self._history.clear()
+                self._pending.clear()
+                self._window = _Window(self._window_start(time.time()), self.edges)
+            elif time.time() >= self._window.start + self.window_seconds:
+                self._rotate(time.time())
+            key = self._edges_key
+
+        shared = None
+        if self._conn is not None:
+            self.flush()
+            shared = self._shared_windows(key, time.time())
+
+        with self._lock:
+            windows = shared or [self._window] + list(reversed(self._history))
+            reports = [self._compare(window) for window in windows]
+            if histograms:
+                for report, window in zip(reports, windows):
+                    for name, feature in report['features'].items():
+                        feature['counts'] = list(window.counts[name])
+
+        result = {
+            'window_seconds': self.window_seconds,
+            'thresholds': {'psi': self.psi_alert, 'ks_p_value': self.ks_alpha,
+                           'min_samples': self.min_samples},
+            'reference': None,
+            'current': reports[0],
+            'windows': reports[1:],
+            'drift': bool(reports[0]['drifted_features'])
+        }
+        if self.reference is not None:
+            result['reference'] = {key: self.reference.get(key)
+                                   for key in ('created', 'source', 'images', 'model')}
+        if histograms:
+            result['edges'] = self.edges
+        return result
+
+
+def _reference_feature(values, bins):
+    """Equal-frequency bin edges and counts of one feature's reference values"""
+    values = np.asarray(values, dtype=np.float64)
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+    counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+    return {'edges': [float(edge) for edge in edges], 'counts': [int(c) for c in counts],
+            'mean': float(values.mean())}
+
+
+def build_reference(image_paths, bins=DRIFT_BINS, model_path=None, batch_size=32):
+    """
+    Reference histograms from the training images
+
+    Args:
+        image_paths: Images to describe
+        bins: Equal-frequency bins per feature (fewer if values repeat)
+        model_path: Also record the model's probability and confidence
+            distribution on these images
+        batch_size: Images per model batch
+
+    Returns:
+        Reference dictionary as read by DriftMonitor
+    """
+    from src.image_guard import ImageRejected, check_image, decode_for_model
+
+    values = {name: [] for name in FEATURES}
+    pixels = []
+    for i, path in enumerate(image_paths):
+        try:
+            data = Path(path).read_bytes()
+            _, width, height = check_image(data)
+            image = np.asarray(decode_for_model(data, (224, 224)))
+        except (OSError, ImageRejected) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        for name, value in image_features(width, height, image).items():
+            values[name].append(value)
+        if model_path is not None:
+            pixels.append(image)
+        if (i + 1) % 500 == 0:
+            print(f"Described {i + 1}/{len(image_paths)} images")
+
+    if model_path is not None and pixels:
+        from src.prediction import load_predictor
+        predictor = load_predictor(model_path=str(model_path))
+        for start in range(0, len(pixels), batch_size):
+            batch = np.stack(pixels[start:start + batch_size]).astype(np.float32) / 255.0
+            probabilities, _ = predictor.predict_staged(batch)
+            for probability in probabilities:
+                for name, value in prediction_features(float(probability)).items():
+                    values[name].append(value)
+
+    return {
+        'created': datetime.now().isoformat(),
+        'images': len(values['width']),
+        'model': str(model_path) if model_path is not None else None,
+        'features': {name: _reference_feature(feature_values, bins)
+                     for name, feature_values in values.items() if feature_values}
+    }
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Data-drift monitoring tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ref_parser = subparsers.add_parser('reference', help="Build the training reference")
+    ref_parser.add_argument('--image-dir', default='data/train')
+    ref_parser.add_argument('--limit', type=int, default=2000,
+                            help="Images sampled evenly from the directory")
+    ref_parser.add_argument('--bins', type=int, default=DRIFT_BINS)
+    ref_parser.add_argument('--model', default=None,
+                            help="Model whose outputs to record, e.g. models/cats_dogs_model.h5")
+    ref_parser.add_argument('--output', default=str(DRIFT_REFERENCE_PATH))
+
+    args = parser.parse_args()
+
+    paths = sorted(path for path in Path(args.image_dir).rglob('*')
+                   if path.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    if not paths:
+        print(f"No images found in {args.image_dir}")
+        return 1
+    if args.limit and len(paths) > args.limit:
+        paths = [paths[i] for i in np.linspace(0, len(paths) - 1, args.limit).astype(int)]
+
+    reference = build_reference(paths, bins=args.bins, model_path=args.model)
+    reference['source'] = args.image_dir
+    with open(args.output, 'w') as f:
+        json.dump(reference, f, indent=4)
+    print(f"Reference of {reference['images']} images saved to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
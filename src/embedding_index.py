@@ -0,0 +1,659 @@
+"""
+Embedding Index for Cats vs Dogs Similarity Search
+Keeps the backbone embedding of every training and retraining image in
+append-only files, stored as float16 vectors or product-quantization codes,
+and answers nearest-neighbour queries with vectorized NumPy (exact cosine
+search, or asymmetric-distance search over PQ codes)
+"""
+
+import os
+import sys
+import json
+import fcntl
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from src.image_store import IMAGE_EXTENSIONS, ImageStore, file_sha256
+
+
+EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', 'models/embedding_index')
+# 'float16' keeps every vector (exact search); 'pq' keeps EMBEDDING_PQ_SUBSPACES
+# bytes per image and searches approximately
+EMBEDDING_STORAGE = os.getenv('EMBEDDING_STORAGE', 'float16')
+EMBEDDING_PQ_SUBSPACES = int(os.getenv('EMBEDDING_PQ_SUBSPACES', '64'))
+EMBEDDING_SYNC_SECONDS = float(os.getenv('EMBEDDING_SYNC_SECONDS', '30'))
+# How often the writer stats the store manifests for uploads made by other workers
+EMBEDDING_POLL_SECONDS = float(os.getenv('EMBEDDING_POLL_SECONDS', '1'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+
+# Rows converted and scored per matrix product; small enough to stay in cache
+_SEARCH_CHUNK = 1024
+# float16 -> float32 through a table: NumPy's own conversion branches per value
+# and is several times slower on embeddings full of ReLU zeros
+_HALF_TO_FLOAT = np.arange(65536, dtype=np.uint16).view(np.float16).astype(np.float32)
+# Vectors assigned to PQ centroids at a time, bounding the distance matrix
+_ASSIGN_CHUNK = 4096
+# Centroids per PQ subspace (one byte per code); a codebook is only trained
+# once there are at least this many vectors
+PQ_CENTROIDS = 256
+
+
+def model_signature(model_path):
+    """Identifies a model file version; cached probabilities are only reused for it"""
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def train_codebook(vectors, subspaces, iterations=20, seed=0):
+    """
+    Train a product quantizer with k-means in each subspace
+
+    Args:
+        vectors: (N, D) float32 vectors; D must be divisible by subspaces
+        subspaces: Number of subvectors (bytes per code)
+        iterations: k-means iterations
+        seed: Initialization seed
+
+    Returns:
+        (subspaces, PQ_CENTROIDS, D / subspaces) float32 centroids
+    """
+    count, dim = vectors.shape
+    if dim % subspaces:
+        raise ValueError(f"Embedding size {dim} is not divisible by {subspaces} subspaces")
+    if count < PQ_CENTROIDS:
+        raise ValueError(f"A PQ codebook needs at least {PQ_CENTROIDS} vectors, got {count}")
+    parts = vectors.reshape(count, subspaces, dim // subspaces).transpose(1, 0, 2)
+    k = PQ_CENTROIDS
+    rng = np.random.default_rng(seed)
+    centroids = parts[:, rng.choice(count, k, replace=False)].copy()
+
+    for _ in range(iterations):
+        codes = _assign(parts, centroids)
+        for m in range(subspaces):
+            counts = np.bincount(codes[:, m], minlength=k)
+            sums = np.stack([np.bincount(codes[:, m], weights=parts[m, :, j], minlength=k)
+                             for j in range(parts.shape[2])], axis=1)
+            filled = counts > 0
+            centroids[m, filled] = sums[filled] / counts[filled, None]
+            # Reseed empty clusters from random points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[m, empty] = parts[m, rng.choice(count, len(empty))]
+    return centroids
+
+
+def _assign(parts, centroids):
+    """Nearest centroid per subspace; parts is (M, N, d), returns (N, M) uint8"""
+    codes = np.empty((parts.shape[1], parts.shape[0]), dtype=np.uint8)
+    centroid_norms = np.einsum('mkd,mkd->mk', centroids, centroids)[:, None, :]
+    for start in range(0, parts.shape[1], _ASSIGN_CHUNK):
+        chunk = parts[:, start:start + _ASSIGN_CHUNK]
+        # |x - c|^2 without the |x|^2 term, which does not change the argmin
+        distances = centroid_norms - 2 * np.matmul(chunk, centroids.transpose(0, 2, 1))
+        codes[start:start + chunk.shape[1]] = distances.argmin(axis=2).T
+    return codes
+
+
+def pq_encode(vectors, centroids):
+    """PQ codes of (N, D) vectors as an (N, subspaces) uint8 array"""
+    subspaces, _, sub_dim = centroids.shape
+    parts = vectors.reshape(len(vectors), subspaces, sub_dim).transpose(1, 0, 2)
+    return _assign(parts, centroids)
+
+
+class _WriterLock:
+    """Non-blocking exclusive lock held by the one process that appends to an index"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = None
+
+    def acquire(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'w')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+class EmbeddingIndex:
+    """
+    Nearest-neighbour index over image embeddings, keyed by image SHA-256
+
+    entries.jsonl holds one record per row (id, label, path and the cached
+    probability with the model it came from) plus later probability
+    updates; vectors.f16 or codes.u8 holds the rows. Both files are only
+    appended to, so other processes pick up new rows by reading the tail.
+    """
+
+    def __init__(self, root=EMBEDDING_INDEX_DIR, storage=EMBEDDING_STORAGE,
+                 pq_subspaces=EMBEDDING_PQ_SUBSPACES):
+        """
+        Open (or prepare) an index
+
+        Args:
+            root: Index directory
+            storage: 'float16' or 'pq' for a new index; an existing index
+                keeps the storage it was built with
+            pq_subspaces: Bytes per PQ code for a new 'pq' index
+        """
+        if storage not in ('float16', 'pq'):
+            raise ValueError(f"Unknown embedding storage: {storage}")
+        self.root = Path(root)
+        self.storage = storage
+        self.pq_subspaces = pq_subspaces
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def _rows_path(self):
+        return self.root / ('codes.u8' if self.storage == 'pq' else 'vectors.f16')
+
+    def _load(self):
+        """Read the whole index from disk"""
+        self.meta = {}
+        meta_path = self.root / 'meta.json'
+        if meta_path.exists():
+            with open(meta_path, 'r') as f:
+                self.meta = json.load(f)
+            self.storage = self.meta.get('storage', self.storage)
+            self.pq_subspaces = self.meta.get('pq_subspaces', self.pq_subspaces)
+        self.dim = self.meta.get('dim')
+        codebook_path = self.root / 'codebook.npy'
+        self.codebook = np.load(codebook_path) if codebook_path.exists() else None
+
+        self.entries = []
+        self._rows_by_id = {}
+        self._entries_offset = 0
+        self._entries_inode = None
+        width = self._row_width()
+        self._rows = np.empty((0, width or 0), dtype=self._row_dtype())
+        self._count = 0
+        self._refresh()
+
+    def _row_width(self):
+        if self.storage == 'pq':
+            return self.pq_subspaces
+        return self.dim
+
+    def _row_dtype(self):
+        return np.uint8 if self.storage == 'pq' else np.float16
+
+    def _refresh(self):
+        """Pick up rows appended by another process (or reload a rebuilt index)"""
+        entries_path = self.root / 'entries.jsonl'
+        try:
+            stat = entries_path.stat()
+        except OSError:
+            if self.entries:
+                self._load()
+            return
+        if self._entries_inode not in (None, stat.st_ino) or stat.st_size < self._entries_offset:
+            self._load()
+            return
+        self._entries_inode = stat.st_ino
+        if stat.st_size == self._entries_offset:
+            return
+        if self.dim is None and (self.root / 'meta.json').exists():
+            self._load()
+            return
+
+        with open(entries_path, 'rb') as f:
+            f.seek(self._entries_offset)
+            data = f.read()
+        # Only complete lines; a partly written record is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        new_rows = 0
+        for line in data.splitlines():
+            record = json.loads(line)
+            if record.get('update'):
+                row = self._rows_by_id.get(record['id'])
+                if row is not None:
+                    self.entries[row].update(probability=record['probability'],
+                                             model=record['model'])
+                continue
+            self._rows_by_id[record['id']] = len(self.entries)
+            self.entries.append(record)
+            new_rows += 1
+        self._entries_offset += len(data)
+
+        if new_rows:
+            width = self._row_width()
+            itemsize = np.dtype(self._row_dtype()).itemsize
+            with open(self._rows_path, 'rb') as f:
+                f.seek(self._count * width * itemsize)
+                rows = np.fromfile(f, dtype=self._row_dtype(), count=new_rows * width)
+            self._append_rows(rows.reshape(-1, width))
+
+    def _append_rows(self, rows):
+        """Grow the in-memory row array geometrically and append rows"""
+        needed = self._count + len(rows)
+        if needed > len(self._rows):
+            grown = np.empty((max(needed, 2 * len(self._rows), 1024), rows.shape[1]),
+                             dtype=self._rows.dtype)
+            grown[:self._count] = self._rows[:self._count]
+            self._rows = grown
+        self._rows[self._count:needed] = rows
+        self._count = needed
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def lookup(self, image_id):
+        """Entry for an image hash, or None"""
+        with self._lock:
+            self._refresh()
+            row = self._rows_by_id.get(image_id)
+            return dict(self.entries[row]) if row is not None else None
+
+    def missing(self, ids):
+        """The image hashes among ids that are not indexed yet"""
+        with self._lock:
+            self._refresh()
+            return [image_id for image_id in ids if image_id not in self._rows_by_id]
+
+    def appendable(self):
+        """False for a PQ index whose codebook `build` has not trained yet"""
+        with self._lock:
+            self._refresh()
+            return self.storage != 'pq' or self.codebook is not None
+
+    def add(self, ids, embeddings, labels, paths, probabilities, model):
+        """
+        Append images to the index (ids already present are skipped)
+
+        Args:
+            ids: SHA-256 hashes of the image files
+            embeddings: (N, D) backbone embeddings
+            labels: Class labels
+            paths: Image paths, for display
+            probabilities: Model output for each image
+            model: model_signature() of the model that produced them
+
+        Returns:
+            Number of images added
+
+        Raises:
+            ValueError: For a PQ index without a trained codebook
+        """
+        with self._lock:
+            self._refresh()
+            if not self.appendable():
+                # A codebook fitted to a handful of rows would quantize every
+                # later row badly; it is trained by `build` on the full set
+                raise ValueError("PQ index has no codebook; create it with "
+                                 "`python -m src.embedding_index build --storage pq`")
+            keep, seen = [], set(self._rows_by_id)
+            for i, image_id in enumerate(ids):
+                if image_id not in seen:
+                    seen.add(image_id)
+                    keep.append(i)
+            if not keep:
+                return 0
+            vectors = _normalize(np.asarray(embeddings)[keep])
+
+            self.root.mkdir(parents=True, exist_ok=True)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.meta = {'dim': self.dim, 'storage': self.storage,
+                             'pq_subspaces': self.pq_subspaces}
+                with open(self.root / 'meta.json', 'w') as f:
+                    json.dump(self.meta, f, indent=4)
+                self._rows = np.empty((0, self._row_width()), dtype=self._row_dtype())
+            if self.storage == 'pq':
+                rows = pq_encode(vectors, self.codebook)
+            else:
+                rows = vectors.astype(np.float16)
+
+            # Rows first, so a reader never sees an entry without its row
+            with open(self._rows_path, 'ab') as f:
+                f.write(rows.tobytes())
+            records = [{'id': ids[i], 'label': labels[i], 'path': str(paths[i]),
+                        'probability': float(probabilities[i]), 'model': model} for i in keep]
+            with open(self.root / 'entries.jsonl', 'a') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._refresh()
+            return len(keep)
+
+    def update_prediction(self, image_id, probability, model):
+        """Record a fresh probability for an indexed image"""
+        with self._lock:
+            with open(self.root / 'entries.jsonl', 'a') as f:
+                f.write(json.dumps({'id': image_id, 'update': True,
+                                    'probability': float(probability), 'model': model}) + '\n')
+            self._refresh()
+
+    def search(self, embeddings, k=5):
+        """
+        Nearest indexed images by cosine similarity
+
+        Args:
+            embeddings: (Q, D) query embeddings
+            k: Neighbours per query
+
+        Returns:
+            List of Q lists of entries with a 'score', best first
+        """
+        with self._lock:
+            self._refresh()
+            count = self._count
+            rows = self._rows[:count]
+            entries = self.entries
+        queries = _normalize(np.atleast_2d(embeddings))
+        if count == 0:
+            return [[] for _ in queries]
+
+        scores = np.empty((len(queries), count), dtype=np.float32)
+        if self.storage == 'pq':
+            # Asymmetric distance: per-subspace query/centroid products, summed by code
+            subspaces, _, sub_dim = self.codebook.shape
+            tables = np.einsum('qmd,mkd->qmk', queries.reshape(-1, subspaces, sub_dim),
+                               self.codebook)
+            scores[:] = 0
+            for m in range(subspaces):
+                scores += tables[:, m, rows[:, m]]
+        else:
+            for start in range(0, count, _SEARCH_CHUNK):
+                chunk = np.take(_HALF_TO_FLOAT, rows[start:start + _SEARCH_CHUNK].view(np.uint16))
+                scores[:, start:start + len(chunk)] = queries @ chunk.T
+
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[query, candidates])]
+            results.append([dict(entries[row], score=float(scores[query, row]))
+                            for row in ordered])
+        return results
+
+    def statistics(self):
+        """Size and storage of the index"""
+        with self._lock:
+            self._refresh()
+            labels = {}
+            for entry in self.entries:
+                labels[entry['label']] = labels.get(entry['label'], 0) + 1
+            return {
+                'images': self._count,
+                'dim': self.dim,
+                'storage': self.storage,
+                'bytes_per_image': self._row_width() * np.dtype(self._row_dtype()).itemsize
+                if self.dim else None,
+                'labels': labels
+            }
+
+    @classmethod
+    def create(cls, root=EMBEDDING_INDEX_DIR, storage=EMBEDDING_STORAGE,
+               pq_subspaces=EMBEDDING_PQ_SUBSPACES, training_vectors=None):
+        """
+        Start an empty index in root, replacing any existing one
+
+        Args:
+            training_vectors: Embeddings to train the PQ codebook on (at
+                least PQ_CENTROIDS); a 'pq' index without them takes no rows
+        """
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        for name in ('meta.json', 'entries.jsonl', 'vectors.f16', 'codes.u8', 'codebook.npy'):
+            (root / name).unlink(missing_ok=True)
+        index = cls(root, storage, pq_subspaces)
+        if storage == 'pq' and training_vectors is not None:
+            index.codebook = train_codebook(_normalize(training_vectors), pq_subspaces)
+            np.save(root / 'codebook.npy', index.codebook)
+        return index
+
+
+class EmbeddingIndexer:
+    """
+    Background thread that embeds newly labeled store images into the index
+
+    Only the process holding the index's writer lock appends; in the other
+    API workers the indexer stays idle and their index reads the new rows.
+    Uploads handled by those workers reach the writer through the store
+    manifests, whose size and mtime it polls.
+    """
+
+    def __init__(self, index, store, embed_fn, model_signature_fn,
+                 interval=EMBEDDING_SYNC_SECONDS, batch_size=EMBEDDING_BATCH_SIZE,
+                 poll_interval=EMBEDDING_POLL_SECONDS):
+        """
+        Initialize indexer
+
+        Args:
+            index: EmbeddingIndex to update
+            store: ImageStore with the labeled retraining images
+            embed_fn: Maps a uint8 (N, 224, 224, 3) batch to (probabilities, embeddings)
+            model_signature_fn: Returns the serving model's signature
+            interval: Seconds between syncs when none is requested
+            batch_size: Images per embed_fn call
+            poll_interval: Seconds between checks of the store manifests
+        """
+        self.index = index
+        self.store = store
+        self.embed_fn = embed_fn
+        self.model_signature_fn = model_signature_fn
+        self.interval = interval
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._writer = _WriterLock(Path(index.root) / 'writer.lock')
+        self.is_writer = False
+
+    def start(self):
+        self.is_writer = self._writer.acquire()
+        if self.is_writer:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def request_sync(self):
+        """Index newly stored images soon"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._writer.release()
+
+    def _manifest_signature(self):
+        """Size and mtime of every store manifest; changes when any worker stores an image"""
+        signature = []
+        for path in sorted(self.store.manifests_dir.glob('*.jsonl')):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((path.name, stat.st_size, stat.st_mtime_ns))
+        return signature
+
+    def _run(self):
+        while not self._stop.is_set():
+            signature = self._manifest_signature()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Embedding index sync failed: {e}")
+
+            waited = 0.0
+            while not self._stop.is_set() and waited < self.interval:
+                if self._wake.wait(self.poll_interval):
+                    break
+                waited += self.poll_interval
+                if self._manifest_signature() != signature:
+                    break
+            self._wake.clear()
+
+    def sync(self):
+        """Embed every labeled store image missing from the index; returns the count added"""
+        from src.image_guard import decode_for_model
+
+        if not self.index.appendable():
+            return 0
+
+        labeled = [(digest, self.store.object_path(digest, entry['ext']), class_name)
+                   for class_name, entries in self.store.snapshot().items()
+                   for digest, entry in entries.items()]
+        unindexed = set(self.index.missing([digest for digest, _, _ in labeled]))
+        missing = [item for item in labeled if item[0] in unindexed]
+
+        added = 0
+        for start in range(0, len(missing), self.batch_size):
+            batch = []
+            for digest, path, label in missing[start:start + self.batch_size]:
+                try:
+                    image = decode_for_model(Path(path).read_bytes())
+                except Exception as e:
+                    print(f"Skipping {path} in embedding index: {e}")
+                    continue
+                batch.append((digest, path, label, np.asarray(image, dtype=np.uint8)))
+            if not batch:
+                continue
+            probabilities, embeddings = self.embed_fn(np.stack([item[3] for item in batch]))
+            added += self.index.add(
+                [item[0] for item in batch], embeddings, [item[2] for item in batch],
+                [item[1] for item in batch], probabilities, self.model_signature_fn()
+            )
+        if added:
+            print(f"Added {added} images to the embedding index")
+        return added
+
+
+def _labeled_files(directories, store_dir):
+    """(sha256, path, label) for images in <dir>/<class>/ folders and an image store"""
+    files = []
+    for directory in directories:
+        for class_dir in sorted(Path(directory).iterdir()) if Path(directory).is_dir() else []:
+            if class_dir.is_dir():
+                files.extend((None, path, class_dir.name) for path in sorted(class_dir.iterdir())
+                             if path.suffix.lower() in IMAGE_EXTENSIONS)
+    if store_dir and Path(store_dir).is_dir():
+        store = ImageStore(store_dir)
+        for class_name, entries in store.snapshot().items():
+            files.extend((digest, store.object_path(digest, entry['ext']), class_name)
+                         for digest, entry in entries.items())
+    return files
+
+
+def build_index(model_path='models/cats_dogs_model.h5', directories=('data/train',),
+                store_dir='data/retrain', root=EMBEDDING_INDEX_DIR, storage=EMBEDDING_STORAGE,
+                pq_subspaces=EMBEDDING_PQ_SUBSPACES, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Embed every training and retraining image into a new index
+
+    Args:
+        model_path: Model whose backbone produces the embeddings
+        directories: Folders of <class>/ image directories
+        store_dir: ImageStore with the retraining images
+        root: Index directory (replaced)
+        storage: 'float16' or 'pq'
+        pq_subspaces: Bytes per PQ code
+        batch_size: Images per forward pass
+
+    Returns:
+        Index statistics
+    """
+    from src.prediction import load_predictor
+    from src.image_guard import decode_for_model
+
+    predictor = load_predictor(model_path)
+    signature = model_signature(model_path)
+    files = _labeled_files(directories, store_dir)
+    print(f"Embedding {len(files)} images")
+
+    ids, paths, labels, probabilities, embeddings = [], [], [], [], []
+    for start in range(0, len(files), batch_size):
+        batch = []
+        for digest, path, label in files[start:start + batch_size]:
+            try:
+                image = decode_for_model(Path(path).read_bytes())
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            batch.append(np.asarray(image, dtype=np.float32) / 255.0)
+            ids.append(digest or file_sha256(path))
+            paths.append(path)
+            labels.append(label)
+        if batch:
+            batch_probabilities, batch_embeddings = predictor.predict_with_embeddings(np.stack(batch))
+            probabilities.extend(batch_probabilities)
+            embeddings.append(batch_embeddings)
+        if (start // batch_size) % 20 == 0:
+            print(f"  {min(start + batch_size, len(files))}/{len(files)}")
+
+    embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0), np.float32)
+    if storage == 'pq' and len(embeddings) < PQ_CENTROIDS:
+        raise ValueError(f"PQ storage needs at least {PQ_CENTROIDS} images to train its "
+                         f"codebook, found {len(embeddings)}; use float16 storage")
+    index = EmbeddingIndex.create(root, storage, pq_subspaces,
+                                  training_vectors=embeddings if len(embeddings) else None)
+    if len(embeddings):
+        index.add(ids, embeddings, labels, paths, probabilities, signature)
+    return index.statistics()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Embedding index for similarity search")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Embed all training and retraining images")
+    build_parser.add_argument('--model-path',
+                              default=os.getenv('SERVING_MODEL', 'models/cats_dogs_model.h5'))
+    build_parser.add_argument('--dirs', nargs='+', default=['data/train'])
+    build_parser.add_argument('--store', default='data/retrain')
+    build_parser.add_argument('--storage', choices=('float16', 'pq'), default=EMBEDDING_STORAGE)
+    build_parser.add_argument('--pq-subspaces', type=int, default=EMBEDDING_PQ_SUBSPACES)
+
+    query_parser = subparsers.add_parser('query', help="Find the nearest indexed images")
+    query_parser.add_argument('image')
+    query_parser.add_argument('-k', type=int, default=5)
+    query_parser.add_argument('--model-path',
+                              default=os.getenv('SERVING_MODEL', 'models/cats_dogs_model.h5'))
+
+    subparsers.add_parser('stats', help="Show index size and storage")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        stats = build_index(args.model_path, args.dirs, args.store, storage=args.storage,
+                            pq_subspaces=args.pq_subspaces)
+        print(json.dumps(stats, indent=4))
+    elif args.command == 'query':
+        from src.prediction import load_predictor
+        from src.image_guard import decode_for_model
+
+        image = np.asarray(decode_for_model(Path(args.image).read_bytes()), dtype=np.float32)
+        probability, embedding = load_predictor(args.model_path).predict_with_embeddings(
+            image[None] / 255.0
+        )
+        neighbours = EmbeddingIndex().search(embedding, args.k)[0]
+        print(json.dumps({'probability': float(probability[0]), 'neighbours': neighbours},
+                         indent=4))
+    else:
+        print(json.dumps(EmbeddingIndex().statistics(), indent=4))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Image Input Guard for Cats vs Dogs Classification
+Checks format, dimensions and size from the image header before any pixel
+is decoded, and decodes large JPEGs at reduced scale, so the cost of one
+request is bounded whatever the client sends
+"""
+
+import io
+import os
+
+from PIL import Image
+
+
+# Formats accepted for prediction and training uploads
+ALLOWED_FORMATS = tuple(os.getenv('IMAGE_ALLOWED_FORMATS', 'JPEG,PNG,WEBP,BMP,GIF').split(','))
+IMAGE_MAX_BYTES = int(float(os.getenv('IMAGE_MAX_MB', '10')) * 1024 * 1024)
+# Images above this many pixels are rejected without decoding them
+IMAGE_MAX_PIXELS = int(float(os.getenv('IMAGE_MAX_MEGAPIXELS', '40')) * 1_000_000)
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '16384'))
+
+# Leading bytes of the accepted formats, checked before Pillow sees the data
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'RIFF', 'WEBP'),
+    (b'BM', 'BMP'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+# Keep Pillow's own decompression-bomb check from undercutting a raised limit
+Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS or 0, IMAGE_MAX_PIXELS)
+
+
+class ImageRejected(ValueError):
+    """An image failed the pre-decode checks; status_code is the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_format(head):
+    """Format named by an image's leading bytes, or None"""
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            if name == 'WEBP' and head[8:12] != b'WEBP':
+                return None
+            return name
+    return None
+
+
+def check_image(source, size=None, max_bytes=IMAGE_MAX_BYTES, max_pixels=IMAGE_MAX_PIXELS,
+                max_side=IMAGE_MAX_SIDE, allowed_formats=ALLOWED_FORMATS):
+    """
+    Validate an image from its header only
+
+    Args:
+        source: Image bytes, or a path to an image file
+        size: Byte size of source if already known
+        max_bytes: Largest accepted encoded size
+        max_pixels: Largest accepted width * height
+        max_side: Largest accepted width or height
+        allowed_formats: Accepted Pillow format names
+
+    Returns:
+        Tuple of (format, width, height)
+
+    Raises:
+        ImageRejected: With status 413 for oversized images, 415 for
+            unsupported formats and 400 for malformed headers
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        size = len(source) if size is None else size
+        head = bytes(source[:16])
+        stream = io.BytesIO(source)
+    else:
+        size = os.path.getsize(source) if size is None else size
+        with open(source, 'rb') as f:
+            head = f.read(16)
+        stream = source
+
+    if size > max_bytes:
+        raise ImageRejected(f"Image is {size / 1024 / 1024:.1f} MB; the limit is "
+                            f"{max_bytes / 1024 / 1024:.0f} MB", 413)
+
+    sniffed = sniff_format(head)
+    if sniffed is None or sniffed not in allowed_formats:
+        raise ImageRejected(f"Unsupported image format; accepted: {', '.join(allowed_formats)}", 415)
+
+    try:
+        # Image.open only parses the header; no pixel data is decoded here
+        with Image.open(stream) as img:
+            image_format, (width, height) = img.format, img.size
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e), 413)
+    except (Image.UnidentifiedImageError, SyntaxError, OSError) as e:
+        raise ImageRejected(f"Malformed image: {e}")
+
+    if image_format != sniffed:
+        raise ImageRejected(f"Image header says {image_format} but the data is {sniffed}")
+    if width < 1 or height < 1:
+        raise ImageRejected("Image has no pixels")
+    if max(width, height) > max_side or width * height > max_pixels:
+        raise ImageRejected(f"Image is {width}x{height}; the limit is {max_pixels / 1e6:.0f} "
+                            f"megapixels and {max_side}px per side", 413)
+
+    return image_format, width, height
+
+
+def decode_for_model(data, target_size=(224, 224), **limits):
+    """
+    Check an uploaded image, then decode it at no more than twice the model size
+
+    JPEGs are decoded with draft(), which has libjpeg scale by 1/2, 1/4 or
+    1/8 while decoding, so a large photo never exists at full resolution.
+
+    Args:
+        data: Encoded image bytes
+        target_size: (width, height) the model expects
+        **limits: Overrides for check_image's limits
+
+    Returns:
+        RGB PIL image of target_size; info['source_size'] holds the
+        (width, height) of the upload
+    """
+    _, width, height = check_image(data, **limits)
+
+    with Image.open(io.BytesIO(data)) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (target_size[0] * 2, target_size[1] * 2))
+        # reducing_gap box-reduces by an integer factor before resampling
+        image = img.convert('RGB').resize(target_size, reducing_gap=3.0)
+    image.info['source_size'] = (width, height)
+    return image
@@ -0,0 +1,369 @@
+"""
+Shared-Memory Image Ring for Cats vs Dogs Inference
+Decode worker processes write images straight into preallocated slots of a
+shared-memory ring; the inference loop scores runs of consecutive slots as
+zero-copy batch views and recycles them, so no pixel array is ever pickled
+between processes
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from src.image_guard import ImageRejected, decode_for_model
+from src.drift import image_features
+
+
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', '0'))
+DECODE_RING_SLOTS = int(os.getenv('DECODE_RING_SLOTS', '128'))
+DECODE_MAX_BATCH = int(os.getenv('DECODE_MAX_BATCH', '32'))
+DECODE_BATCH_TIMEOUT = float(os.getenv('DECODE_BATCH_TIMEOUT_MS', '5')) / 1000.0
+
+# Slot states kept by the owning process
+_FREE, _PENDING, _READY, _FAILED = range(4)
+
+
+class ImageRing:
+    """Fixed number of image-sized slots in one shared-memory block"""
+
+    def __init__(self, slots, shape=(224, 224, 3), dtype=np.uint8, name=None):
+        """
+        Create a ring, or attach to an existing one when name is given
+
+        Args:
+            slots: Number of image slots
+            shape: Shape of one image
+            dtype: np.uint8 (pixels) or np.float32 (normalized pixels)
+            name: Shared-memory block to attach to
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.owner = name is None
+        self.shm = SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def spec(self):
+        """Arguments that attach another process to this ring"""
+        return {'slots': self.slots, 'shape': self.shape, 'dtype': self.dtype.str,
+                'name': self.shm.name}
+
+    def close(self):
+        """Detach, and free the block if this process created it"""
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Ring attached by each decode worker process
+_worker_ring = None
+
+
+def _attach_worker(spec):
+    """Decode worker initializer"""
+    global _worker_ring
+    _worker_ring = ImageRing(**spec)
+
+
+def _decode_into_slot(source, slot):
+    """
+    Worker task: decode one image into its ring slot
+
+    Args:
+        source: Encoded image bytes, or a path to an image file
+
+    Returns:
+        Tuple of (error, features): error is None or (HTTP status, message)
+        when the image was rejected; features are the image's drift
+        statistics (see src/drift.py), computed here off the serving process
+    """
+    try:
+        if not isinstance(source, (bytes, bytearray)):
+            source = Path(source).read_bytes()
+        height, width = _worker_ring.shape[:2]
+        image = decode_for_model(source, (width, height))
+        pixels = np.asarray(image)
+        if _worker_ring.dtype == np.uint8:
+            _worker_ring.array[slot] = pixels
+        else:
+            np.multiply(pixels, 1 / 255.0, out=_worker_ring.array[slot], casting='unsafe')
+        return None, image_features(*image.info['source_size'], pixels)
+    except ImageRejected as e:
+        # Returned rather than raised: the status code does not survive pickling
+        return (e.status_code, str(e)), None
+    except Exception as e:
+        return (400, f"Could not decode image: {e}"), None
+
+
+class DecodePipeline:
+    """
+    Process pool of decoders feeding a batching inference loop through an ImageRing
+
+    Slots are handed out in ring order and returned in the same order, so the
+    ready slots at the head of the ring are always contiguous and a batch is
+    a plain slice of the shared array.
+    """
+
+    def __init__(self, predict_fn, workers=DECODE_WORKERS or 1, slots=DECODE_RING_SLOTS,
+                 shape=(224, 224, 3), dtype=np.uint8, max_batch_size=DECODE_MAX_BATCH,
+                 batch_timeout=DECODE_BATCH_TIMEOUT, observe_fn=None):
+        """
+        Initialize pipeline
+
+        Args:
+            predict_fn: Scores an (N, *shape) batch view; returns
+                (N probabilities, N stage names)
+            workers: Number of decode processes
+            slots: Ring size; submit() blocks while every slot is in use
+            shape: Shape of one decoded image
+            dtype: Slot dtype; np.float32 slots hold pixels already divided by 255
+            max_batch_size: Most slots scored in one call to predict_fn
+            batch_timeout: Seconds to wait for more ready slots before scoring
+            observe_fn: Called with the input features of every image scored,
+                e.g. DriftMonitor.observe
+        """
+        self.predict_fn = predict_fn
+        self.observe_fn = observe_fn
+        self.max_batch_size = max(1, min(max_batch_size, slots))
+        self.batch_timeout = batch_timeout
+        self.ring = ImageRing(slots, shape, dtype)
+        # Spawned, not forked: the parent may already hold TensorFlow threads
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_attach_worker, initargs=(self.ring.spec,)
+        )
+        self._condition = threading.Condition()
+        self._state = [_FREE] * slots
+        self._results = [None] * slots
+        self._errors = [None] * slots
+        self._features = [None] * slots
+        self._head = 0
+        self._tail = 0
+        self._used = 0
+        self._closed = False
+        self.stats = {'images': 0, 'batches': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, source):
+        """
+        Queue one image for decoding and scoring
+
+        Args:
+            source: Encoded image bytes, or a path to an image file
+
+        Returns:
+            Future resolving to (probability, stage name), or raising ImageRejected
+        """
+        result = Future()
+        with self._condition:
+            while self._used == self.ring.slots and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError("Decode pipeline is closed")
+            slot = self._tail
+            self._tail = (self._tail + 1) % self.ring.slots
+            self._used += 1
+            self._state[slot] = _PENDING
+            self._results[slot] = result
+
+        try:
+            task = self.pool.submit(_decode_into_slot, source, slot)
+        except Exception as e:
+            self._finish_decode(slot, (500, f"Decode worker failed: {e}"), None)
+        else:
+            task.add_done_callback(lambda task, slot=slot: self._decoded(slot, task))
+        return result
+
+    def _decoded(self, slot, task):
+        """Mark a slot ready once its worker has written it"""
+        try:
+            error, features = task.result()
+        except Exception as e:
+            error, features = (500, f"Decode worker failed: {e}"), None
+        self._finish_decode(slot, error, features)
+
+    def _finish_decode(self, slot, error, features):
+        with self._condition:
+            self._errors[slot] = error
+            self._features[slot] = features
+            self._state[slot] = _READY if error is None else _FAILED
+            self._condition.notify_all()
+
+    def _ready_run(self):
+        """Number of consecutive decoded slots at the head, without wrapping"""
+        limit = min(self.max_batch_size, self.ring.slots - self._head, self._used)
+        count = 0
+        while count < limit and self._state[self._head + count] in (_READY, _FAILED):
+            count += 1
+        return count
+
+    def _batch_loop(self):
+        """Score runs of decoded slots as views of the ring and recycle them"""
+        while True:
+            with self._condition:
+                while not self._closed and self._ready_run() == 0:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Give slots decoding right behind the head a moment to finish
+                deadline = time.monotonic() + self.batch_timeout
+                while self._ready_run() < min(self._used, self.max_batch_size, self.ring.slots - self._head):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                start, count = self._head, self._ready_run()
+
+            # A failed slot is scored along with its neighbours (its pixels
+            # are stale) so the batch stays one contiguous view
+            batch = self.ring.array[start:start + count]
+            try:
+                probabilities, stages = self.predict_fn(batch)
+                outcomes = [(float(p), s) for p, s in zip(probabilities, stages)]
+            except Exception as e:
+                outcomes = [e] * count
+            del batch
+
+            observed = []
+            with self._condition:
+                for offset in range(count):
+                    slot = start + offset
+                    result, error = self._results[slot], self._errors[slot]
+                    if error is not None:
+                        result.set_exception(ImageRejected(error[1], error[0]))
+                        self.stats['failed'] += 1
+                    elif isinstance(outcomes[offset], Exception):
+                        result.set_exception(outcomes[offset])
+                    else:
+                        result.set_result(outcomes[offset])
+                        observed.append(self._features[slot])
+                    self._state[slot] = _FREE
+                    self._results[slot] = self._errors[slot] = self._features[slot] = None
+                self._head = (start + count) % self.ring.slots
+                self._used -= count
+                self.stats['images'] += count
+                self.stats['batches'] += 1
+                self._condition.notify_all()
+
+            if self.observe_fn is not None:
+                for features in observed:
+                    self.observe_fn(features)
+
+    def close(self):
+        """Stop the workers and free the shared memory"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self._thread.join()
+        for result in self._results:
+            if result is not None and not result.done():
+                result.set_exception(RuntimeError("Decode pipeline is closed"))
+        self.ring.close()
+
+
+def _decode_to_array(source, size):
+    """Pickle baseline task: decode one image and return it as a float32 array"""
+    image = decode_for_model(Path(source).read_bytes(), size)
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def benchmark(image_paths, workers=2, batch_size=DECODE_MAX_BATCH, repeats=1):
+    """
+    Decode-to-batch throughput of the shared-memory ring against a pickling pool
+
+    Both variants use the same number of spawned decode processes; the
+    consumer only touches the batch (a sum), so the figures isolate decoding
+    and handoff from the model.
+
+    Args:
+        image_paths: Images to decode
+        workers: Decode processes
+        batch_size: Images per consumer batch
+        repeats: Passes over image_paths
+
+    Returns:
+        Dictionary of images per second for each variant
+    """
+    sources = [str(path) for path in image_paths] * repeats
+    results = {'images': len(sources), 'workers': workers}
+
+    # Baseline: workers return float32 arrays, pickled back to the parent
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        list(pool.map(_decode_to_array, sources[:workers], [(224, 224)] * workers))
+        start = time.perf_counter()
+        arrays = pool.map(_decode_to_array, sources, [(224, 224)] * len(sources), chunksize=4)
+        pending = []
+        for array in arrays:
+            pending.append(array)
+            if len(pending) == batch_size:
+                float(np.stack(pending).sum())
+                pending = []
+        if pending:
+            float(np.stack(pending).sum())
+        results['pickle_float32'] = len(sources) / (time.perf_counter() - start)
+
+    for dtype in (np.uint8, np.float32):
+        def consume(batch):
+            float(batch.sum())
+            return np.zeros(len(batch)), ['full'] * len(batch)
+
+        pipeline = DecodePipeline(consume, workers=workers, dtype=dtype,
+                                  max_batch_size=batch_size)
+        try:
+            [f.result() for f in [pipeline.submit(s) for s in sources[:workers]]]
+            start = time.perf_counter()
+            futures = [pipeline.submit(source) for source in sources]
+            for future in futures:
+                future.result()
+            results[f'ring_{np.dtype(dtype).name}'] = len(sources) / (time.perf_counter() - start)
+            results[f'ring_{np.dtype(dtype).name}_mean_batch'] = (
+                pipeline.stats['images'] / max(pipeline.stats['batches'], 1)
+            )
+        finally:
+            pipeline.close()
+
+    return results
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Shared-memory decode pipeline tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = subparsers.add_parser('benchmark', help="Compare ring and pickle handoff")
+    bench_parser.add_argument('--image-dir', default='data/test')
+    bench_parser.add_argument('--limit', type=int, default=512)
+    bench_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    bench_parser.add_argument('--repeats', type=int, default=1)
+    bench_parser.add_argument('--output', default='models/decode_benchmark.json')
+
+    args = parser.parse_args()
+
+    paths = sorted(path for path in Path(args.image_dir).rglob('*')
+                   if path.suffix.lower() in ('.jpg', '.jpeg', '.png'))[:args.limit]
+    if not paths:
+        print(f"No images found in {args.image_dir}")
+        return 1
+
+    results = benchmark(paths, workers=args.workers, repeats=args.repeats)
+    print(json.dumps(results, indent=4))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    sys.exit(main())
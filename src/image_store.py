@@ -0,0 +1,401 @@
+"""
+Content-Addressed Image Store for Retraining Data
+Keeps every unique image once, keyed by its SHA-256, with per-class label
+manifests that reference the hashes and perceptual hashes for near-duplicate detection
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Maximum Hamming distance (out of 64 bits) between two dHashes for the
+# images to be treated as near-duplicates; 0 disables the check
+NEAR_DUPLICATE_DISTANCE = int(os.getenv('STORE_NEAR_DUPLICATE_DISTANCE', '4'))
+
+# Byte-wise popcount table for vectorized Hamming distances
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def compute_dhash(image, hash_size=8):
+    """
+    Compute a 64-bit difference hash of an image
+
+    Args:
+        image: PIL image or path to an image file
+        hash_size: Hash grid size (hash_size**2 bits)
+
+    Returns:
+        Perceptual hash as a Python int
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as img:
+            img.draft('L', (hash_size * 8, hash_size * 8))
+            return compute_dhash(img.convert('L'), hash_size)
+
+    pixels = np.asarray(
+        image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR),
+        dtype=np.int16
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hash a file without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageStore:
+    """
+    Content-addressed image store with per-class label manifests
+
+    Manifests are append-only logs shared by every process using the store:
+    changes are made under an flock on manifests/.lock, and each instance
+    replays what other processes appended before reading or writing.
+    """
+
+    def __init__(self, root, class_names=None,
+                 near_duplicate_distance=NEAR_DUPLICATE_DISTANCE):
+        """
+        Initialize image store
+
+        Args:
+            root: Store directory (contains objects/ and manifests/)
+            class_names: Labels with a manifest (default: ['cats', 'dogs'])
+            near_duplicate_distance: dHash distance treated as a duplicate
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.manifests_dir = self.root / 'manifests'
+        self.class_names = class_names or ['cats', 'dogs']
+        self.near_duplicate_distance = near_duplicate_distance
+        self._lock = threading.Lock()
+
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+
+        self.manifests = {name: {} for name in self.class_names}
+        # Per manifest: (inode, bytes replayed)
+        self._positions = {name: (None, 0) for name in self.class_names}
+        self._phash_owners, self._phashes = [], np.array([], dtype=np.uint64)
+        self.refresh()
+
+    def _manifest_path(self, class_name):
+        return self.manifests_dir / f"{class_name}.jsonl"
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store lock (across threads and processes) with up-to-date manifests"""
+        with self._lock, open(self.manifests_dir / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Replay manifest records appended by other processes"""
+        with self._locked():
+            pass
+
+    def _refresh(self):
+        """Replay each manifest's unread tail; called with the lock held"""
+        rebuild, added = False, ([], [])
+        for class_name in self.class_names:
+            path = self._manifest_path(class_name)
+            inode, offset = self._positions[class_name]
+            try:
+                stat = path.stat()
+            except OSError:
+                if inode is not None:
+                    self.manifests[class_name], rebuild = {}, True
+                self._positions[class_name] = (None, 0)
+                continue
+            if stat.st_ino != inode or stat.st_size < offset:
+                self.manifests[class_name], offset, rebuild = {}, 0, True
+            if stat.st_size == offset:
+                self._positions[class_name] = (stat.st_ino, offset)
+                continue
+
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            data = data[:data.rfind(b'\n') + 1]
+            for line in data.splitlines():
+                if line.strip():
+                    rebuild |= self._apply(class_name, json.loads(line), added)
+            self._positions[class_name] = (stat.st_ino, offset + len(data))
+        if rebuild:
+            self._rebuild_phash_index()
+        else:
+            self._extend_phash_index(*added)
+
+    def _apply(self, class_name, record, added):
+        """
+        Apply one manifest record to the in-memory view
+
+        Args:
+            class_name: Manifest the record belongs to
+            record: Parsed manifest record
+            added: (hashes, phashes) lists that new dHashes are collected in,
+                so a replay extends the phash index once
+
+        Returns:
+            True if the phash index has to be rebuilt
+        """
+        entries = self.manifests[class_name]
+        if record.get('removed'):
+            return entries.pop(record['hash'], None) is not None
+        # A re-added hash already has an index entry, possibly with another dHash
+        replaced = record['hash'] in entries
+        entries[record['hash']] = record
+        if replaced:
+            return True
+        if record.get('phash') is not None:
+            added[0].append(record['hash'])
+            added[1].append(int(record['phash'], 16))
+        return False
+
+    def _append(self, class_name, record):
+        """Append a record and apply it; called with the lock held"""
+        line = (json.dumps(record) + '\n').encode()
+        path = self._manifest_path(class_name)
+        with open(path, 'ab') as f:
+            f.write(line)
+        inode, offset = self._positions[class_name]
+        self._positions[class_name] = (inode or path.stat().st_ino, offset + len(line))
+        added = ([], [])
+        if self._apply(class_name, record, added):
+            self._rebuild_phash_index()
+        else:
+            self._extend_phash_index(*added)
+
+    def _rebuild_phash_index(self):
+        """Collect every stored dHash into one array for vectorized lookups"""
+        hashes, phashes = [], []
+        for entries in self.manifests.values():
+            for digest, entry in entries.items():
+                if entry.get('phash') is not None:
+                    hashes.append(digest)
+                    phashes.append(int(entry['phash'], 16))
+        self._phash_owners = hashes
+        self._phashes = np.array(phashes, dtype=np.uint64)
+
+    def _extend_phash_index(self, hashes, phashes):
+        """Append newly replayed dHashes to the index in one copy"""
+        if hashes:
+            self._phash_owners.extend(hashes)
+            self._phashes = np.concatenate([self._phashes, np.array(phashes, dtype=np.uint64)])
+
+    def object_path(self, digest, ext='.jpg'):
+        """Path of the stored object for a hash"""
+        return self.objects_dir / digest[:2] / f"{digest}{ext}"
+
+    def find_object(self, digest):
+        """Return the stored object path for a hash, or None"""
+        for ext in IMAGE_EXTENSIONS:
+            path = self.object_path(digest, ext)
+            if path.exists():
+                return path
+        return None
+
+    def find_near_duplicate(self, phash):
+        """
+        Find a stored image whose dHash is within the configured distance
+
+        Args:
+            phash: 64-bit perceptual hash
+
+        Returns:
+            Hash of the closest stored image, or None
+        """
+        if not self.near_duplicate_distance or len(self._phashes) == 0:
+            return None
+
+        xor = np.bitwise_xor(self._phashes, np.uint64(phash))
+        distances = _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        closest = int(np.argmin(distances))
+        if distances[closest] <= self.near_duplicate_distance:
+            return self._phash_owners[closest]
+        return None
+
+    def add_file(self, source, class_name, digest=None, phash=None,
+                 source_name=None, move=False):
+        """
+        Add an image to the store and label it
+
+        Args:
+            source: Path to the image file
+            class_name: Label to record it under
+            digest: Precomputed content hash (computed if omitted)
+            phash: Precomputed dHash (computed if omitted)
+            source_name: Original filename, kept for reference
+            move: Move the file into the store instead of copying it
+
+        Returns:
+            Tuple of (status, hash) where status is 'stored', 'duplicate',
+            'near_duplicate' or 'conflict' (the same bytes are stored under
+            another label)
+        """
+        if class_name not in self.manifests:
+            raise ValueError(f"Unknown class: {class_name}")
+
+        source = Path(source)
+        digest = digest or file_sha256(source)
+        ext = source.suffix.lower() if source.suffix.lower() in IMAGE_EXTENSIONS else '.jpg'
+
+        with self._locked():
+            if digest in self.manifests[class_name]:
+                return 'duplicate', digest
+            if any(digest in entries for entries in self.manifests.values()):
+                # One image with two labels would contradict itself in training
+                return 'conflict', digest
+
+            existing = self.find_object(digest)
+            if existing is None:
+                phash = compute_dhash(source) if phash is None else phash
+                similar = self.find_near_duplicate(phash)
+                if similar is not None:
+                    return 'near_duplicate', similar
+
+                destination = self.object_path(digest, ext)
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                if move:
+                    shutil.move(str(source), str(destination))
+                else:
+                    shutil.copy2(source, destination)
+            else:
+                # An object left without a label (e.g. by an interrupted add)
+                destination = existing
+                phash = compute_dhash(destination) if phash is None else phash
+
+            entry = {
+                'hash': digest,
+                'ext': destination.suffix,
+                'phash': f"{phash:016x}" if phash is not None else None,
+                'source': source_name or source.name,
+                'added_at': datetime.now().isoformat()
+            }
+            self._append(class_name, entry)
+
+        return 'stored', digest
+
+    def remove(self, digest, class_name):
+        """Drop a label; the object is deleted once no manifest references it"""
+        with self._locked():
+            if digest not in self.manifests[class_name]:
+                return False
+            self._append(class_name, {'hash': digest, 'removed': True})
+
+            if not any(digest in m for m in self.manifests.values()):
+                path = self.find_object(digest)
+                if path is not None:
+                    path.unlink()
+        return True
+
+    def import_directory(self, directory, class_name, move=False):
+        """
+        Add every image in a plain class directory to the store
+
+        Args:
+            directory: Directory containing images
+            class_name: Label for the images
+            move: Move files into the store instead of copying them
+
+        Returns:
+            Dictionary mapping status to count
+        """
+        counts = {'stored': 0, 'duplicate': 0, 'near_duplicate': 0, 'conflict': 0, 'error': 0}
+        for path in sorted(Path(directory).iterdir()):
+            if path.suffix.lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                status, _ = self.add_file(path, class_name, move=move)
+                counts[status] += 1
+                if move and path.exists():
+                    path.unlink()
+            except Exception as e:
+                print(f"Error importing {path}: {e}")
+                counts['error'] += 1
+        return counts
+
+    def migrate_class_directories(self):
+        """Move images from legacy root/<class>/ folders into the store"""
+        for class_name in self.class_names:
+            legacy_dir = self.root / class_name
+            if legacy_dir.is_dir():
+                counts = self.import_directory(legacy_dir, class_name, move=True)
+                if any(counts.values()):
+                    print(f"Migrated {legacy_dir} into image store: {counts}")
+                if not any(legacy_dir.iterdir()):
+                    legacy_dir.rmdir()
+
+    def snapshot(self):
+        """Up-to-date copy of the manifests as {class name: {hash: entry}}"""
+        with self._locked():
+            return {name: dict(entries) for name, entries in self.manifests.items()}
+
+    def labeled_files(self):
+        """
+        List stored images with their labels
+
+        Returns:
+            List of (absolute path, class name) tuples
+        """
+        files = []
+        for class_name, entries in self.snapshot().items():
+            for digest, entry in entries.items():
+                files.append((str(self.object_path(digest, entry['ext'])), class_name))
+        return files
+
+    def partition_by_added(self, cutoff):
+        """
+        Split stored images into those labeled after a time and the rest
+
+        Args:
+            cutoff: ISO timestamp; None treats every image as new
+
+        Returns:
+            Tuple of (new, old) lists of (absolute path, class name) tuples
+        """
+        new, old = [], []
+        for class_name, entries in self.snapshot().items():
+            for digest, entry in entries.items():
+                item = (str(self.object_path(digest, entry['ext'])), class_name)
+                if cutoff is None or entry.get('added_at', '') > cutoff:
+                    new.append(item)
+                else:
+                    old.append(item)
+        return new, old
+
+    def count(self):
+        """Total number of labeled images"""
+        return sum(len(entries) for entries in self.snapshot().values())
+
+    def statistics(self):
+        """Per-class image counts, in the format of get_dataset_statistics"""
+        stats = {name: len(entries) for name, entries in self.snapshot().items()}
+        stats['total'] = sum(stats.values())
+        return stats
+
+
+def is_image_store(directory):
+    """Check whether a directory holds an ImageStore"""
+    return (Path(directory) / 'manifests').is_dir()
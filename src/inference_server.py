@@ -0,0 +1,367 @@
+"""
+Shared Inference Server for Cats vs Dogs Classification
+Hosts a single copy of the model and serves predictions to API workers over local IPC
+"""
+
+import os
+import sys
+import time
+import queue
+import secrets
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from pathlib import Path
+
+import numpy as np
+
+from src.memory import MemoryManager, normalize_batch
+
+
+# The socket lives in a directory only this user can enter; the shared secret
+# is generated per run by main() and handed to the server and the API workers
+# in INFERENCE_AUTHKEY, so there is no default key to guess
+DEFAULT_SOCKET = os.getenv('INFERENCE_SOCKET', os.path.join(
+    tempfile.gettempdir(), f'cats_dogs_inference-{os.getuid()}', 'inference.sock'
+))
+MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH', '32'))
+BATCH_TIMEOUT = float(os.getenv('INFERENCE_BATCH_TIMEOUT_MS', '5')) / 1000.0
+
+
+def inference_authkey():
+    """
+    Shared secret of the running inference server
+
+    Returns:
+        The INFERENCE_AUTHKEY environment variable as bytes
+
+    Raises:
+        RuntimeError: If no key is configured
+    """
+    authkey = os.getenv('INFERENCE_AUTHKEY')
+    if not authkey:
+        raise RuntimeError("INFERENCE_AUTHKEY is not set; start the workers with "
+                           "python -m src.inference_server or export the server's key")
+    return authkey.encode()
+
+
+def prepare_socket_dir(address):
+    """
+    Create the socket's directory, private to this user
+
+    Args:
+        address: Unix socket path
+
+    Raises:
+        PermissionError: If the directory is shared with other users
+    """
+    directory = Path(address).parent
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stat = directory.stat()
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError(
+            f"Inference socket directory {directory} must be owned by this user with mode 0700"
+        )
+
+
+class InferenceServer:
+    """Single-process model host that micro-batches requests from many workers"""
+
+    def __init__(self, model_path='models/cats_dogs_model.h5',
+                 address=DEFAULT_SOCKET, authkey=None,
+                 max_batch_size=MAX_BATCH_SIZE, batch_timeout=BATCH_TIMEOUT):
+        """
+        Initialize inference server
+
+        Args:
+            model_path: Path to saved model
+            address: Unix socket path to listen on
+            authkey: Shared secret clients must present (default: INFERENCE_AUTHKEY)
+            max_batch_size: Maximum number of images per forward pass
+            batch_timeout: Seconds to wait for more requests before running a batch
+        """
+        self.model_path = model_path
+        self.address = address
+        self.authkey = authkey or inference_authkey()
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.predictor = None
+        self.requests = queue.Queue()
+        self.stats = {'batches': 0, 'images': 0, 'started_at': time.time()}
+        self.memory = MemoryManager()
+
+    def load_model(self):
+        """Load (or reload) the model held by this process"""
+        from src.prediction import load_predictor
+
+        self.predictor = load_predictor(model_path=self.model_path)
+        self.memory.settle()
+
+    def serve_forever(self):
+        """Accept worker connections and run the batching loop"""
+        prepare_socket_dir(self.address)
+        if Path(self.address).exists():
+            os.unlink(self.address)
+
+        self.memory.configure()
+        self.load_model()
+
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+        with Listener(self.address, family='AF_UNIX', authkey=self.authkey) as listener:
+            print(f"Inference server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Rejected inference client: {e}")
+                    continue
+                threading.Thread(
+                    target=self._handle_connection, args=(conn,), daemon=True
+                ).start()
+
+    def _handle_connection(self, conn):
+        """Serve requests from one worker connection until it closes"""
+        with conn:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    conn.send(('ok', self._dispatch(op, payload)))
+                except Exception as e:
+                    conn.send(('error', str(e)))
+
+    def _dispatch(self, op, payload):
+        """Execute a single request"""
+        if op in ('predict', 'predict_tta', 'embed'):
+            images, views = payload if op == 'predict_tta' else (payload, 0)
+            done = threading.Event()
+            job = {'op': op, 'images': images, 'views': views, 'done': done,
+                   'result': None, 'error': None}
+            self.requests.put(job)
+            done.wait()
+            if job['error'] is not None:
+                raise job['error']
+            return job['result']
+        if op == 'reload':
+            self.load_model()
+            return True
+        if op == 'ping':
+            info = {'model_path': self.model_path, 'pid': os.getpid(), **self.stats}
+            if hasattr(self.predictor, 'stage_statistics'):
+                info['cascade'] = self.predictor.stage_statistics()
+            if hasattr(self.predictor, 'rollout_statistics'):
+                info['rollout'] = self.predictor.rollout_statistics()
+            info['memory'] = self.memory.snapshot()
+            return info
+        raise ValueError(f"Unknown operation: {op}")
+
+    def _run_jobs(self, jobs):
+        """Score jobs that share an operation and TTA view count in one forward pass"""
+        batch = normalize_batch(np.concatenate([job['images'] for job in jobs]))
+        views = jobs[0]['views']
+        if jobs[0]['op'] == 'embed':
+            probabilities, extra = self.predictor.predict_with_embeddings(batch)
+        elif views:
+            probabilities, extra = self.predictor.predict_tta(batch, views)
+        else:
+            probabilities, extra = self.predictor.predict_staged(batch)
+
+        offset = 0
+        for job in jobs:
+            size = len(job['images'])
+            job['result'] = (probabilities[offset:offset + size], extra[offset:offset + size])
+            offset += size
+        self.memory.after_request()
+
+    def _batch_loop(self):
+        """Gather concurrent requests into one forward pass"""
+        while True:
+            jobs = [self.requests.get()]
+            count = len(jobs[0]['images']) * max(jobs[0]['views'], 1)
+            deadline = time.monotonic() + self.batch_timeout
+
+            while count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                # TTA jobs cost one forward-pass slot per view
+                count += len(job['images']) * max(job['views'], 1)
+
+            try:
+                groups = {}
+                for job in jobs:
+                    groups.setdefault((job['op'], job['views']), []).append(job)
+                for group in groups.values():
+                    self._run_jobs(group)
+                self.stats['batches'] += 1
+                self.stats['images'] += sum(len(job['images']) for job in jobs)
+            except Exception as e:
+                for job in jobs:
+                    job['error'] = e
+            finally:
+                for job in jobs:
+                    job['done'].set()
+
+
+class InferenceClient:
+    """Thread-safe client used by API workers to reach the shared inference server"""
+
+    def __init__(self, address=DEFAULT_SOCKET, authkey=None):
+        """
+        Initialize inference client
+
+        Args:
+            address: Unix socket path of the inference server
+            authkey: Shared secret expected by the server (default: INFERENCE_AUTHKEY)
+        """
+        self.address = address
+        self.authkey = authkey or inference_authkey()
+        self._local = threading.local()
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, op, payload=None):
+        """Send one request and wait for its reply"""
+        conn = self._connection()
+        try:
+            conn.send((op, payload))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise ConnectionError(f"Inference server at {self.address} is unavailable")
+
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def predict_staged(self, images):
+        """
+        Score a batch of images on the shared model
+
+        Args:
+            images: uint8 array of shape (N, height, width, 3)
+
+        Returns:
+            Tuple of (N dog probabilities, N names of the answering model stage)
+        """
+        return self._call('predict', np.ascontiguousarray(images, dtype=np.uint8))
+
+    def predict(self, images):
+        """Dog probabilities for a uint8 image batch (see predict_staged)"""
+        return self.predict_staged(images)[0]
+
+    def predict_tta(self, images, views):
+        """
+        Score a batch with test-time augmentation on the shared model
+
+        Args:
+            images: uint8 array of shape (N, height, width, 3)
+            views: Number of augmented views per image
+
+        Returns:
+            Tuple of (N averaged probabilities, (N, views) per-view probabilities)
+        """
+        return self._call('predict_tta', (np.ascontiguousarray(images, dtype=np.uint8), views))
+
+    def predict_with_embeddings(self, images):
+        """
+        Probabilities and backbone embeddings for a uint8 image batch
+
+        Returns:
+            Tuple of (N probabilities, (N, D) embeddings)
+        """
+        return self._call('embed', np.ascontiguousarray(images, dtype=np.uint8))
+
+    def reload(self):
+        """Ask the server to reload the model from disk"""
+        return self._call('reload')
+
+    def ping(self):
+        """Return server information, raising if it is unreachable"""
+        return self._call('ping')
+
+
+def wait_for_server(address=DEFAULT_SOCKET, authkey=None, timeout=300):
+    """
+    Block until the inference server accepts connections
+
+    Args:
+        address: Unix socket path of the inference server
+        authkey: Shared secret of the server (default: INFERENCE_AUTHKEY)
+        timeout: Maximum seconds to wait
+    """
+    client = InferenceClient(address, authkey)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return client.ping()
+        except (ConnectionError, FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Inference server did not start within {timeout}s")
+            time.sleep(0.5)
+
+
+def run_server(model_path, address, authkey=None):
+    """Process entry point for the inference server"""
+    InferenceServer(model_path=model_path, address=address, authkey=authkey).serve_forever()
+
+
+def main():
+    """Start the shared inference server and, optionally, the API workers"""
+    parser = argparse.ArgumentParser(description="Multi-worker serving with a shared model")
+    parser.add_argument('--model-path',
+                        default=os.getenv('SERVING_MODEL', 'models/cats_dogs_model.h5'))
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of API worker processes (0 runs only the inference server)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8000')))
+    args = parser.parse_args()
+
+    if args.workers == 0:
+        # Standalone server: the workers started elsewhere must share its key
+        if not os.getenv('INFERENCE_AUTHKEY'):
+            parser.error("set INFERENCE_AUTHKEY to the key the API workers will use")
+        run_server(args.model_path, args.socket)
+        return
+
+    # A fresh key per run; the spawned server and the uvicorn workers inherit it
+    os.environ['INFERENCE_AUTHKEY'] = secrets.token_bytes(32).hex()
+    prepare_socket_dir(args.socket)
+
+    server = multiprocessing.get_context('spawn').Process(
+        target=run_server, args=(args.model_path, args.socket), daemon=True
+    )
+    server.start()
+    wait_for_server(args.socket)
+
+    # Workers only forward decoded pixels, so they never import TensorFlow
+    os.environ['SERVING_MODE'] = 'shared'
+    os.environ['INFERENCE_SOCKET'] = args.socket
+
+    import uvicorn
+    try:
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
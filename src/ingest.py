@@ -0,0 +1,460 @@
+"""
+Streaming Ingest Module for Training Data Uploads
+Writes multipart uploads to disk chunk by chunk and validates, de-duplicates
+and normalizes images in a low-priority worker pool
+"""
+
+import os
+import uuid
+import asyncio
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from src.image_guard import ImageRejected, check_image
+from src.image_store import IMAGE_EXTENSIONS, compute_dhash
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# Longest side kept on ingest; a little above the 224px model input so that
+# crop/zoom augmentation still has real pixels to work with
+INGEST_MAX_SIDE = int(os.getenv('INGEST_MAX_SIDE', '512'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '64'))
+INGEST_MAX_FILE_BYTES = int(os.getenv('INGEST_MAX_FILE_MB', '25')) * 1024 * 1024
+INGEST_MAX_ARCHIVE_BYTES = int(os.getenv('INGEST_MAX_ARCHIVE_MB', '2048')) * 1024 * 1024
+INGEST_MAX_ARCHIVE_MEMBERS = int(os.getenv('INGEST_MAX_ARCHIVE_MEMBERS', '20000'))
+COPY_CHUNK_SIZE = 1024 * 1024
+# Worker results recorded in the store per thread hop
+RECORD_BATCH_SIZE = 64
+
+
+def _lower_priority():
+    """Pool initializer: keep ingest work behind prediction traffic"""
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+def _normalize_image(source, max_side=INGEST_MAX_SIDE):
+    """
+    Validate an image, downscaling it in place if it is oversized
+
+    Args:
+        source: Path to the staged upload
+        max_side: Maximum length of the longest side in pixels
+
+    Returns:
+        Tuple of (final path, dHash, whether the image was resized)
+    """
+    # Header-only check first, so a decompression bomb is never decoded
+    check_image(source, max_bytes=INGEST_MAX_FILE_BYTES)
+    with Image.open(source) as img:
+        img.verify()
+
+    with Image.open(source) as img:
+        if img.format in ('JPEG', 'PNG') and max(img.size) <= max_side:
+            return source, compute_dhash(img), False
+
+        # draft() lets the JPEG decoder downscale while decoding
+        img.draft('RGB', (max_side, max_side))
+        img = img.convert('RGB')
+        img.thumbnail((max_side, max_side))
+        resized_path = source.with_suffix('.jpg')
+        img.save(resized_path, 'JPEG', quality=95)
+        phash = compute_dhash(img)
+
+    if resized_path != source:
+        source.unlink()
+    return resized_path, phash, True
+
+
+def prepare_staged_file(staged_path, digest, extension, objects_dir, max_side=INGEST_MAX_SIDE):
+    """
+    Worker task: validate and normalize one staged image
+
+    Args:
+        staged_path: Path to the fully written upload
+        digest: SHA-256 of the uploaded bytes
+        extension: Original file extension
+        objects_dir: Image store object directory, checked for exact duplicates
+        max_side: Maximum length of the longest side in pixels
+
+    Returns:
+        Tuple of (status, detail): ('prepared', dict), ('existing', digest)
+        or ('error', message)
+    """
+    staged_path = Path(staged_path)
+
+    try:
+        for candidate in IMAGE_EXTENSIONS:
+            if (Path(objects_dir) / digest[:2] / f"{digest}{candidate}").exists():
+                staged_path.unlink()
+                return 'existing', digest
+
+        named_path = staged_path.with_suffix(extension if extension in IMAGE_EXTENSIONS else '.jpg')
+        staged_path.rename(named_path)
+        staged_path = named_path
+
+        path, phash, resized = _normalize_image(staged_path, max_side)
+        return 'prepared', {
+            'path': str(path),
+            'digest': digest,
+            'phash': phash,
+            'resized': resized
+        }
+    except ImageRejected as e:
+        staged_path.unlink(missing_ok=True)
+        return 'error', str(e)
+    except (Image.UnidentifiedImageError, SyntaxError, OSError):
+        staged_path.unlink(missing_ok=True)
+        return 'error', "Invalid or unsupported image"
+    except Exception as e:
+        staged_path.unlink(missing_ok=True)
+        return 'error', str(e)
+
+
+def _archive_members(archive_path):
+    """Yield (name, file object) for each regular file in an archive, one at a time"""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member
+    else:
+        # 'r|*' reads the tar sequentially without seeking or indexing it
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+
+
+def prepare_staged_archive(archive_path, objects_dir, staging_dir, max_side=INGEST_MAX_SIDE):
+    """
+    Worker task: unpack an archive member by member and prepare its images
+
+    Args:
+        archive_path: Path to the fully written archive
+        objects_dir: Image store object directory, checked for exact duplicates
+        staging_dir: Directory for temporary member files
+        max_side: Maximum length of the longest side in pixels
+
+    Returns:
+        List of (member name, status, detail) tuples
+    """
+    results = []
+    try:
+        for count, (name, member) in enumerate(_archive_members(archive_path)):
+            if count >= INGEST_MAX_ARCHIVE_MEMBERS:
+                results.append((name, 'error', "Archive member limit reached"))
+                break
+
+            extension = Path(name).suffix.lower()
+            if extension not in IMAGE_EXTENSIONS or Path(name).name.startswith('.'):
+                continue
+
+            staged = Path(staging_dir) / uuid.uuid4().hex
+            digest = hashlib.sha256()
+            size = 0
+            with open(staged, 'wb') as out:
+                for chunk in iter(lambda: member.read(COPY_CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if size > INGEST_MAX_FILE_BYTES:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            if size > INGEST_MAX_FILE_BYTES:
+                staged.unlink()
+                results.append((name, 'error', "File too large"))
+                continue
+
+            status, detail = prepare_staged_file(
+                staged, digest.hexdigest(), extension, objects_dir, max_side
+            )
+            results.append((name, status, detail))
+    except Exception as e:
+        results.append((Path(archive_path).name, 'error', f"Invalid archive: {e}"))
+    finally:
+        Path(archive_path).unlink(missing_ok=True)
+
+    return results
+
+
+class _UploadPart:
+    """State of the multipart part currently being received"""
+
+    def __init__(self):
+        self.headers = {}
+        self.header_field = b''
+        self.header_value = b''
+        self.filename = None
+        self.content_type = ''
+        self.path = None
+        self.file = None
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.error = None
+
+
+class StreamingIngestor:
+    """Streams multipart training uploads to disk with bounded memory"""
+
+    def __init__(self, staging_dir=None, max_workers=INGEST_WORKERS,
+                 max_pending=INGEST_MAX_PENDING, max_side=INGEST_MAX_SIDE):
+        """
+        Initialize ingestor
+
+        Args:
+            staging_dir: Directory for partially received files
+            max_workers: Number of processes validating and resizing images
+            max_pending: Maximum staged files waiting for a worker
+            max_side: Longest image side kept on ingest
+        """
+        self.staging_dir = Path(staging_dir or tempfile.gettempdir()) / 'ingest'
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_side = max_side
+        self._pool = None
+
+    @property
+    def pool(self):
+        """Process pool, created on first upload"""
+        if self._pool is None:
+            # Spawn rather than fork: the API process may be running TensorFlow threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_lower_priority
+            )
+        return self._pool
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def ingest(self, request, store, class_name):
+        """
+        Consume a multipart request body and add its images to a store
+
+        Args:
+            request: Starlette request with a multipart/form-data body
+            store: ImageStore receiving the images
+            class_name: Label for the uploaded images
+
+        Returns:
+            Dictionary with stored, duplicate and rejected files
+        """
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise ValueError("Expected a multipart/form-data body")
+
+        objects_dir = str(store.objects_dir)
+
+        pending = threading.BoundedSemaphore(self.max_pending)
+        futures = []
+        errors = []
+        seen_digests = set()
+        state = {'part': None}
+
+        def on_part_begin():
+            state['part'] = _UploadPart()
+
+        def on_header_field(data, start, end):
+            state['part'].header_field += data[start:end]
+
+        def on_header_value(data, start, end):
+            state['part'].header_value += data[start:end]
+
+        def on_header_end():
+            part = state['part']
+            part.headers[part.header_field.lower()] = part.header_value
+            part.header_field = b''
+            part.header_value = b''
+
+        def on_headers_finished():
+            part = state['part']
+            _, disposition = parse_options_header(part.headers.get(b'content-disposition', b''))
+            filename = disposition.get(b'filename')
+            if filename is None:
+                return
+
+            part.filename = Path(filename.decode('utf-8', 'replace')).name
+            part.content_type = part.headers.get(b'content-type', b'').decode('latin-1')
+            extension = ''.join(Path(part.filename).suffixes[-2:]).lower()
+
+            is_archive = extension.endswith(ARCHIVE_EXTENSIONS)
+            if not (is_archive or part.content_type.startswith('image/')):
+                part.error = "Not an image"
+                return
+
+            part.path = self.staging_dir / uuid.uuid4().hex
+            part.file = open(part.path, 'wb')
+
+        def on_part_data(data, start, end):
+            part = state['part']
+            if part.file is None:
+                return
+
+            chunk = data[start:end]
+            part.size += len(chunk)
+            is_archive = part.filename.lower().endswith(ARCHIVE_EXTENSIONS)
+            if part.size > (INGEST_MAX_ARCHIVE_BYTES if is_archive else INGEST_MAX_FILE_BYTES):
+                part.error = "File too large"
+                part.file.close()
+                part.file = None
+                part.path.unlink()
+                return
+
+            part.digest.update(chunk)
+            part.file.write(chunk)
+
+        def on_part_end():
+            part = state['part']
+            state['part'] = None
+            if part.filename is None:
+                return
+            if part.error:
+                errors.append(f"{part.filename}: {part.error}")
+                return
+
+            part.file.close()
+
+            lower_name = part.filename.lower()
+            is_archive = lower_name.endswith(ARCHIVE_EXTENSIONS)
+            digest = part.digest.hexdigest()
+            if not is_archive and digest in seen_digests:
+                part.path.unlink()
+                futures.append((part.filename, ('duplicate', part.filename)))
+                return
+            seen_digests.add(digest)
+
+            # Blocks the parser thread, and therefore the request stream,
+            # when the workers fall behind
+            pending.acquire()
+            if is_archive:
+                future = self.pool.submit(
+                    prepare_staged_archive, str(part.path), objects_dir,
+                    str(self.staging_dir), self.max_side
+                )
+            else:
+                future = self.pool.submit(
+                    prepare_staged_file, str(part.path), digest,
+                    Path(lower_name).suffix or '.jpg', objects_dir, self.max_side
+                )
+            future.add_done_callback(lambda _: pending.release())
+            futures.append((part.filename, future))
+
+        parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': on_part_begin,
+            'on_header_field': on_header_field,
+            'on_header_value': on_header_value,
+            'on_header_end': on_header_end,
+            'on_headers_finished': on_headers_finished,
+            'on_part_data': on_part_data,
+            'on_part_end': on_part_end,
+        })
+
+        try:
+            async for chunk in request.stream():
+                # Disk writes and backpressure waits happen off the event loop
+                await asyncio.to_thread(parser.write, chunk)
+            parser.finalize()
+        finally:
+            part = state['part']
+            if part is not None and part.file is not None:
+                part.file.close()
+                part.path.unlink(missing_ok=True)
+
+        return await self._collect(futures, errors, store, class_name)
+
+    async def _collect(self, futures, errors, store, class_name):
+        """Wait for worker results, record them in the store and summarize them"""
+        summary = {
+            "uploaded": 0,
+            "files": [],
+            "duplicates": [],
+            "near_duplicates": [],
+            "conflicts": [],
+            "resized": 0,
+            "errors": errors
+        }
+
+        batch = []
+        for filename, future in futures:
+            if isinstance(future, tuple):
+                result = future
+            else:
+                result = await asyncio.wrap_future(future)
+
+            if isinstance(result, list):
+                batch.extend((f"{filename}/{name}", status, detail) for name, status, detail in result)
+            else:
+                batch.append((filename, *result))
+
+            if len(batch) >= RECORD_BATCH_SIZE:
+                # Store writes take the manifest lock and move files; keep them off the event loop
+                await asyncio.to_thread(self._record, batch, store, class_name, summary)
+                batch = []
+        if batch:
+            await asyncio.to_thread(self._record, batch, store, class_name, summary)
+
+        summary["uploaded"] = len(summary["files"])
+        return summary
+
+    def _record(self, entries, store, class_name, summary):
+        """
+        Add prepared images to the store
+
+        Args:
+            entries: List of (name, status, detail) results from the workers
+            store: ImageStore receiving the images
+            class_name: Label of the upload
+            summary: Response dictionary updated in place
+        """
+        for name, status, detail in entries:
+            if status == 'error':
+                summary["errors"].append(f"{name}: {detail}")
+                continue
+            if status == 'duplicate':
+                summary["duplicates"].append(name)
+                continue
+
+            if status == 'existing':
+                # Bytes already stored, possibly under the other label
+                outcome, digest = store.add_file(name, class_name, digest=detail,
+                                                 source_name=Path(name).name)
+            else:
+                outcome, digest = store.add_file(
+                    detail['path'], class_name, digest=detail['digest'],
+                    phash=detail['phash'], source_name=Path(name).name, move=True
+                )
+                Path(detail['path']).unlink(missing_ok=True)
+
+            if outcome == 'stored':
+                summary["files"].append(digest)
+                summary["resized"] += bool(status == 'prepared' and detail['resized'])
+            elif outcome == 'near_duplicate':
+                summary["near_duplicates"].append(name)
+            elif outcome == 'conflict':
+                summary["conflicts"].append(name)
+            else:
+                summary["duplicates"].append(name)
@@ -0,0 +1,409 @@
+"""
+Memory Management for Cats vs Dogs Serving
+Replaces a full garbage collection after every prediction with a managed
+policy: model objects are frozen out of the collector, generation 0 runs
+less often, model inputs are normalized into reused per-thread buffers, and
+resident memory is checked against a budget so that a full collection (and
+returning freed heap to the OS) only happens when memory is actually high.
+"""
+
+import io
+import os
+import gc
+import sys
+import json
+import time
+import ctypes
+import argparse
+import resource
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+
+# 'managed' (default) or 'collect', which runs gc.collect() after every request
+MEMORY_POLICY = os.getenv('MEMORY_POLICY', 'managed')
+# Resident set size above which memory is reclaimed (0 = no budget)
+MEMORY_RSS_BUDGET_MB = float(os.getenv('MEMORY_RSS_BUDGET_MB', '0'))
+# Requests between RSS checks
+MEMORY_CHECK_EVERY = int(os.getenv('MEMORY_CHECK_EVERY', '16'))
+# Shortest time between two reclaims, so an unreachable budget cannot turn
+# into a full collection per request
+MEMORY_RECLAIM_COOLDOWN_SECONDS = float(os.getenv('MEMORY_RECLAIM_COOLDOWN_SECONDS', '10'))
+# Collector thresholds under the managed policy (Python's default is 700,10,10)
+GC_THRESHOLDS = tuple(int(value) for value in os.getenv('GC_THRESHOLDS', '10000,20,20').split(','))
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    """
+    Current resident set size of this process
+
+    Read from /proc/self/statm; where that does not exist, the peak from
+    getrusage() is the best available figure.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Largest resident set size this process has had"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_libc = None
+
+
+def _malloc_trim():
+    """Return free heap pages to the OS (glibc only); True if it was possible"""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL('libc.so.6')
+            _libc.malloc_trim
+        except (OSError, AttributeError):
+            _libc = False
+    if not _libc:
+        return False
+    _libc.malloc_trim(0)
+    return True
+
+
+_scratch = threading.local()
+
+
+def normalize_batch(images):
+    """
+    Scale a uint8 image batch to [0, 1] float32 in a reused per-thread buffer
+
+    The result is a view that is overwritten by the thread's next call, so
+    it must be consumed (e.g. by a forward pass) before then; keep a copy
+    to hold on to it.
+
+    Args:
+        images: uint8 array of shape (N, height, width, 3)
+
+    Returns:
+        float32 array of the same shape
+    """
+    buffer = getattr(_scratch, 'buffer', None)
+    if buffer is None or buffer.shape[1:] != images.shape[1:] or len(buffer) < len(images):
+        capacity = max(len(images), len(buffer) if buffer is not None else 0)
+        buffer = np.empty((capacity,) + images.shape[1:], dtype=np.float32)
+        _scratch.buffer = buffer
+    batch = buffer[:len(images)]
+    np.multiply(images, np.float32(1 / 255), out=batch)
+    return batch
+
+
+class MemoryManager:
+    """
+    Garbage collection policy and RSS budget for a serving process
+
+    With the 'collect' policy every request ends in a full collection, as
+    the API used to do. With 'managed', long-lived objects (the model) are
+    frozen after loading, the collector runs at GC_THRESHOLDS, and every
+    check_every requests the RSS is compared with the budget; above it a
+    young-generation collection is tried first and a full collection with a
+    heap trim only if that was not enough.
+    """
+
+    def __init__(self, policy=MEMORY_POLICY, budget_mb=MEMORY_RSS_BUDGET_MB,
+                 check_every=MEMORY_CHECK_EVERY, cooldown=MEMORY_RECLAIM_COOLDOWN_SECONDS,
+                 thresholds=GC_THRESHOLDS):
+        """
+        Initialize manager
+
+        Args:
+            policy: 'managed' or 'collect'
+            budget_mb: RSS budget in MB (0 = none)
+            check_every: Requests between RSS checks
+            cooldown: Seconds between reclaims
+            thresholds: gc.set_threshold() arguments for the managed policy
+        """
+        if policy not in ('managed', 'collect'):
+            raise ValueError(f"Unknown memory policy: {policy}")
+        self.policy = policy
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.check_every = max(1, check_every)
+        self.cooldown = cooldown
+        self.thresholds = thresholds
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._last_reclaim = 0.0
+        self.counters = {'requests': 0, 'checks': 0, 'over_budget': 0, 'young_collections': 0,
+                         'full_collections': 0, 'trims': 0, 'reclaim_seconds': 0.0}
+        self.last_rss = None
+        self.last_reclaim = None
+
+    def configure(self):
+        """Apply the collector thresholds; call once at startup"""
+        if self.policy == 'managed':
+            gc.set_threshold(*self.thresholds)
+
+    def settle(self):
+        """
+        Collect, then freeze what survives; call after (re)loading a model
+
+        Frozen objects are skipped by every later collection, so the model's
+        graph no longer makes each full collection slower. They are
+        unfrozen first so that the previous model can be freed.
+        """
+        if self.policy != 'managed':
+            gc.collect()
+            return
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def after_request(self):
+        """Called once a request's buffers have been released"""
+        if self.policy == 'collect':
+            gc.collect()
+            return
+        with self._lock:
+            self._requests += 1
+            self.counters['requests'] += 1
+            due = self._requests >= self.check_every
+            if due:
+                self._requests = 0
+        if due:
+            self.check()
+
+    def check(self):
+        """
+        Compare RSS with the budget and reclaim memory if it is exceeded
+
+        Returns:
+            Dictionary describing the reclaim, or None if none was needed
+        """
+        rss = rss_bytes()
+        self.last_rss = rss
+        self.counters['checks'] += 1
+        if not self.budget or rss <= self.budget:
+            return None
+        self.counters['over_budget'] += 1
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_reclaim < self.cooldown:
+                return None
+            self._last_reclaim = now
+        return self.reclaim(rss)
+
+    def reclaim(self, rss=None):
+        """Free memory: young generations first, then everything plus a heap trim"""
+        start = time.perf_counter()
+        before = rss if rss is not None else rss_bytes()
+        steps = ['young']
+        gc.collect(1)
+        self.counters['young_collections'] += 1
+        after = rss_bytes()
+        if after > self.budget:
+            steps.append('full')
+            gc.collect()
+            self.counters['full_collections'] += 1
+            if _malloc_trim():
+                steps.append('trim')
+                self.counters['trims'] += 1
+            after = rss_bytes()
+        seconds = time.perf_counter() - start
+        self.counters['reclaim_seconds'] += seconds
+        self.last_rss = after
+        self.last_reclaim = {'at': datetime.now().isoformat(), 'steps': steps,
+                             'rss_before_mb': before / 2 ** 20, 'rss_after_mb': after / 2 ** 20,
+                             'seconds': seconds}
+        if after > self.budget:
+            print(f"RSS {after / 2 ** 20:.0f} MB is still above the "
+                  f"{self.budget / 2 ** 20:.0f} MB budget after reclaiming")
+        return self.last_reclaim
+
+    def snapshot(self):
+        """Policy, RSS, collector state and counters"""
+        rss = rss_bytes()
+        return {
+            'policy': self.policy,
+            'rss_mb': rss / 2 ** 20,
+            'peak_rss_mb': peak_rss_bytes() / 2 ** 20,
+            'budget_mb': self.budget / 2 ** 20 if self.budget else None,
+            'gc_thresholds': gc.get_threshold(),
+            'gc_counts': gc.get_count(),
+            'gc_frozen_objects': gc.get_freeze_count(),
+            'gc_collections': [stats['collections'] for stats in gc.get_stats()],
+            'counters': dict(self.counters),
+            'last_reclaim': self.last_reclaim
+        }
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _sample_images(image_dir, limit, size=(640, 480)):
+    """Encoded images from image_dir, or synthetic JPEGs if it has none"""
+    from PIL import Image
+
+    paths = sorted(path for path in Path(image_dir).rglob('*')
+                   if path.suffix.lower() in ('.jpg', '.jpeg', '.png'))[:limit]
+    if paths:
+        return [path.read_bytes() for path in paths]
+
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(min(limit, 16)):
+        pixels = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize(size).save(buffer, 'JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def soak(requests=2000, model_path='models/cats_dogs_model.h5', backbone='mobilenet_v2',
+         image_dir='data/test', sample_every=100):
+    """
+    Serve requests in a loop under the environment's MEMORY_POLICY
+
+    Each request decodes an image, normalizes it, runs the forward pass and
+    ends with the policy's after_request(), like the API's predict path.
+
+    Args:
+        requests: Requests to serve
+        model_path: Model to serve (random weights are used if missing)
+        backbone: Backbone for the random-weight fallback
+        image_dir: Images to decode (synthetic JPEGs if empty)
+        sample_every: Requests between RSS samples
+
+    Returns:
+        Dictionary of latency percentiles, RSS samples and collector counters
+    """
+    import tensorflow as tf
+    from src.runtime import configure_runtime, _load_benchmark_model
+    from src.image_guard import decode_for_model
+
+    configure_runtime()
+    manager = MemoryManager()
+    manager.configure()
+    model = _load_benchmark_model(model_path, backbone)
+    forward = tf.function(model)
+    images = _sample_images(image_dir, 64)
+
+    def serve(contents):
+        image = decode_for_model(contents, (224, 224))
+        batch = np.expand_dims(np.asarray(image, dtype=np.uint8), axis=0)
+        probability = float(np.asarray(forward(normalize_batch(batch), training=False)).reshape(-1)[0])
+        del image, batch
+        manager.after_request()
+        return probability
+
+    for contents in images[:8]:
+        serve(contents)
+    manager.settle()
+
+    latencies = []
+    rss = []
+    for index in range(requests):
+        start = time.perf_counter()
+        serve(images[index % len(images)])
+        latencies.append(time.perf_counter() - start)
+        if index % sample_every == 0:
+            rss.append(rss_bytes() / 2 ** 20)
+    rss.append(rss_bytes() / 2 ** 20)
+
+    milliseconds = np.array(latencies) * 1000
+    half = len(rss) // 2
+    return {
+        'policy': manager.policy,
+        'requests': requests,
+        'latency_ms': {'mean': float(milliseconds.mean()),
+                       **{f'p{q}': float(np.percentile(milliseconds, q)) for q in (50, 95, 99)},
+                       'max': float(milliseconds.max())},
+        'rss_mb': {'start': rss[0], 'end': rss[-1], 'max': max(rss),
+                   # Growth over the second half, once caches have warmed up
+                   'growth_second_half': rss[-1] - rss[half]},
+        'rss_samples_mb': rss,
+        'memory': manager.snapshot()
+    }
+
+
+def benchmark(requests=2000, model_path='models/cats_dogs_model.h5', backbone='mobilenet_v2',
+              image_dir='data/test', budget_mb=0, report_path='models/memory_benchmark.json',
+              timeout=3600):
+    """
+    Soak-test each memory policy in a fresh interpreter and compare them
+
+    Returns:
+        Report dictionary with each policy's results
+    """
+    results = {}
+    for policy in ('collect', 'managed'):
+        env = dict(os.environ, MEMORY_POLICY=policy, MEMORY_RSS_BUDGET_MB=str(budget_mb),
+                   TF_CPP_MIN_LOG_LEVEL='3')
+        command = [
+            sys.executable, '-m', 'src.memory', 'soak', '--requests', str(requests),
+            '--model-path', model_path or '', '--backbone', backbone, '--image-dir', image_dir
+        ]
+        try:
+            completed = subprocess.run(command, env=env, capture_output=True, text=True,
+                                       timeout=timeout, check=True)
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (subprocess.SubprocessError, ValueError, IndexError) as e:
+            result = {'policy': policy, 'error': str(e)[-500:]}
+        print(json.dumps({key: value for key, value in result.items() if key != 'rss_samples_mb'}))
+        results[policy] = result
+
+    report = {'results': results, 'created_at': datetime.now().isoformat()}
+    if all('error' not in result for result in results.values()):
+        report['p50_speedup'] = (results['collect']['latency_ms']['p50']
+                                 / results['managed']['latency_ms']['p50'])
+        report['p99_speedup'] = (results['collect']['latency_ms']['p99']
+                                 / results['managed']['latency_ms']['p99'])
+
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Memory benchmark saved to {report_path}")
+
+    return report
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compare serving memory policies")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('benchmark', 'soak'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--requests', type=int, default=2000)
+        sub.add_argument('--model-path', default='models/cats_dogs_model.h5')
+        sub.add_argument('--backbone', default='mobilenet_v2')
+        sub.add_argument('--image-dir', default='data/test')
+    subparsers.choices['benchmark'].add_argument('--budget-mb', type=float, default=0)
+    subparsers.choices['benchmark'].add_argument('--output', default='models/memory_benchmark.json')
+
+    args = parser.parse_args()
+
+    if args.command == 'soak':
+        # Single policy from the environment; the last stdout line is the result
+        result = soak(args.requests, args.model_path, args.backbone, args.image_dir)
+        print(json.dumps(result))
+        return
+
+    report = benchmark(args.requests, args.model_path, args.backbone, args.image_dir,
+                       args.budget_mb, args.output)
+    if 'p50_speedup' in report:
+        print(f"Median latency {report['p50_speedup']:.2f}x, "
+              f"p99 {report['p99_speedup']:.2f}x faster with the managed policy")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,66 +4,317 @@ Handles model architecture, training, and evaluation
 """
 
 import os
+import sys
 import json
+import time
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers, models
-from tensorflow.keras.applications import VGG16
-from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+from tensorflow.keras.applications import (
+    VGG16, ResNet50, MobileNetV2, MobileNetV3Small, MobileNetV3Large, EfficientNetB0
+)
+from tensorflow.keras.callbacks import (
+    BackupAndRestore, Callback, EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+)
 from tensorflow.keras.optimizers import Adam
 from sklearn.metrics import (
     accuracy_score, precision_score, recall_score, f1_score,
     confusion_matrix, classification_report, roc_auc_score
 )
+from PIL import Image
+
+from src.runtime import configure_runtime
+
+
+STUDENT_ARCHITECTURES = ('mobilenet', 'custom_cnn')
+TEACHER_LOGITS_CACHE = 'models/teacher_logits.npz'
+
+# Pretrained backbone used by build_model(use_pretrained=True)
+MODEL_BACKBONE = os.getenv('MODEL_BACKBONE', 'vgg16')
+# ImageNet weights are kept here so building a model needs no network access
+WEIGHTS_CACHE_DIR = os.getenv('WEIGHTS_CACHE_DIR', 'models/weights')
+# Set to 1 to fail instead of downloading weights that are not cached yet
+BACKBONE_OFFLINE = os.getenv('BACKBONE_OFFLINE', '0') == '1'
+
+# Backbone name -> (constructor, display name, input preprocessing). All
+# pipelines feed images scaled to [0, 1]; the preprocessing entry says how
+# the model converts that into what the backbone was trained on:
+#   'caffe' - 0-255, RGB->BGR, ImageNet mean subtracted (VGG16, ResNet50)
+#   'tf'    - [-1, 1] (MobileNetV2)
+#   'raw'   - 0-255, the backbone normalizes internally (MobileNetV3, EfficientNet)
+BACKBONES = {
+    'vgg16': (VGG16, 'VGG16', 'caffe'),
+    'resnet50': (ResNet50, 'ResNet50', 'caffe'),
+    'mobilenet_v2': (MobileNetV2, 'MobileNetV2', 'tf'),
+    'mobilenet_v3_small': (MobileNetV3Small, 'MobileNetV3-Small', 'raw'),
+    'mobilenet_v3_large': (MobileNetV3Large, 'MobileNetV3-Large', 'raw'),
+    'efficientnet_b0': (EfficientNetB0, 'EfficientNet-B0', 'raw'),
+}
+IMAGENET_BGR_MEAN = (103.939, 116.779, 123.68)
+
+# Backbone layers fine_tune_model() keeps frozen; the rest are unfrozen
+FINE_TUNE_FROZEN_LAYERS = int(os.getenv('FINE_TUNE_FROZEN_LAYERS', '15'))
+
+
+def backbone_preprocessing(mode):
+    """
+    Layer converting [0, 1] RGB images into a backbone's expected input
+    
+    Built from standard layers so saved models load without custom objects;
+    'caffe' uses a frozen 1x1 projection that scales, swaps RGB to BGR and
+    subtracts the ImageNet mean in one step.
+    
+    Args:
+        mode: 'caffe', 'tf' or 'raw'
+        
+    Returns:
+        Keras layer
+    """
+    if mode == 'tf':
+        return layers.Rescaling(2.0, offset=-1.0, name='backbone_preprocessing')
+    if mode == 'raw':
+        return layers.Rescaling(255.0, name='backbone_preprocessing')
+    if mode == 'caffe':
+        swap = np.eye(3, dtype=np.float32)[::-1] * 255.0
+        return layers.Dense(
+            3, trainable=False, name='backbone_preprocessing',
+            kernel_initializer=keras.initializers.Constant(swap),
+            bias_initializer=keras.initializers.Constant(-np.array(IMAGENET_BGR_MEAN))
+        )
+    raise ValueError(f"Unknown preprocessing mode: {mode}")
+
+
+def load_backbone(name, img_size=(224, 224), cache_dir=WEIGHTS_CACHE_DIR, offline=BACKBONE_OFFLINE,
+                  weights='imagenet'):
+    """
+    Build a headless ImageNet backbone, with weights from the local cache
+    
+    Weights missing from the cache are downloaded once and saved there,
+    unless offline is set.
+    
+    Args:
+        name: Key of BACKBONES
+        img_size: Input image dimensions (height, width)
+        cache_dir: Directory of cached backbone weights
+        offline: Raise instead of downloading missing weights
+        weights: 'imagenet', or None for random initialization (e.g. benchmarks)
+        
+    Returns:
+        Keras model without its classification top
+    """
+    if name not in BACKBONES:
+        raise ValueError(f"Unknown backbone: {name} (choose from {', '.join(BACKBONES)})")
+    
+    constructor = BACKBONES[name][0]
+    input_shape = (img_size[0], img_size[1], 3)
+    if weights is None:
+        return constructor(weights=None, include_top=False, input_shape=input_shape)
+    weights_path = Path(cache_dir) / f"{name}_notop.weights.h5"
+    
+    if weights_path.exists():
+        base_model = constructor(weights=None, include_top=False, input_shape=input_shape)
+        base_model.load_weights(weights_path)
+        return base_model
+    
+    if offline:
+        raise FileNotFoundError(
+            f"No cached weights for {name} at {weights_path}; "
+            f"run 'python -m src.model cache-weights {name}' with network access"
+        )
+    
+    base_model = constructor(weights='imagenet', include_top=False, input_shape=input_shape)
+    weights_path.parent.mkdir(parents=True, exist_ok=True)
+    base_model.save_weights(weights_path)
+    print(f"Cached {name} weights at {weights_path}")
+    return base_model
+
+
+def find_backbone(model):
+    """Return the nested pretrained backbone of a transfer-learning model"""
+    for layer in model.layers:
+        if isinstance(layer, keras.Model):
+            return layer
+    raise ValueError("Model has no nested backbone")
+
+
+class TrainingProgressCallback(Callback):
+    """Reports training progress, with an ETA, to a callable"""
+    
+    def __init__(self, report, batch_interval=2.0):
+        """
+        Initialize progress callback
+        
+        Args:
+            report: Function called with a progress dictionary
+            batch_interval: Minimum seconds between in-epoch progress reports
+        """
+        super().__init__()
+        self.report = report
+        self.batch_interval = batch_interval
+        self.train_start = None
+        self.epoch_start = None
+        self.last_report = 0.0
+        self.epoch = 0
+        self.first_epoch = None
+    
+    def _eta(self, completed_epochs):
+        """Seconds remaining, extrapolated from the average epoch time so far"""
+        total_epochs = self.params.get('epochs') or 0
+        # A resumed run starts part way through; only time this run's epochs
+        run_epochs = completed_epochs - (self.first_epoch or 0)
+        if run_epochs <= 0:
+            return None
+        per_epoch = (time.time() - self.train_start) / run_epochs
+        return per_epoch * max(total_epochs - completed_epochs, 0)
+    
+    def on_train_begin(self, logs=None):
+        self.train_start = time.time()
+        self.first_epoch = None
+        self.report({'stage': 'started', 'total_epochs': self.params.get('epochs')})
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.first_epoch is None:
+            self.first_epoch = epoch
+        self.epoch = epoch
+        self.epoch_start = time.time()
+    
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.time()
+        if now - self.last_report < self.batch_interval:
+            return
+        self.last_report = now
+        
+        steps = self.params.get('steps') or 0
+        fraction = (batch + 1) / steps if steps else 0.0
+        logs = logs or {}
+        self.report({
+            'stage': 'batch',
+            'epoch': self.epoch + 1,
+            'total_epochs': self.params.get('epochs'),
+            'step': batch + 1,
+            'steps': steps,
+            'loss': float(logs.get('loss', 0.0)),
+            'accuracy': float(logs.get('accuracy', 0.0)),
+            'eta_seconds': self._eta(self.epoch + fraction)
+        })
+    
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        progress = {
+            'stage': 'epoch',
+            'epoch': epoch + 1,
+            'total_epochs': self.params.get('epochs'),
+            'epoch_seconds': time.time() - self.epoch_start,
+            'eta_seconds': self._eta(epoch + 1)
+        }
+        for key in ('loss', 'accuracy', 'val_loss', 'val_accuracy'):
+            if key in logs:
+                progress[key] = float(logs[key])
+        self.report(progress)
+    
+    def on_train_end(self, logs=None):
+        self.report({
+            'stage': 'finished',
+            'elapsed_seconds': time.time() - self.train_start
+        })
+
+
+class ResumableTraining(BackupAndRestore):
+    """
+    BackupAndRestore that also carries the other callbacks' counters
+
+    Keras backs up the weights, optimizer state and epoch. The best scores
+    and patience counters of EarlyStopping, ReduceLROnPlateau and
+    ModelCheckpoint are saved next to them, so a resumed run neither stops
+    late nor overwrites a better checkpoint with a worse one. Must come
+    after those callbacks in the callback list.
+    """
+    
+    STATE_ATTRIBUTES = ('best', 'wait', 'cooldown_counter', 'stopped_epoch')
+    
+    def __init__(self, backup_dir, callbacks, save_freq='epoch'):
+        super().__init__(backup_dir, save_freq=save_freq)
+        self.tracked = callbacks
+        self.resumed_epoch = None
+        self._state_path = Path(backup_dir) / 'callback_state.json'
+    
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        self.resumed_epoch = self.model._initial_epoch
+        if self.resumed_epoch and self._state_path.exists():
+            with open(self._state_path, 'r') as f:
+                states = json.load(f)
+            for callback, state in zip(self.tracked, states):
+                for name, value in state.items():
+                    setattr(callback, name, value)
+            print(f"Resuming training from epoch {self.resumed_epoch + 1}")
+    
+    def _save_model(self):
+        super()._save_model()
+        states = [
+            {name: float(getattr(callback, name)) for name in self.STATE_ATTRIBUTES
+             if isinstance(getattr(callback, name, None), (int, float, np.floating))}
+            for callback in self.tracked
+        ]
+        with open(self._state_path, 'w') as f:
+            json.dump(states, f)
 
 
 class CatsDogsModel:
     """Model builder and trainer for binary image classification"""
     
-    def __init__(self, img_size=(224, 224), learning_rate=0.0001):
+    def __init__(self, img_size=(224, 224), learning_rate=0.0001, backbone=None):
         """
         Initialize model builder
         
         Args:
             img_size: Input image dimensions (height, width)
             learning_rate: Learning rate for optimizer
+            backbone: Pretrained backbone name (default: MODEL_BACKBONE)
         """
         self.img_size = img_size
         self.learning_rate = learning_rate
+        self.backbone = backbone or MODEL_BACKBONE
         self.model = None
         self.history = None
+        # Threads, bfloat16 mixed precision and XLA (see src/runtime.py)
+        self.runtime = configure_runtime()
         
-    def build_model(self, use_pretrained=True):
+    def build_model(self, use_pretrained=True, backbone_weights='imagenet'):
         """
         Build the model architecture using transfer learning
         
         Args:
-            use_pretrained: Whether to use pretrained VGG16 weights
+            use_pretrained: Whether to use a pretrained backbone (self.backbone)
+            backbone_weights: 'imagenet', or None for an untrained backbone
             
         Returns:
             Compiled Keras model
         """
         if use_pretrained:
-            # Load pretrained VGG16
-            base_model = VGG16(
-                weights='imagenet',
-                include_top=False,
-                input_shape=(self.img_size[0], self.img_size[1], 3)
-            )
+            # Load the pretrained backbone from the local weight cache
+            base_model = load_backbone(self.backbone, self.img_size, weights=backbone_weights)
             base_model.trainable = False
             
             # Build custom top layers
             self.model = models.Sequential([
+                layers.Input(shape=(self.img_size[0], self.img_size[1], 3)),
+                backbone_preprocessing(BACKBONES[self.backbone][2]),
                 base_model,
                 layers.GlobalAveragePooling2D(),
                 layers.Dense(256, activation='relu'),
                 layers.Dropout(0.5),
                 layers.Dense(128, activation='relu'),
                 layers.Dropout(0.3),
-                layers.Dense(1, activation='sigmoid')
+                # Kept in float32 under mixed precision for a stable sigmoid
+                layers.Dense(1, activation='sigmoid', dtype='float32')
             ])
         else:
             # Build custom CNN
@@ -78,7 +329,8 @@ class CatsDogsModel:
                 layers.Flatten(),
                 layers.Dense(256, activation='relu'),
                 layers.Dropout(0.5),
-                layers.Dense(1, activation='sigmoid')
+                # Kept in float32 under mixed precision for a stable sigmoid
+                layers.Dense(1, activation='sigmoid', dtype='float32')
             ])
         
         # Compile model
@@ -87,13 +339,16 @@ class CatsDogsModel:
             loss='binary_crossentropy',
             metrics=['accuracy', 
                     tf.keras.metrics.Precision(), 
-                    tf.keras.metrics.Recall()]
+                    tf.keras.metrics.Recall()],
+            jit_compile=self.runtime['xla']
         )
         
         return self.model
     
     def train(self, train_generator, validation_generator, 
-              epochs=15, model_save_path='models/best_model.h5'):
+              epochs=15, model_save_path='models/best_model.h5',
+              extra_callbacks=None, checkpoint_dir=None, checkpoint_freq='epoch',
+              max_steps_per_epoch=None):
         """
         Train the model
         
@@ -102,6 +357,11 @@ class CatsDogsModel:
             validation_generator: Validation data generator
             epochs: Number of training epochs
             model_save_path: Path to save the best model
+            extra_callbacks: Additional Keras callbacks (e.g. progress reporting)
+            checkpoint_dir: Directory for resumable weight, optimizer and epoch
+                checkpoints; a run that finds one there continues from it
+            checkpoint_freq: 'epoch' or a number of batches between checkpoints
+            max_steps_per_epoch: Upper bound on batches per epoch
             
         Returns:
             Training history
@@ -134,14 +394,22 @@ class CatsDogsModel:
                 verbose=1
             )
         ]
+        if checkpoint_dir is not None:
+            callbacks.append(ResumableTraining(checkpoint_dir, list(callbacks), checkpoint_freq))
+        callbacks.extend(extra_callbacks or [])
+        
+        # Small incremental sets can hold less than one batch
+        steps_per_epoch = max(1, train_generator.samples // train_generator.batch_size)
+        if max_steps_per_epoch:
+            steps_per_epoch = min(steps_per_epoch, max_steps_per_epoch)
         
         # Train model
         self.history = self.model.fit(
             train_generator,
-            steps_per_epoch=train_generator.samples // train_generator.batch_size,
+            steps_per_epoch=steps_per_epoch,
             epochs=epochs,
-            validation_data=validation_generator,
-            validation_steps=validation_generator.samples // validation_generator.batch_size,
+            validation_data=validation_generator if validation_generator.samples else None,
+            validation_steps=max(1, validation_generator.samples // validation_generator.batch_size),
             callbacks=callbacks,
             verbose=1
         )
@@ -150,7 +418,9 @@ class CatsDogsModel:
     
     def retrain(self, train_generator, validation_generator, 
                 pretrained_model_path, epochs=15, 
-                model_save_path='models/retrained_model.h5'):
+                model_save_path='models/retrained_model.h5',
+                extra_callbacks=None, fine_tune_layers=None, learning_rate=None,
+                **train_options):
         """
         Retrain model on new data using existing model as base
         
@@ -160,12 +430,32 @@ class CatsDogsModel:
             pretrained_model_path: Path to existing trained model
             epochs: Number of retraining epochs
             model_save_path: Path to save retrained model
+            extra_callbacks: Additional Keras callbacks passed to train()
+            fine_tune_layers: Unfreeze the backbone above this many layers
+                (see fine_tune_model); None keeps the saved trainable layers
+            learning_rate: Learning rate to continue with (default: the
+                trainer's, or fine_tune_model's when fine-tuning)
+            **train_options: checkpoint_dir, checkpoint_freq and
+                max_steps_per_epoch for train()
             
         Returns:
             Retraining history
         """
-        # Load pretrained model
-        self.model = keras.models.load_model(pretrained_model_path)
+        # Load pretrained model. It is recompiled with a fresh optimizer: Keras 3
+        # cannot keep training the optimizer restored from a legacy .h5 file.
+        self.model = keras.models.load_model(pretrained_model_path, compile=False)
+        if fine_tune_layers is not None:
+            fine_tune_model(self.model, fine_tune_layers, learning_rate=learning_rate or 1e-5,
+                            jit_compile=self.runtime['xla'])
+        else:
+            self.model.compile(
+                optimizer=Adam(learning_rate=learning_rate or self.learning_rate),
+                loss='binary_crossentropy',
+                metrics=['accuracy', 
+                        tf.keras.metrics.Precision(), 
+                        tf.keras.metrics.Recall()],
+                jit_compile=self.runtime['xla']
+            )
         
         print(f"Loaded pretrained model from {pretrained_model_path}")
         print(f"Starting retraining for {epochs} epochs...")
@@ -175,7 +465,9 @@ class CatsDogsModel:
             train_generator, 
             validation_generator, 
             epochs=epochs,
-            model_save_path=model_save_path
+            model_save_path=model_save_path,
+            extra_callbacks=extra_callbacks,
+            **train_options
         )
         
         return history
@@ -237,8 +529,15 @@ class CatsDogsModel:
         
         # Save configuration
         if save_config:
+            try:
+                find_backbone(self.model)
+                architecture = f"{BACKBONES[self.backbone][1]} Transfer Learning"
+                backbone = self.backbone
+            except ValueError:
+                architecture, backbone = 'Custom CNN', None
             config = {
-                'architecture': 'VGG16 Transfer Learning',
+                'architecture': architecture,
+                'backbone': backbone,
                 'input_shape': list(self.img_size) + [3],
                 'learning_rate': self.learning_rate,
                 'created_at': datetime.now().isoformat()
@@ -294,19 +593,25 @@ class CatsDogsModel:
         return '\n'.join(summary_list)
 
 
-def fine_tune_model(model, base_model_layers=15):
+def fine_tune_model(model, base_model_layers=None, learning_rate=1e-5, jit_compile=False):
     """
     Fine-tune a pretrained model by unfreezing top layers
     
     Args:
         model: Keras model to fine-tune
         base_model_layers: Number of base model layers to keep frozen
+            (default: FINE_TUNE_FROZEN_LAYERS)
+        learning_rate: Learning rate for the recompiled model
+        jit_compile: Compile the training step with XLA
         
     Returns:
         Fine-tuned model
     """
+    if base_model_layers is None:
+        base_model_layers = FINE_TUNE_FROZEN_LAYERS
+    
     # Unfreeze top layers of base model
-    base_model = model.layers[0]
+    base_model = find_backbone(model)
     base_model.trainable = True
     
     # Freeze bottom layers
@@ -315,11 +620,493 @@ def fine_tune_model(model, base_model_layers=15):
     
     # Recompile with lower learning rate
     model.compile(
-        optimizer=Adam(learning_rate=1e-5),
+        optimizer=Adam(learning_rate=learning_rate),
         loss='binary_crossentropy',
         metrics=['accuracy', 
                 tf.keras.metrics.Precision(), 
-                tf.keras.metrics.Recall()]
+                tf.keras.metrics.Recall()],
+        jit_compile=jit_compile
     )
     
     return model
+
+
+def build_student_model(architecture='mobilenet', img_size=(224, 224)):
+    """
+    Build a compact student network for distillation
+    
+    The final Dense layer is named 'logits' so the distillation loss can use
+    the pre-sigmoid output; the model itself outputs a probability, like the
+    teacher, so it can be served by Predictor unchanged.
+    
+    Args:
+        architecture: 'mobilenet' (depthwise-separable blocks) or 'custom_cnn'
+        img_size: Input image dimensions (height, width)
+        
+    Returns:
+        Uncompiled Keras model
+    """
+    inputs = layers.Input(shape=(img_size[0], img_size[1], 3))
+    
+    if architecture == 'mobilenet':
+        x = layers.Conv2D(32, (3, 3), strides=2, padding='same', use_bias=False)(inputs)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU(6.0)(x)
+        for filters, strides in ((64, 1), (128, 2), (128, 1), (256, 2), (256, 1), (512, 2)):
+            x = layers.DepthwiseConv2D((3, 3), strides=strides, padding='same', use_bias=False)(x)
+            x = layers.BatchNormalization()(x)
+            x = layers.ReLU(6.0)(x)
+            x = layers.Conv2D(filters, (1, 1), use_bias=False)(x)
+            x = layers.BatchNormalization()(x)
+            x = layers.ReLU(6.0)(x)
+        x = layers.GlobalAveragePooling2D()(x)
+        x = layers.Dropout(0.2)(x)
+    elif architecture == 'custom_cnn':
+        x = inputs
+        for filters in (32, 64, 128):
+            x = layers.Conv2D(filters, (3, 3), activation='relu')(x)
+            x = layers.MaxPooling2D((2, 2))(x)
+        x = layers.Flatten()(x)
+        x = layers.Dense(256, activation='relu')(x)
+        x = layers.Dropout(0.5)(x)
+    else:
+        raise ValueError(f"Unknown student architecture: {architecture}")
+    
+    logits = layers.Dense(1, name='logits', dtype='float32')(x)
+    outputs = layers.Activation('sigmoid', name='probability', dtype='float32')(logits)
+    return models.Model(inputs, outputs, name=f"student_{architecture}")
+
+
+def _load_batch(paths, img_size):
+    """Load and scale images the way the training generators do"""
+    batch = np.empty((len(paths), img_size[0], img_size[1], 3), dtype=np.float32)
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            img = img.convert('RGB').resize((img_size[1], img_size[0]), Image.NEAREST)
+            batch[i] = np.asarray(img, dtype=np.float32) / 255.0
+    return batch
+
+
+def compute_teacher_logits(teacher_path, image_paths, cache_path=TEACHER_LOGITS_CACHE,
+                           img_size=(224, 224), batch_size=64):
+    """
+    Teacher logits for a list of images, cached on disk
+    
+    Entries are keyed by path, size and mtime and tied to the teacher file's
+    mtime, so later runs only score images that are new or changed.
+    
+    Args:
+        teacher_path: Path to the teacher model
+        image_paths: Image files to score
+        cache_path: .npz file holding previously computed logits
+        img_size: Teacher input size
+        batch_size: Images per forward pass
+        
+    Returns:
+        NumPy array of logits aligned with image_paths
+    """
+    teacher_version = os.stat(teacher_path).st_mtime
+    keys = []
+    for path in image_paths:
+        stat = os.stat(path)
+        keys.append(f"{path}|{stat.st_size}|{stat.st_mtime}")
+    
+    cached = {}
+    cache_path = Path(cache_path)
+    if cache_path.exists():
+        with np.load(cache_path, allow_pickle=False) as data:
+            if float(data['teacher_version']) == teacher_version:
+                cached = dict(zip(data['keys'].tolist(), data['logits'].tolist()))
+    
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    print(f"Teacher logits: {len(keys) - len(missing)} cached, {len(missing)} to compute")
+    
+    if missing:
+        teacher = keras.models.load_model(teacher_path, compile=False)
+        for start in range(0, len(missing), batch_size):
+            indices = missing[start:start + batch_size]
+            batch = _load_batch([image_paths[i] for i in indices], img_size)
+            probabilities = np.asarray(teacher(batch, training=False), dtype=np.float64).reshape(-1)
+            probabilities = np.clip(probabilities, 1e-7, 1 - 1e-7)
+            for i, p in zip(indices, probabilities):
+                cached[keys[i]] = float(np.log(p / (1 - p)))
+        
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            cache_path,
+            keys=np.array(list(cached.keys())),
+            logits=np.array(list(cached.values()), dtype=np.float32),
+            teacher_version=teacher_version
+        )
+    
+    return np.array([cached[key] for key in keys], dtype=np.float32)
+
+
+def _distillation_files(train_dir, store=None, class_names=('cats', 'dogs')):
+    """List (path, label index) for the training directory and an optional image store"""
+    files = []
+    for label, class_name in enumerate(class_names):
+        class_dir = Path(train_dir) / class_name
+        if class_dir.is_dir():
+            for entry in sorted(os.scandir(class_dir), key=lambda e: e.name):
+                if entry.is_file() and Path(entry.name).suffix.lower() in ('.jpg', '.jpeg', '.png'):
+                    files.append((entry.path, label))
+    
+    if store is not None:
+        for path, class_name in store.labeled_files():
+            files.append((path, class_names.index(class_name)))
+    
+    return files
+
+
+def distill_student(teacher_path='models/cats_dogs_model.h5', train_dir='data/train',
+                    store=None, architecture='mobilenet', temperature=4.0, alpha=0.1,
+                    epochs=20, learning_rate=1e-3, batch_size=32, validation_split=0.2,
+                    model_save_path='models/student_model.h5', img_size=(224, 224),
+                    extra_callbacks=None, seed=42):
+    """
+    Train a compact student on the teacher's soft labels
+    
+    The loss is alpha * BCE(true label) + (1 - alpha) * T^2 * BCE(teacher
+    soft label at temperature T). Teacher logits come from the un-augmented
+    images and are cached, so the teacher never runs inside the training loop.
+    
+    Args:
+        teacher_path: Path to the teacher model
+        train_dir: Directory of class folders
+        store: Optional ImageStore with retraining images
+        architecture: Student architecture (see build_student_model)
+        temperature: Softening temperature T
+        alpha: Weight of the hard-label loss
+        epochs: Number of training epochs
+        learning_rate: Learning rate for optimizer
+        batch_size: Number of images per batch
+        validation_split: Fraction of images held out for validation
+        model_save_path: Where to save the student
+        img_size: Input image dimensions (height, width)
+        extra_callbacks: Additional Keras callbacks
+        seed: Shuffle seed for the train/validation split
+        
+    Returns:
+        Tuple of (student model, training history)
+    """
+    import pandas as pd
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    
+    files = _distillation_files(train_dir, store)
+    if not files:
+        raise ValueError(f"No training images found in {train_dir}")
+    
+    paths = [path for path, _ in files]
+    logits = compute_teacher_logits(teacher_path, paths, img_size=img_size)
+    
+    dataframe = pd.DataFrame({
+        'filename': paths,
+        'label': np.array([label for _, label in files], dtype=np.float32),
+        'soft': 1.0 / (1.0 + np.exp(-logits / temperature))
+    })
+    # The files are listed class by class and the validation subset is a
+    # contiguous slice, so shuffle first or it would hold a single class
+    dataframe = dataframe.sample(frac=1, random_state=seed).reset_index(drop=True)
+    
+    datagen = ImageDataGenerator(
+        rescale=1./255,
+        rotation_range=40,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        fill_mode='nearest',
+        validation_split=validation_split
+    )
+    generators = [
+        datagen.flow_from_dataframe(
+            dataframe, x_col='filename', y_col=['label', 'soft'],
+            target_size=img_size, batch_size=batch_size,
+            class_mode='raw', subset=subset, shuffle=shuffle
+        )
+        for subset, shuffle in (('training', True), ('validation', False))
+    ]
+    
+    # Training graph: the student's probability next to its temperature-softened
+    # probability, matched column-wise against [true label, teacher soft label]
+    student = build_student_model(architecture, img_size)
+    softened = layers.Rescaling(1.0 / temperature)(student.get_layer('logits').output)
+    softened = layers.Activation('sigmoid')(softened)
+    trainer = models.Model(
+        student.input, layers.Concatenate(name='distillation')([student.output, softened])
+    )
+    
+    def distillation_loss(y_true, y_pred):
+        hard = keras.losses.binary_crossentropy(y_true[:, :1], y_pred[:, :1])
+        soft = keras.losses.binary_crossentropy(y_true[:, 1:], y_pred[:, 1:])
+        return alpha * hard + (1.0 - alpha) * temperature ** 2 * soft
+    
+    def accuracy(y_true, y_pred):
+        return keras.metrics.binary_accuracy(y_true[:, :1], y_pred[:, :1])
+    
+    trainer.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss=distillation_loss,
+        metrics=[accuracy]
+    )
+    
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True, verbose=1),
+        ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-7, verbose=1)
+    ]
+    callbacks.extend(extra_callbacks or [])
+    
+    history = trainer.fit(
+        generators[0],
+        epochs=epochs,
+        validation_data=generators[1],
+        callbacks=callbacks,
+        verbose=1
+    )
+    
+    # The student shares the trainer's weights; save it on its own for serving
+    student.compile(optimizer=Adam(learning_rate=learning_rate),
+                    loss='binary_crossentropy', metrics=['accuracy'])
+    model_save_path = Path(model_save_path)
+    model_save_path.parent.mkdir(parents=True, exist_ok=True)
+    student.save(model_save_path)
+    
+    config = {
+        'architecture': f"Distilled {architecture} student",
+        'teacher': str(teacher_path),
+        'temperature': temperature,
+        'alpha': alpha,
+        'parameters': int(student.count_params()),
+        'training_images': len(files),
+        'input_shape': list(img_size) + [3],
+        'created_at': datetime.now().isoformat()
+    }
+    with open(model_save_path.with_suffix('.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    
+    print(f"Student model saved to {model_save_path}")
+    return student, history
+
+
+def compare_models(model_paths, test_dir='data/test', report_path='models/model_comparison.json',
+                   img_size=(224, 224), latency_runs=20, batch_size=32):
+    """
+    Compare models side by side on accuracy, size and CPU latency
+    
+    Args:
+        model_paths: Model files to compare
+        test_dir: Directory of labeled test images
+        report_path: Where to save the JSON report (None to skip)
+        img_size: Input image dimensions (height, width)
+        latency_runs: Timed forward passes per measurement
+        batch_size: Batch size for the throughput measurement
+        
+    Returns:
+        List of per-model result dictionaries. peak_rss_mb is the process
+        peak so far, so compare memory by evaluating each model in its own
+        process (as compare_backbones does).
+    """
+    files = _distillation_files(test_dir)
+    paths = [path for path, _ in files]
+    labels = np.array([label for _, label in files])
+    
+    results = []
+    for model_path in model_paths:
+        model = keras.models.load_model(model_path, compile=False)
+        
+        probabilities = []
+        for start in range(0, len(paths), batch_size):
+            batch = _load_batch(paths[start:start + batch_size], img_size)
+            probabilities.append(np.asarray(model(batch, training=False)).reshape(-1))
+        probabilities = np.concatenate(probabilities) if probabilities else np.array([])
+        
+        single = np.random.rand(1, img_size[0], img_size[1], 3).astype(np.float32)
+        batch = np.random.rand(batch_size, img_size[0], img_size[1], 3).astype(np.float32)
+        model(single, training=False)  # warm-up
+        timings = {}
+        for name, data in (('single', single), ('batch', batch)):
+            samples = []
+            for _ in range(latency_runs):
+                start = time.perf_counter()
+                model(data, training=False)
+                samples.append(time.perf_counter() - start)
+            timings[name] = float(np.median(samples))
+        
+        results.append({
+            'model': str(model_path),
+            'accuracy': float(accuracy_score(labels, (probabilities > 0.5).astype(int))) if len(labels) else None,
+            'roc_auc': float(roc_auc_score(labels, probabilities)) if len(set(labels)) > 1 else None,
+            'parameters': int(model.count_params()),
+            'file_size_mb': os.path.getsize(model_path) / (1024 * 1024),
+            'latency_ms': timings['single'] * 1000,
+            'throughput_images_per_second': batch_size / timings['batch'],
+            # ru_maxrss is reported in KB on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        })
+        
+        del model
+        tf.keras.backend.clear_session()
+    
+    if report_path is not None:
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump({'test_images': len(paths), 'models': results,
+                       'created_at': datetime.now().isoformat()}, f, indent=4)
+        print(f"Comparison saved to {report_path}")
+    
+    return results
+
+
+def pareto_front(results, maximize=('accuracy',), minimize=('latency_ms', 'peak_rss_mb')):
+    """
+    Flag results that no other result dominates
+    
+    Args:
+        results: List of result dictionaries
+        maximize: Keys where higher is better
+        minimize: Keys where lower is better
+        
+    Returns:
+        The same list, each entry with a 'pareto_optimal' flag
+    """
+    def as_costs(result):
+        return [-(result[key] or 0.0) for key in maximize] + [result[key] for key in minimize]
+    
+    costs = [as_costs(result) for result in results]
+    for i, result in enumerate(results):
+        result['pareto_optimal'] = not any(
+            all(a <= b for a, b in zip(other, costs[i])) and other != costs[i]
+            for j, other in enumerate(costs) if j != i
+        )
+    return results
+
+
+def _train_backbone_candidate(backbone, train_dir, epochs, model_path):
+    """Train one backbone's classification head (run in a child process)"""
+    from src.preprocessing import ImagePreprocessor
+    
+    train_gen, val_gen = ImagePreprocessor().create_data_generators(train_dir)
+    trainer = CatsDogsModel(backbone=backbone)
+    trainer.build_model(use_pretrained=True)
+    trainer.train(train_gen, val_gen, epochs=epochs, model_save_path=model_path)
+    return model_path
+
+
+def compare_backbones(backbones=tuple(BACKBONES), train_dir='data/train', test_dir='data/test',
+                      epochs=5, output_dir='models/backbones',
+                      report_path='models/backbone_comparison.json', retrain=False):
+    """
+    Train (if needed) and evaluate each backbone, then mark the Pareto front
+    
+    Every training run and evaluation happens in a fresh process so that
+    memory measurements are not inflated by previously loaded models.
+    
+    Args:
+        backbones: Backbone names to compare
+        train_dir: Directory of class folders for training
+        test_dir: Directory of class folders for evaluation
+        epochs: Head-training epochs per candidate
+        output_dir: Where candidate models are saved
+        report_path: Where to save the JSON report
+        retrain: Retrain candidates that already have a saved model
+        
+    Returns:
+        List of per-backbone result dictionaries
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    
+    for backbone in backbones:
+        model_path = str(Path(output_dir) / f"{backbone}.h5")
+        
+        if retrain or not Path(model_path).exists():
+            print(f"Training {backbone} head for {epochs} epochs...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                pool.submit(_train_backbone_candidate, backbone, train_dir, epochs, model_path).result()
+        
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(compare_models, [model_path], test_dir, None).result()[0]
+        result['backbone'] = backbone
+        results.append(result)
+    
+    pareto_front(results)
+    
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump({'models': results, 'created_at': datetime.now().isoformat()}, f, indent=4)
+    print(f"Backbone comparison saved to {report_path}")
+    
+    return results
+
+
+def main():
+    """Command line entry point for distillation and model comparison"""
+    parser = argparse.ArgumentParser(description="Distill and compare Cats vs Dogs models")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    distill_parser = subparsers.add_parser('distill', help="Train a student on the teacher's soft labels")
+    distill_parser.add_argument('--teacher', default='models/cats_dogs_model.h5')
+    distill_parser.add_argument('--train-dir', default='data/train')
+    distill_parser.add_argument('--retrain-store', default='data/retrain',
+                                help="Image store with retraining data ('' to skip)")
+    distill_parser.add_argument('--architecture', choices=STUDENT_ARCHITECTURES, default='mobilenet')
+    distill_parser.add_argument('--temperature', type=float, default=4.0)
+    distill_parser.add_argument('--alpha', type=float, default=0.1)
+    distill_parser.add_argument('--epochs', type=int, default=20)
+    distill_parser.add_argument('--output', default='models/student_model.h5')
+    
+    compare_parser = subparsers.add_parser('compare', help="Compare accuracy, size and latency")
+    compare_parser.add_argument('models', nargs='+')
+    compare_parser.add_argument('--test-dir', default='data/test')
+    
+    cache_parser = subparsers.add_parser('cache-weights', help="Download backbone weights into the local cache")
+    cache_parser.add_argument('backbones', nargs='*', default=list(BACKBONES))
+    
+    backbones_parser = subparsers.add_parser(
+        'compare-backbones', help="Train and compare backbones on accuracy, CPU latency and memory"
+    )
+    backbones_parser.add_argument('--backbones', nargs='+', choices=list(BACKBONES), default=list(BACKBONES))
+    backbones_parser.add_argument('--train-dir', default='data/train')
+    backbones_parser.add_argument('--test-dir', default='data/test')
+    backbones_parser.add_argument('--epochs', type=int, default=5)
+    backbones_parser.add_argument('--retrain', action='store_true',
+                                  help="Retrain candidates that were already trained")
+    
+    args = parser.parse_args()
+    
+    if args.command == 'distill':
+        from src.image_store import ImageStore, is_image_store
+        
+        store = None
+        if args.retrain_store and is_image_store(args.retrain_store):
+            store = ImageStore(args.retrain_store)
+        distill_student(args.teacher, args.train_dir, store, args.architecture,
+                        args.temperature, args.alpha, args.epochs,
+                        model_save_path=args.output)
+        compare_models([args.teacher, args.output])
+    elif args.command == 'cache-weights':
+        for backbone in args.backbones:
+            load_backbone(backbone, offline=False)
+            tf.keras.backend.clear_session()
+    elif args.command == 'compare-backbones':
+        results = compare_backbones(args.backbones, args.train_dir, args.test_dir,
+                                    args.epochs, retrain=args.retrain)
+        print(f"{'backbone':<20} {'accuracy':>8} {'latency':>10} {'peak RSS':>10} {'params':>12}  pareto")
+        for row in sorted(results, key=lambda r: r['latency_ms']):
+            print(f"{row['backbone']:<20} {row['accuracy']:>8.4f} {row['latency_ms']:>7.1f} ms "
+                  f"{row['peak_rss_mb']:>7.0f} MB {row['parameters']:>12,}  "
+                  f"{'*' if row['pareto_optimal'] else ''}")
+    else:
+        for row in compare_models(args.models, args.test_dir):
+            print(f"{row['model']}: accuracy {row['accuracy']:.4f}, "
+                  f"{row['parameters']:,} params, {row['file_size_mb']:.1f} MB, "
+                  f"{row['latency_ms']:.1f} ms/image, "
+                  f"{row['throughput_images_per_second']:.1f} images/s batched")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
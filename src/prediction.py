@@ -3,6 +3,9 @@ Prediction Module for Cats vs Dogs Classification
 Handles single and batch predictions
 """
 
+import os
+import time
+import threading
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
@@ -10,6 +13,46 @@ from pathlib import Path
 import json
 from datetime import datetime
 
+from src.runtime import configure_runtime, to_mixed_precision
+
+
+# Cascade serving: a small model answers confident images, the full model the rest
+PREDICTION_MODE = os.getenv('PREDICTION_MODE', 'full')
+CASCADE_MODEL_PATH = os.getenv('CASCADE_MODEL_PATH', 'models/cascade_small_model.h5')
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '0.9'))
+
+# Test-time augmentation views as (name, crop box [y1, x1, y2, x2] in
+# normalized coordinates). Swapping x1 and x2 mirrors the crop, and boxes
+# reaching outside [0, 1] zoom out with a black border. Requests use the
+# first N views, so the most useful ones come first.
+TTA_VIEWS = (
+    ('identity', (0.0, 0.0, 1.0, 1.0)),
+    ('flip', (0.0, 1.0, 1.0, 0.0)),
+    ('center_crop', (0.05, 0.05, 0.95, 0.95)),
+    ('center_crop_flip', (0.05, 0.95, 0.95, 0.05)),
+    ('zoom_out', (-0.05, -0.05, 1.05, 1.05)),
+    ('zoom_out_flip', (-0.05, 1.05, 1.05, -0.05)),
+    ('top_left', (0.0, 0.0, 0.9, 0.9)),
+    ('top_right', (0.0, 0.1, 0.9, 1.0)),
+    ('bottom_left', (0.1, 0.0, 1.0, 0.9)),
+    ('bottom_right', (0.1, 0.1, 1.0, 1.0)),
+)
+
+
+def _feature_output(model):
+    """
+    Output of the layer that feeds the classification head: the global
+    average pooling layer of a transfer-learning model, or the input of
+    the first Dense layer of the custom CNN
+    """
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.GlobalAveragePooling2D):
+            return layer.output
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Dense):
+            return layer.input
+    raise ValueError("Model has no feature layer before its classification head")
+
 
 class Predictor:
     """Handler for model predictions"""
@@ -31,11 +74,117 @@ class Predictor:
     def load_model(self):
         """Load the trained model"""
         if Path(self.model_path).exists():
-            self.model = keras.models.load_model(self.model_path)
+            # Inference only, so skip restoring the optimizer and training metrics
+            self.model = keras.models.load_model(self.model_path, compile=False)
+            
+            runtime = configure_runtime()
+            if runtime['mixed_precision']:
+                self.model = to_mixed_precision(self.model)
+            self._forward = self.model
+            self._embedding_forward = None
+            self._pad_batches = runtime['xla']
+            if runtime['xla']:
+                self._forward = tf.function(self.model, jit_compile=True)
+            
             print(f"Model loaded from {self.model_path}")
         else:
             raise FileNotFoundError(f"Model not found at {self.model_path}")
     
+    def predict_proba(self, image_batch):
+        """
+        Compute dog probabilities for a batch of images in one forward pass
+        
+        Args:
+            image_batch: Preprocessed array of shape (N, height, width, 3)
+            
+        Returns:
+            NumPy array of N probabilities
+        """
+        if self.model is None:
+            raise ValueError("Model not loaded")
+        
+        count = len(image_batch)
+        if self._pad_batches:
+            # XLA compiles one program per shape; pad to a power of two so
+            # micro-batches of any size reuse a handful of programs
+            padded = 1 << max(count - 1, 0).bit_length()
+            if padded != count:
+                image_batch = np.concatenate(
+                    [image_batch, np.zeros((padded - count,) + image_batch.shape[1:], image_batch.dtype)]
+                )
+        
+        # Calling the model directly avoids the per-call overhead of predict()
+        probabilities = self._forward(image_batch, training=False)
+        return np.asarray(probabilities, dtype=np.float32).reshape(-1)[:count]
+    
+    def predict_staged(self, image_batch):
+        """
+        Compute probabilities along with the stage that produced each one
+        
+        Args:
+            image_batch: Preprocessed array of shape (N, height, width, 3)
+            
+        Returns:
+            Tuple of (N probabilities, list of N stage names)
+        """
+        return self.predict_proba(image_batch), ['full'] * len(image_batch)
+    
+    def predict_with_embeddings(self, image_batch):
+        """
+        Compute probabilities and backbone embeddings in one forward pass
+        
+        The embedding is the pooled backbone feature vector the classification
+        head starts from (512 values for VGG16).
+        
+        Args:
+            image_batch: Preprocessed array of shape (N, height, width, 3)
+            
+        Returns:
+            Tuple of (N probabilities, (N, D) float32 embeddings)
+        """
+        if self.model is None:
+            raise ValueError("Model not loaded")
+        
+        if self._embedding_forward is None:
+            features = _feature_output(self.model)
+            self._embedding_forward = keras.Model(
+                self.model.inputs[0], [features, self.model.outputs[0]]
+            )
+        embeddings, probabilities = self._embedding_forward(image_batch, training=False)
+        return (np.asarray(probabilities, dtype=np.float32).reshape(-1),
+                np.asarray(embeddings, dtype=np.float32))
+    
+    def predict_embeddings(self, image_batch):
+        """Backbone embeddings for a batch (see predict_with_embeddings)"""
+        return self.predict_with_embeddings(image_batch)[1]
+    
+    def predict_tta(self, image_batch, views=len(TTA_VIEWS)):
+        """
+        Test-time augmentation: average the model over flipped, cropped and
+        rescaled views of each image
+        
+        All views of all images are cut out by a single crop_and_resize call
+        and scored in one forward pass.
+        
+        Args:
+            image_batch: Preprocessed array of shape (N, height, width, 3)
+            views: Number of TTA_VIEWS to use per image
+            
+        Returns:
+            Tuple of (N averaged probabilities, (N, views) per-view probabilities)
+        """
+        views = max(1, min(int(views), len(TTA_VIEWS)))
+        count, height, width = image_batch.shape[:3]
+        
+        boxes = np.tile(np.array([box for _, box in TTA_VIEWS[:views]], dtype=np.float32), (count, 1))
+        box_indices = np.repeat(np.arange(count, dtype=np.int32), views)
+        view_batch = tf.image.crop_and_resize(
+            image_batch, boxes, box_indices, (height, width), method='bilinear'
+        )
+        
+        view_probabilities = self.predict_proba(view_batch.numpy()).reshape(count, views)
+        return view_probabilities.mean(axis=1), view_probabilities
+    
     def predict_single(self, image_array, return_confidence=True):
         """
         Predict class for a single image
@@ -215,7 +364,167 @@ class Predictor:
         return stats
 
 
-def batch_predict_from_directory(predictor, image_dir, preprocessor):
+class CascadePredictor:
+    """
+    Early-exit cascade of a small model and the full model
+    
+    Every image is scored by the small model; only those whose confidence is
+    below the threshold are passed on to the full model.
+    """
+    
+    STAGES = ('small', 'full')
+    
+    def __init__(self, model_path='models/cats_dogs_model.h5',
+                 small_model_path=CASCADE_MODEL_PATH, threshold=CASCADE_THRESHOLD,
+                 class_names=None):
+        """
+        Initialize cascade predictor
+        
+        Args:
+            model_path: Path to the full model
+            small_model_path: Path to the small first-stage model
+            threshold: Minimum small-model confidence to answer without the full model
+            class_names: List of class names (default: ['cats', 'dogs'])
+        """
+        self.model_path = model_path
+        self.small = Predictor(small_model_path, class_names)
+        self.full = Predictor(model_path, class_names)
+        self.class_names = self.full.class_names
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.reset_statistics()
+    
+    @property
+    def model(self):
+        return self.full.model
+    
+    def reset_statistics(self):
+        """Clear per-stage traffic and latency counters"""
+        with self._lock:
+            self.stats = {stage: {'images': 0, 'seconds': 0.0} for stage in self.STAGES}
+            self.stats['batches'] = 0
+    
+    def predict_staged(self, image_batch, threshold=None):
+        """
+        Score a batch through the cascade
+        
+        Args:
+            image_batch: Preprocessed array of shape (N, height, width, 3)
+            threshold: Override of the confidence threshold
+            
+        Returns:
+            Tuple of (N probabilities, list of N stage names)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        
+        start = time.perf_counter()
+        probabilities = self.small.predict_proba(image_batch).copy()
+        small_seconds = time.perf_counter() - start
+        
+        confidence = np.maximum(probabilities, 1.0 - probabilities)
+        uncertain = np.flatnonzero(confidence < threshold)
+        
+        full_seconds = 0.0
+        if len(uncertain):
+            start = time.perf_counter()
+            probabilities[uncertain] = self.full.predict_proba(image_batch[uncertain])
+            full_seconds = time.perf_counter() - start
+        
+        stages = ['small'] * len(probabilities)
+        for index in uncertain:
+            stages[index] = 'full'
+        
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['small']['images'] += len(probabilities) - len(uncertain)
+            self.stats['small']['seconds'] += small_seconds
+            self.stats['full']['images'] += len(uncertain)
+            self.stats['full']['seconds'] += full_seconds
+        
+        return probabilities, stages
+    
+    def predict_proba(self, image_batch):
+        """Cascade probabilities for a batch (see predict_staged)"""
+        return self.predict_staged(image_batch)[0]
+    
+    def predict_tta(self, image_batch, views=len(TTA_VIEWS)):
+        """Test-time augmentation trades latency for accuracy, so it uses the full model"""
+        return self.full.predict_tta(image_batch, views)
+    
+    def predict_with_embeddings(self, image_batch):
+        """Embeddings come from the full model, whose backbone the index was built with"""
+        return self.full.predict_with_embeddings(image_batch)
+    
+    def predict_embeddings(self, image_batch):
+        return self.full.predict_embeddings(image_batch)
+    
+    def stage_statistics(self):
+        """
+        Per-stage traffic and latency since the counters were reset
+        
+        Returns:
+            Dictionary with the share of images answered by each stage and
+            the average seconds spent per image in each stage
+        """
+        with self._lock:
+            stats = {stage: dict(self.stats[stage]) for stage in self.STAGES}
+            batches = self.stats['batches']
+        
+        total = sum(stats[stage]['images'] for stage in self.STAGES)
+        # The small model runs on every image, the full model only on escalations
+        scored = {'small': total, 'full': stats['full']['images']}
+        
+        return {
+            'threshold': self.threshold,
+            'batches': batches,
+            'images': total,
+            'stages': {
+                stage: {
+                    'images': stats[stage]['images'],
+                    'traffic_share': stats[stage]['images'] / total if total else None,
+                    'seconds_per_image': (
+                        stats[stage]['seconds'] / scored[stage] if scored[stage] else None
+                    )
+                }
+                for stage in self.STAGES
+            }
+        }
+
+
+def load_predictor(model_path='models/cats_dogs_model.h5'):
+    """
+    Create the predictor selected by PREDICTION_MODE
+    
+    Falls back to the full model alone when the cascade's small model has
+    not been trained yet.
+    
+    Args:
+        model_path: Path to the full model
+        
+    Returns:
+        Predictor or CascadePredictor, wrapped in a ShadowPredictor while a
+        candidate model for model_path is in shadow or canary
+    """
+    from src.rollout import ShadowPredictor, active_rollout
+    
+    predictor = None
+    if PREDICTION_MODE == 'cascade':
+        if Path(CASCADE_MODEL_PATH).exists():
+            predictor = CascadePredictor(model_path=model_path)
+        else:
+            print(f"Cascade model not found at {CASCADE_MODEL_PATH}; serving the full model only")
+    predictor = predictor or Predictor(model_path=model_path)
+    
+    rollout = active_rollout(model_path)
+    if rollout is not None:
+        print(f"Candidate model {rollout['id']} in {rollout['status']} "
+              f"({rollout['canary_percent']}% canary)")
+        predictor = ShadowPredictor(predictor, Predictor(model_path=rollout['candidate']),
+                                    rollout, model_path)
+    return predictor
+
+
+def batch_predict_from_directory(predictor, image_dir, preprocessor, workers=0):
     """
     Predict all images in a directory
     
@@ -223,6 +532,8 @@ def batch_predict_from_directory(predictor, image_dir, preprocessor):
         predictor: Predictor instance
         image_dir: Directory containing images
         preprocessor: ImagePreprocessor instance
+        workers: Decode processes; with workers > 0 images are decoded in
+            parallel into a shared-memory ring and scored in batches
         
     Returns:
         List of predictions with filenames
@@ -233,6 +544,9 @@ def batch_predict_from_directory(predictor, image_dir, preprocessor):
                  list(Path(image_dir).glob('*.jpeg')) + \
                  list(Path(image_dir).glob('*.png'))
     
+    if workers > 0:
+        return _batch_predict_with_ring(predictor, image_paths, workers)
+    
     results = []
     for img_path in image_paths:
         try:
@@ -244,3 +558,36 @@ def batch_predict_from_directory(predictor, image_dir, preprocessor):
             print(f"Error predicting {img_path}: {e}")
     
     return results
+
+
+def _batch_predict_with_ring(predictor, image_paths, workers):
+    """Score image files through a DecodePipeline of float32 slots"""
+    from src.image_ring import DecodePipeline
+    
+    # float32 slots already hold model input, so batches go to the model as views
+    pipeline = DecodePipeline(predictor.predict_staged, workers=workers, dtype=np.float32)
+    try:
+        futures = [(path, pipeline.submit(path)) for path in image_paths]
+        results = []
+        for img_path, future in futures:
+            try:
+                probability, stage = future.result()
+            except Exception as e:
+                print(f"Error predicting {img_path}: {e}")
+                continue
+            predicted_class_idx = int(probability > 0.5)
+            confidence = probability if predicted_class_idx == 1 else 1 - probability
+            results.append({
+                'predicted_class': predictor.class_names[predicted_class_idx],
+                'class': predictor.class_names[predicted_class_idx],
+                'class_index': predicted_class_idx,
+                'probability': probability,
+                'confidence': confidence,
+                'confidence_percentage': f"{confidence * 100:.2f}%",
+                'stage': stage,
+                'timestamp': datetime.now().isoformat(),
+                'filename': img_path.name
+            })
+        return results
+    finally:
+        pipeline.close()
@@ -7,8 +7,11 @@ import os
 import numpy as np
 from pathlib import Path
 from PIL import Image
-import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
+
+from src.image_store import ImageStore, is_image_store
+
+# TensorFlow is imported inside the methods that need it so that API workers
+# can use the lightweight helpers here without loading the TF runtime
 
 
 class ImagePreprocessor:
@@ -36,6 +39,8 @@ class ImagePreprocessor:
         Returns:
             train_generator, validation_generator
         """
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+        
         train_datagen = ImageDataGenerator(
             rescale=1./255,
             rotation_range=40,
@@ -68,6 +73,83 @@ class ImagePreprocessor:
         
         return train_generator, validation_generator
     
+    def create_data_generators_from_store(self, store, validation_split=0.2):
+        """
+        Create training and validation generators from an image store's manifests
+        
+        Args:
+            store: ImageStore (or path to one) holding the labeled images
+            validation_split: Fraction of training data for validation
+            
+        Returns:
+            train_generator, validation_generator
+        """
+        if not isinstance(store, ImageStore):
+            store = ImageStore(store)
+        
+        return self.create_data_generators_from_files(
+            store.labeled_files(), store.class_names, validation_split
+        )
+    
+    def create_data_generators_from_files(self, labeled_files, class_names=('cats', 'dogs'),
+                                          validation_split=0.2, seed=42, cache=None):
+        """
+        Create training and validation generators from a list of labeled images
+        
+        The list is shuffled with a fixed seed before it is split, so both
+        classes appear in the validation subset and a resumed run validates
+        on the same images.
+        
+        Args:
+            labeled_files: List of (path, class name) tuples
+            class_names: Class names in label order
+            validation_split: Fraction of training data for validation
+            seed: Shuffle seed for the train/validation split
+            cache: Synced ThumbnailCache (see src/train_cache.py) to read
+                pre-resized images from and augment whole batches at once
+            
+        Returns:
+            train_generator, validation_generator
+        """
+        if cache is not None:
+            from src.train_cache import create_cached_generators
+            return create_cached_generators(cache, list(labeled_files), list(class_names),
+                                            self.img_size, self.batch_size, validation_split, seed)
+        
+        import pandas as pd
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+        
+        dataframe = pd.DataFrame(list(labeled_files), columns=['filename', 'class'])
+        dataframe = dataframe.sample(frac=1, random_state=seed).reset_index(drop=True)
+        
+        train_datagen = ImageDataGenerator(
+            rescale=1./255,
+            rotation_range=40,
+            width_shift_range=0.2,
+            height_shift_range=0.2,
+            shear_range=0.2,
+            zoom_range=0.2,
+            horizontal_flip=True,
+            fill_mode='nearest',
+            validation_split=validation_split
+        )
+        
+        generators = []
+        for subset, shuffle in (('training', True), ('validation', False)):
+            generators.append(train_datagen.flow_from_dataframe(
+                dataframe,
+                x_col='filename',
+                y_col='class',
+                classes=list(class_names),
+                target_size=self.img_size,
+                batch_size=self.batch_size,
+                class_mode='binary',
+                subset=subset,
+                shuffle=shuffle
+            ))
+        
+        return generators[0], generators[1]
+    
     def create_test_generator(self, test_dir):
         """
         Create test data generator (no augmentation)
@@ -78,6 +160,8 @@ class ImagePreprocessor:
         Returns:
             test_generator
         """
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+        
         test_datagen = ImageDataGenerator(rescale=1./255)
         
         test_generator = test_datagen.flow_from_directory(
@@ -100,6 +184,8 @@ class ImagePreprocessor:
         Returns:
             Preprocessed image array ready for model input
         """
+        from tensorflow.keras.preprocessing.image import load_img, img_to_array
+        
         img = load_img(image_path, target_size=self.img_size)
         img_array = img_to_array(img)
         img_array = np.expand_dims(img_array, axis=0)
@@ -181,32 +267,20 @@ class ImagePreprocessor:
 
 def organize_uploaded_data(upload_dir, output_dir, class_name):
     """
-    Organize uploaded images into proper directory structure
+    Add uploaded images to the content-addressed image store
     
     Args:
         upload_dir: Directory containing uploaded images
-        output_dir: Base directory for organized data
+        output_dir: Image store directory
         class_name: Class label (cats or dogs)
+        
+    Returns:
+        Number of new images stored (duplicates are skipped)
     """
-    from shutil import copy2
-    
-    class_dir = Path(output_dir) / class_name
-    class_dir.mkdir(parents=True, exist_ok=True)
-    
-    uploaded_images = list(Path(upload_dir).glob('*.jpg')) + \
-                     list(Path(upload_dir).glob('*.jpeg')) + \
-                     list(Path(upload_dir).glob('*.png'))
+    store = ImageStore(output_dir)
+    counts = store.import_directory(upload_dir, class_name)
     
-    copied_count = 0
-    for img_path in uploaded_images:
-        try:
-            dest_path = class_dir / img_path.name
-            copy2(img_path, dest_path)
-            copied_count += 1
-        except Exception as e:
-            print(f"Error copying {img_path}: {e}")
-    
-    return copied_count
+    return counts['stored']
 
 
 def get_dataset_statistics(data_dir):
@@ -219,16 +293,20 @@ def get_dataset_statistics(data_dir):
     Returns:
         Dictionary with dataset statistics
     """
+    if is_image_store(data_dir):
+        return ImageStore(data_dir).statistics()
+    
     stats = {}
     data_path = Path(data_dir)
     
     for class_dir in data_path.iterdir():
         if class_dir.is_dir():
-            class_name = class_dir.name
-            image_count = len(list(class_dir.glob('*.jpg'))) + \
-                         len(list(class_dir.glob('*.jpeg'))) + \
-                         len(list(class_dir.glob('*.png')))
-            stats[class_name] = image_count
+            # One directory listing per class instead of one per extension
+            with os.scandir(class_dir) as entries:
+                stats[class_dir.name] = sum(
+                    1 for entry in entries
+                    if os.path.splitext(entry.name)[1] in ('.jpg', '.jpeg', '.png')
+                )
     
     stats['total'] = sum(stats.values())
     
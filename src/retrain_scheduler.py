@@ -0,0 +1,473 @@
+"""
+Retraining Scheduler for Cats vs Dogs Classification
+Decides when to retrain (new-image and class-imbalance thresholds, a cron
+schedule, or on demand), coalesces duplicate requests, and runs each job as a
+budgeted, low-priority subprocess with a persisted queue and history
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+from src.retraining import (
+    CHECKPOINT_ROOT, PROGRESS_MARKER, RETRAIN_MODE, RETRAIN_MODES, RETRAIN_STATE_PATH,
+    SUMMARY_MARKER, interrupted_run, load_retrain_state
+)
+
+
+# Automatic triggers are opt-in; 0 disables a threshold
+RETRAIN_MIN_NEW_IMAGES = int(os.getenv('RETRAIN_MIN_NEW_IMAGES', '0'))
+RETRAIN_IMBALANCE_THRESHOLD = float(os.getenv('RETRAIN_IMBALANCE_THRESHOLD', '0'))
+RETRAIN_IMBALANCE_MIN_IMAGES = int(os.getenv('RETRAIN_IMBALANCE_MIN_IMAGES', '20'))
+# Five-field cron expression (e.g. '0 3 * * *'); runs when there are new images
+RETRAIN_CRON = os.getenv('RETRAIN_CRON', '')
+# Off-peak window (e.g. '01:00-05:00') that threshold-triggered jobs wait for
+RETRAIN_WINDOW = os.getenv('RETRAIN_WINDOW', '')
+
+# Resource budget of a training job. Threads and CPU affinity go to the
+# last RETRAIN_CPU_THREADS cores, leaving the first ones to serving.
+RETRAIN_CPU_THREADS = int(os.getenv('RETRAIN_CPU_THREADS', '0'))
+RETRAIN_MEMORY_MB = int(os.getenv('RETRAIN_MEMORY_MB', '0'))
+RETRAIN_NICE = int(os.getenv('RETRAIN_NICE', '10'))
+# Automatic jobs are held back while serving exceeds this many predictions/s
+RETRAIN_MAX_SERVING_RPS = float(os.getenv('RETRAIN_MAX_SERVING_RPS', '0'))
+
+RETRAIN_POLL_SECONDS = float(os.getenv('RETRAIN_POLL_SECONDS', '30'))
+RETRAIN_HISTORY_SIZE = int(os.getenv('RETRAIN_HISTORY_SIZE', '100'))
+
+# Mode precedence when requests are coalesced: a full run covers the others
+MODE_RANK = {'incremental': 0, 'auto': 1, 'full': 2}
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parse_cron(expression):
+    """
+    Parse a five-field cron expression
+
+    Supports '*', lists, ranges and steps ('*/15', '1-5', '0,30').
+
+    Returns:
+        List of five sets: minutes, hours, days, months, weekdays (0 = Sunday)
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression needs five fields: {expression!r}")
+
+    schedule = []
+    for field, (low, high) in zip(fields, _CRON_RANGES):
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(v) for v in part.split('-'))
+            else:
+                start = int(part)
+                end = high if step else start
+            values.update(range(start, end + 1, int(step or 1)))
+        schedule.append(values)
+
+    # Both 0 and 7 mean Sunday
+    if 7 in schedule[4]:
+        schedule[4].add(0)
+    return schedule
+
+
+def cron_matches(schedule, when):
+    """Check whether a datetime falls on a parsed cron schedule"""
+    minutes, hours, days, months, weekdays = schedule
+    return (when.minute in minutes and when.hour in hours and when.day in days
+            and when.month in months and (when.weekday() + 1) % 7 in weekdays)
+
+
+def in_window(window, when):
+    """Check a 'HH:MM-HH:MM' window (which may cross midnight); '' is always open"""
+    if not window:
+        return True
+    start, end = window.split('-')
+    now = when.strftime('%H:%M')
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+def _rss_mb(pid):
+    """Resident memory of a process from /proc, in MB"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RetrainScheduler:
+    """
+    Queue of retraining jobs fed by triggers and on-demand requests
+
+    With several API workers exactly one holds the scheduler lock and runs
+    jobs. The others drop their requests into a spool directory that the
+    leader picks up, and read the queue and history from the state file
+    the leader keeps up to date.
+    """
+
+    def __init__(self, store, model_path='models/cats_dogs_model.h5',
+                 output_path='models/retrained_model.h5', state_dir='models',
+                 checkpoint_root=CHECKPOINT_ROOT, retrain_state_path=RETRAIN_STATE_PATH,
+                 on_progress=None, on_finish=None, serving_count=None,
+                 poll_seconds=RETRAIN_POLL_SECONDS, resume_interrupted=True):
+        """
+        Initialize scheduler
+
+        Args:
+            store: ImageStore with the labeled retraining images
+            model_path: Serving model a job retrains and replaces
+            output_path: Where a job writes the retrained model
+            state_dir: Directory for the lock, spool, state file and job logs
+            checkpoint_root: Resumable checkpoint directory of src.retraining
+            retrain_state_path: Record of the last successful retrain
+            on_progress: Called with each progress dictionary of a job
+            on_finish: Called with the finished job dictionary
+            serving_count: Returns the total number of predictions served,
+                used to hold automatic jobs back under load
+            poll_seconds: Seconds between trigger checks
+            resume_interrupted: Queue a job at start if a run was interrupted
+        """
+        self.store = store
+        self.model_path = str(model_path)
+        self.output_path = str(output_path)
+        self.state_dir = Path(state_dir)
+        self.spool_dir = self.state_dir / 'retrain_requests'
+        self.log_dir = self.state_dir / 'retrain_logs'
+        self.state_path = self.state_dir / 'retrain_jobs.json'
+        self.checkpoint_root = str(checkpoint_root)
+        self.retrain_state_path = str(retrain_state_path)
+        self.resume_interrupted = resume_interrupted
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.serving_count = serving_count
+        self.poll_seconds = poll_seconds
+        self.cron = parse_cron(RETRAIN_CRON) if RETRAIN_CRON else None
+
+        self.queue = []
+        self.running = None
+        self.history = []
+        self.leader = False
+        self.process = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock_file = None
+        self._thread = None
+        self._last_cron_minute = None
+        self._last_count = None
+        self._serving_rate = 0.0
+
+    # ------------------------------------------------------------------
+    # Public interface
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Try to become the leader and start the scheduling thread"""
+        for directory in (self.spool_dir, self.log_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock_file = open(self.state_dir / 'retrain_scheduler.lock', 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Retraining scheduler runs in another worker; forwarding requests")
+            return
+
+        self.leader = True
+        self.history = self._read_state().get('history', [])
+        if self.resume_interrupted and interrupted_run(self.checkpoint_root) is not None:
+            self.request(reason='resume')
+        self._thread = threading.Thread(target=self._loop, name='retrain-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop scheduling; a running job is interrupted and resumes later"""
+        self._stop.set()
+        self._wake.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def request(self, mode=None, reason='on_demand', immediate=True):
+        """
+        Ask for a retrain
+
+        A request is merged into a job that is already queued: the reasons
+        are combined and the broader mode wins.
+
+        Args:
+            mode: 'full', 'incremental' or 'auto' (default: RETRAIN_MODE)
+            reason: Why the job was requested
+            immediate: Start as soon as nothing else is training; False waits
+                for the off-peak window and for serving load to drop
+
+        Returns:
+            The queued job dictionary (with 'coalesced' set if merged)
+        """
+        mode = mode or RETRAIN_MODE
+        if mode not in RETRAIN_MODES:
+            raise ValueError(f"Unknown retrain mode: {mode}")
+
+        if not self.leader:
+            request = {'mode': mode, 'reason': reason, 'immediate': immediate,
+                       'requested_at': datetime.now().isoformat()}
+            path = self.spool_dir / f"{time.time_ns()}-{os.getpid()}.json"
+            with open(path.with_suffix('.tmp'), 'w') as f:
+                json.dump(request, f)
+            os.replace(path.with_suffix('.tmp'), path)
+            return dict(request, status='forwarded')
+
+        with self._lock:
+            if self.queue:
+                job = self.queue[0]
+                if MODE_RANK[mode] > MODE_RANK[job['mode']]:
+                    job['mode'] = mode
+                if reason not in job['reasons']:
+                    job['reasons'].append(reason)
+                job['immediate'] = job['immediate'] or immediate
+                job['coalesced'] += 1
+            else:
+                job = {
+                    'id': datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+                    'mode': mode,
+                    'reasons': [reason],
+                    'immediate': immediate,
+                    'coalesced': 0,
+                    'status': 'queued',
+                    'requested_at': datetime.now().isoformat()
+                }
+                self.queue.append(job)
+            snapshot = dict(job)
+
+        self._save_state()
+        self._wake.set()
+        return snapshot
+
+    def snapshot(self):
+        """Running job, queue and history (from the leader's state file in other workers)"""
+        if not self.leader:
+            state = self._read_state()
+            return {'running': state.get('running'), 'queue': state.get('queue', []),
+                    'history': state.get('history', [])}
+        with self._lock:
+            return {'running': dict(self.running) if self.running else None,
+                    'queue': [dict(job) for job in self.queue],
+                    'history': list(self.history)}
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        """Write queue, running job and history atomically for other workers"""
+        with self._lock:
+            state = {'running': self.running, 'queue': self.queue, 'history': self.history,
+                     'updated_at': datetime.now().isoformat()}
+            temporary = self.state_path.with_suffix('.tmp')
+            with open(temporary, 'w') as f:
+                json.dump(state, f, indent=4)
+            os.replace(temporary, self.state_path)
+
+    def _collect_spooled(self):
+        """Queue requests forwarded by other workers"""
+        for path in sorted(self.spool_dir.glob('*.json')):
+            try:
+                with open(path, 'r') as f:
+                    request = json.load(f)
+                self.request(request['mode'], request['reason'], request['immediate'])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring retrain request {path.name}: {e}")
+            path.unlink(missing_ok=True)
+
+    def _check_triggers(self, now):
+        """Queue an automatic job when a threshold or the cron schedule fires"""
+        if self.running is not None or self.queue:
+            return
+
+        # Uploads land in whichever API worker took the request; replay the
+        # manifests so both the count and the class balance below include them
+        self.store.refresh()
+        cutoff = load_retrain_state(self.retrain_state_path).get('last_retrain_at')
+        new_files, old_files = self.store.partition_by_added(cutoff)
+        if not new_files:
+            return
+
+        if RETRAIN_MIN_NEW_IMAGES and len(new_files) >= RETRAIN_MIN_NEW_IMAGES:
+            self.request(reason=f'{len(new_files)} new images', immediate=False)
+
+        if RETRAIN_IMBALANCE_THRESHOLD and len(new_files) >= RETRAIN_IMBALANCE_MIN_IMAGES:
+            # Each upload carries a single label, so a batch of new images is
+            # lopsided by nature; judge the balance of everything stored
+            counts = {}
+            for _, class_name in new_files + old_files:
+                counts[class_name] = counts.get(class_name, 0) + 1
+            share = max(counts.values()) / (len(new_files) + len(old_files))
+            if share > RETRAIN_IMBALANCE_THRESHOLD:
+                # Skewed data would bias a fine-tune on it; rebalance with a full run
+                self.request('full', reason=f'class imbalance {share:.0%}', immediate=False)
+
+        minute = now.strftime('%Y%m%d%H%M')
+        if self.cron and minute != self._last_cron_minute and cron_matches(self.cron, now):
+            self._last_cron_minute = minute
+            self.request(reason='cron')
+
+    def _update_serving_rate(self, elapsed):
+        if self.serving_count is None or elapsed <= 0:
+            return
+        count = self.serving_count()
+        if self._last_count is not None:
+            self._serving_rate = (count - self._last_count) / elapsed
+        self._last_count = count
+
+    def _may_start(self, job, now):
+        """Immediate jobs start at once; automatic ones wait for off-peak and low load"""
+        if job['immediate']:
+            return True
+        if not in_window(RETRAIN_WINDOW, now):
+            return False
+        return not (RETRAIN_MAX_SERVING_RPS and self._serving_rate > RETRAIN_MAX_SERVING_RPS)
+
+    def _loop(self):
+        last_check = 0.0
+        while not self._stop.is_set():
+            self._wake.wait(timeout=1.0)
+            self._wake.clear()
+            self._collect_spooled()
+
+            now = datetime.now()
+            elapsed = time.monotonic() - last_check
+            if elapsed >= self.poll_seconds:
+                last_check = time.monotonic()
+                self._update_serving_rate(elapsed)
+                try:
+                    self._check_triggers(now)
+                except Exception as e:
+                    print(f"Error checking retrain triggers: {e}")
+
+            with self._lock:
+                job = self.queue[0] if self.queue else None
+                if job is None or not self._may_start(job, now):
+                    continue
+                self.queue.pop(0)
+                self.running = job
+            self._run(job)
+
+    # ------------------------------------------------------------------
+    # Job execution
+    # ------------------------------------------------------------------
+
+    def _limit_child(self):
+        """Runs in the training process before exec: priority and CPU budget"""
+        os.nice(RETRAIN_NICE)
+        if RETRAIN_CPU_THREADS and hasattr(os, 'sched_setaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, cores[-RETRAIN_CPU_THREADS:])
+
+    def _watch_memory(self, job):
+        """Track peak RSS and stop the job if it exceeds the memory budget"""
+        while self.process.poll() is None:
+            rss = _rss_mb(self.process.pid)
+            job['peak_rss_mb'] = max(job['peak_rss_mb'], rss)
+            if RETRAIN_MEMORY_MB and rss > RETRAIN_MEMORY_MB:
+                job['error'] = f"Memory budget exceeded ({rss:.0f} MB > {RETRAIN_MEMORY_MB} MB)"
+                # Checkpoints survive SIGTERM, so a later job resumes from here
+                self.process.send_signal(signal.SIGTERM)
+                return
+            time.sleep(1.0)
+
+    def _run(self, job):
+        """Run one job as a subprocess and record its outcome"""
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        job['log'] = str(self.log_dir / f"{job['id']}.log")
+        job['peak_rss_mb'] = 0.0
+        job['progress'] = None
+        self._save_state()
+        print(f"Starting retrain job {job['id']} ({job['mode']}; {', '.join(job['reasons'])})")
+
+        env = dict(os.environ, RETRAIN_CHECKPOINT_DIR=self.checkpoint_root,
+                   RETRAIN_STATE_PATH=self.retrain_state_path)
+        if RETRAIN_CPU_THREADS:
+            env.update(TF_INTRA_OP_THREADS=str(RETRAIN_CPU_THREADS), TF_INTER_OP_THREADS='1')
+        command = [
+            sys.executable, '-m', 'src.retraining', 'run', '--mode', job['mode'],
+            '--store', str(self.store.root), '--model-path', self.model_path,
+            '--output-path', self.output_path, '--progress'
+        ]
+
+        summary = None
+        start = time.monotonic()
+        try:
+            with open(job['log'], 'w') as log:
+                self.process = subprocess.Popen(
+                    command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                    env=env, cwd=str(Path(__file__).parent.parent), preexec_fn=self._limit_child
+                )
+                watcher = threading.Thread(target=self._watch_memory, args=(job,), daemon=True)
+                watcher.start()
+
+                for line in self.process.stdout:
+                    log.write(line)
+                    for marker in (PROGRESS_MARKER, SUMMARY_MARKER):
+                        index = line.find(marker)
+                        if index < 0:
+                            continue
+                        payload = json.loads(line[index + len(marker):])
+                        if marker == SUMMARY_MARKER:
+                            summary = payload
+                            continue
+                        # Shared through the state file with the other workers
+                        job['progress'] = payload
+                        self._save_state()
+                        if self.on_progress is not None:
+                            self.on_progress(payload)
+                returncode = self.process.wait()
+                watcher.join()
+
+            if returncode == 0:
+                job['status'] = 'completed' if summary is not None else 'skipped'
+            else:
+                job['status'] = 'failed'
+                job.setdefault('error', f"Training process exited with code {returncode}")
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            self.process = None
+
+        job['summary'] = summary
+        job['finished_at'] = datetime.now().isoformat()
+        job['duration_seconds'] = time.monotonic() - start
+        with self._lock:
+            self.running = None
+            self.history = ([job] + self.history)[:RETRAIN_HISTORY_SIZE]
+        self._save_state()
+        print(f"Retrain job {job['id']} {job['status']} in {job['duration_seconds']:.1f}s")
+
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"Error after retrain job {job['id']}: {e}")
@@ -0,0 +1,322 @@
+"""
+Resumable Full and Incremental Retraining for Cats vs Dogs Classification
+A full run retrains the serving model on every stored image; an incremental
+run fine-tunes it for a few epochs on the images labeled since the last
+retrain plus a replay sample of older data. Both keep weight, optimizer and
+epoch checkpoints so a run interrupted by a crash resumes where it stopped.
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import shutil
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from src.image_store import IMAGE_EXTENSIONS, ImageStore
+from src.rollout import ROLLOUT_MODE, start_rollout
+from src.train_cache import TRAIN_CACHE, ThumbnailCache
+
+
+RETRAIN_MODES = ('full', 'incremental', 'auto')
+
+# 'auto' runs incrementally once a full retrain has happened and no more
+# than INCREMENTAL_MAX_NEW images have arrived since the last retrain
+RETRAIN_MODE = os.getenv('RETRAIN_MODE', 'auto')
+RETRAIN_EPOCHS = int(os.getenv('RETRAIN_EPOCHS', '15'))
+INCREMENTAL_EPOCHS = int(os.getenv('INCREMENTAL_EPOCHS', '2'))
+INCREMENTAL_MAX_STEPS = int(os.getenv('INCREMENTAL_MAX_STEPS', '50'))
+INCREMENTAL_MAX_NEW = int(os.getenv('INCREMENTAL_MAX_NEW', '500'))
+INCREMENTAL_LEARNING_RATE = float(os.getenv('INCREMENTAL_LEARNING_RATE', '1e-5'))
+
+# Old images replayed per new image, drawn from the store and REPLAY_DIRS
+REPLAY_RATIO = float(os.getenv('REPLAY_RATIO', '1.0'))
+REPLAY_DIRS = [d for d in os.getenv('REPLAY_DIRS', 'data/train').split(',') if d]
+
+# Backbone layers kept frozen while retraining ('' keeps the saved model's
+# trainable layers, i.e. only the classification head for build_model())
+RETRAIN_FINE_TUNE_LAYERS = os.getenv('RETRAIN_FINE_TUNE_LAYERS', '')
+
+# Batches between checkpoints; 0 checkpoints at the end of every epoch
+RETRAIN_CHECKPOINT_STEPS = int(os.getenv('RETRAIN_CHECKPOINT_STEPS', '0'))
+CHECKPOINT_ROOT = os.getenv('RETRAIN_CHECKPOINT_DIR', 'models/retrain_checkpoints')
+RETRAIN_STATE_PATH = os.getenv('RETRAIN_STATE_PATH', 'models/retrain_state.json')
+
+# Line prefixes of the machine-readable output of `run --progress`
+PROGRESS_MARKER = '@@retrain-progress '
+SUMMARY_MARKER = '@@retrain-summary '
+
+
+def load_retrain_state(state_path=RETRAIN_STATE_PATH):
+    """Record of the last successful retrain, or an empty dictionary"""
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def interrupted_run(checkpoint_root=CHECKPOINT_ROOT):
+    """Settings of a run that started but never finished, or None"""
+    try:
+        with open(Path(checkpoint_root) / 'run.json', 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _directory_files(directories, class_names):
+    """(path, class) pairs from <dir>/<class>/ folders"""
+    files = []
+    for directory in directories:
+        for class_name in class_names:
+            class_dir = Path(directory) / class_name
+            if not class_dir.is_dir():
+                continue
+            with os.scandir(class_dir) as entries:
+                files.extend((entry.path, class_name) for entry in entries
+                             if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    return files
+
+
+def replay_sample(old_files, count, replay_dirs=REPLAY_DIRS, class_names=('cats', 'dogs'),
+                  seed=0):
+    """
+    Sample older labeled images to mix into an incremental run
+
+    Args:
+        old_files: (path, class) pairs already seen by the serving model
+        count: Number of images to draw
+        replay_dirs: Directories of class folders with the original training data
+        class_names: Class folder names
+        seed: Sampling seed (kept with a run so a resume sees the same sample)
+
+    Returns:
+        List of (path, class name) tuples
+    """
+    # Sorted so the same seed draws the same sample when a run resumes
+    pool = sorted(set(old_files) | set(_directory_files(replay_dirs, class_names)))
+    return random.Random(seed).sample(pool, min(count, len(pool)))
+
+
+def choose_mode(mode, new_count, state, model_exists):
+    """Resolve 'auto' and fall back to a full run when incremental is not possible"""
+    if not model_exists:
+        return 'full'
+    if mode == 'auto':
+        incremental = bool(state.get('last_retrain_at')) and new_count <= INCREMENTAL_MAX_NEW
+        return 'incremental' if incremental else 'full'
+    return mode
+
+
+class _RunLock:
+    """Exclusive lock so API workers never train the same checkpoint twice"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'w')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise RuntimeError("Another retraining run is in progress")
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def run_retraining(store, mode=RETRAIN_MODE, model_path='models/cats_dogs_model.h5',
+                   output_path='models/retrained_model.h5', preprocessor=None,
+                   extra_callbacks=None, checkpoint_root=CHECKPOINT_ROOT,
+                   state_path=RETRAIN_STATE_PATH):
+    """
+    Retrain the serving model and replace it with the result
+
+    An interrupted run found in checkpoint_root is resumed with its
+    original mode, data cutoff and replay sample. With ROLLOUT_MODE=canary
+    the result becomes a candidate model (see src/rollout.py) instead.
+
+    Args:
+        store: ImageStore with the labeled retraining images
+        mode: 'full', 'incremental' or 'auto'
+        model_path: Serving model to start from and to replace
+        output_path: Where the retrained model is written before the swap
+        preprocessor: ImagePreprocessor for the data generators
+        extra_callbacks: Additional Keras callbacks (e.g. progress reporting)
+        checkpoint_root: Directory for the resumable checkpoint
+        state_path: Record of the last successful retrain
+
+    Returns:
+        Summary dictionary, or None when there was nothing to train on
+    """
+    from src.model import CatsDogsModel
+    from src.preprocessing import ImagePreprocessor
+
+    if mode not in RETRAIN_MODES:
+        raise ValueError(f"Unknown retrain mode: {mode}")
+    if not isinstance(store, ImageStore):
+        store = ImageStore(store)
+    preprocessor = preprocessor or ImagePreprocessor()
+    checkpoint_root = Path(checkpoint_root)
+
+    with _RunLock(checkpoint_root / 'lock'):
+        run = interrupted_run(checkpoint_root)
+        resumed = run is not None
+        if run is None:
+            state = load_retrain_state(state_path)
+            cutoff = state.get('last_retrain_at')
+            new_files, _ = store.partition_by_added(cutoff)
+            run = {
+                'mode': choose_mode(mode, len(new_files), state, Path(model_path).exists()),
+                'cutoff': cutoff,
+                'started_at': datetime.now().isoformat(),
+                'seed': random.randrange(2 ** 31),
+                'fine_tune_layers': RETRAIN_FINE_TUNE_LAYERS
+            }
+
+        new_files, old_files = store.partition_by_added(run['cutoff'])
+        if run['mode'] == 'incremental':
+            if not new_files:
+                print("No images labeled since the last retrain")
+                return None
+            replay = replay_sample(old_files, int(round(len(new_files) * REPLAY_RATIO)),
+                                   class_names=store.class_names, seed=run['seed'])
+            files = new_files + replay
+            epochs = INCREMENTAL_EPOCHS
+            learning_rate = INCREMENTAL_LEARNING_RATE
+            train_options = {'max_steps_per_epoch': INCREMENTAL_MAX_STEPS}
+        else:
+            files, replay = new_files + old_files, []
+            epochs = RETRAIN_EPOCHS
+            learning_rate = None
+            train_options = {}
+        if not files:
+            print("No retraining data available")
+            return None
+
+        checkpoint_root.mkdir(parents=True, exist_ok=True)
+        with open(checkpoint_root / 'run.json', 'w') as f:
+            json.dump(run, f, indent=4)
+        if resumed:
+            print(f"Resuming interrupted {run['mode']} retrain started at {run['started_at']}")
+        elif Path(output_path).exists():
+            # A stale file from an earlier run must not be promoted
+            Path(output_path).unlink()
+
+        print(f"{run['mode'].capitalize()} retrain on {len(files)} images "
+              f"({len(new_files)} new, {len(files) - len(new_files)} older)")
+        start = time.time()
+
+        cache = None
+        if TRAIN_CACHE:
+            # Thumbnails of every usable image, so later incremental runs find theirs
+            cache = ThumbnailCache()
+            sync = cache.sync(store.labeled_files() + _directory_files(REPLAY_DIRS, store.class_names),
+                              prune=True)
+            print(f"Training image cache: {sync['built']} built, {sync['pruned']} pruned "
+                  f"in {sync['seconds']:.1f}s")
+        
+        train_gen, val_gen = preprocessor.create_data_generators_from_files(
+            files, store.class_names, validation_split=0.2, seed=run['seed'], cache=cache
+        )
+        train_options.update(
+            checkpoint_dir=str(checkpoint_root / run['mode']),
+            checkpoint_freq=RETRAIN_CHECKPOINT_STEPS or 'epoch'
+        )
+        fine_tune_layers = int(run['fine_tune_layers']) if run['fine_tune_layers'] != '' else None
+
+        model_trainer = CatsDogsModel(img_size=(224, 224), learning_rate=0.0001)
+        if Path(model_path).exists():
+            history = model_trainer.retrain(
+                train_gen, val_gen, str(model_path), epochs=epochs,
+                model_save_path=str(output_path), extra_callbacks=extra_callbacks,
+                fine_tune_layers=fine_tune_layers, learning_rate=learning_rate,
+                **train_options
+            )
+        else:
+            # Train from scratch if no pretrained model
+            model_trainer.build_model(use_pretrained=True)
+            history = model_trainer.train(
+                train_gen, val_gen, epochs=epochs, model_save_path=str(output_path),
+                extra_callbacks=extra_callbacks, **train_options
+            )
+
+        if not Path(output_path).exists():
+            # ModelCheckpoint only writes when a validation score is available
+            model_trainer.model.save(output_path)
+
+        summary = {
+            'mode': run['mode'],
+            'resumed': resumed,
+            'images': len(files),
+            'new_images': len(new_files),
+            'replay_images': len(replay),
+            'epochs': len(history.history.get('loss', [])),
+            'duration_seconds': time.time() - start,
+            'last_retrain_at': run['started_at'],
+            'finished_at': datetime.now().isoformat()
+        }
+
+        if ROLLOUT_MODE == 'canary' and Path(model_path).exists():
+            # The retrained model has to prove itself on live traffic first
+            summary['rollout'] = start_rollout(output_path, model_path, summary)['id']
+        else:
+            # Replace current model with retrained one
+            shutil.copy(output_path, model_path)
+        with open(state_path, 'w') as f:
+            json.dump(summary, f, indent=4)
+        (checkpoint_root / 'run.json').unlink()
+
+    print(f"Retrain finished in {summary['duration_seconds']:.1f}s")
+    return summary
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Full or incremental retraining")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Retrain (or resume an interrupted run)")
+    run_parser.add_argument('--mode', choices=RETRAIN_MODES, default=RETRAIN_MODE)
+    run_parser.add_argument('--store', default='data/retrain')
+    run_parser.add_argument('--model-path', default='models/cats_dogs_model.h5')
+    run_parser.add_argument('--output-path', default='models/retrained_model.h5')
+    run_parser.add_argument('--progress', action='store_true',
+                            help="Print progress and the summary as marked JSON lines")
+
+    subparsers.add_parser('status', help="Show the last retrain and any interrupted run")
+
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print(json.dumps({'last_retrain': load_retrain_state(),
+                          'interrupted_run': interrupted_run()}, indent=4))
+        return
+
+    callbacks = None
+    if args.progress:
+        from src.model import TrainingProgressCallback
+
+        # Read by the retraining scheduler, which runs this command as its job
+        def report(progress):
+            print(f"\n{PROGRESS_MARKER}{json.dumps(progress)}", flush=True)
+        callbacks = [TrainingProgressCallback(report)]
+
+    summary = run_retraining(ImageStore(args.store), args.mode, model_path=args.model_path,
+                             output_path=args.output_path, extra_callbacks=callbacks)
+    if args.progress:
+        print(f"\n{SUMMARY_MARKER}{json.dumps(summary)}", flush=True)
+    elif summary is not None:
+        print(json.dumps(summary, indent=4))
+
+if __name__ == "__main__":
+    sys.exit(main())
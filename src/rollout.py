@@ -0,0 +1,441 @@
+"""
+Shadow and Canary Rollout of Retrained Cats vs Dogs Models
+A retrained model becomes a candidate next to the serving model instead of
+replacing it. The candidate scores a sample of live batches alongside the
+serving model (shadow), then answers a growing share of requests (canary),
+and is promoted or rejected from the measured agreement, confidence and
+latency rather than swapped in unseen
+"""
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import threading
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+
+# 'replace' swaps a retrained model in directly; 'canary' rolls it out gradually
+ROLLOUT_MODE = os.getenv('ROLLOUT_MODE', 'replace')
+# Share of batches the candidate also scores, whatever the canary percentage
+ROLLOUT_SHADOW_FRACTION = float(os.getenv('ROLLOUT_SHADOW_FRACTION', '0.2'))
+# Canary percentages stepped through after the shadow phase; the last step
+# passing promotes the candidate
+ROLLOUT_CANARY_STEPS = [int(step) for step in os.getenv('ROLLOUT_CANARY_STEPS', '5,25,50,100').split(',')]
+# Compared images a step needs before it is judged
+ROLLOUT_MIN_SAMPLES = int(os.getenv('ROLLOUT_MIN_SAMPLES', '200'))
+ROLLOUT_MIN_AGREEMENT = float(os.getenv('ROLLOUT_MIN_AGREEMENT', '0.9'))
+# Largest drop in mean confidence (candidate minus serving) accepted
+ROLLOUT_MAX_CONFIDENCE_DROP = float(os.getenv('ROLLOUT_MAX_CONFIDENCE_DROP', '0.05'))
+# Largest candidate / serving forward-pass time ratio accepted
+ROLLOUT_MAX_LATENCY_RATIO = float(os.getenv('ROLLOUT_MAX_LATENCY_RATIO', '1.5'))
+# Apply decisions automatically ('0' leaves them to the rollout endpoints)
+ROLLOUT_AUTO = os.getenv('ROLLOUT_AUTO', '1') == '1'
+
+ACTIVE_STATUSES = ('shadow', 'canary')
+
+# Seconds between checks of the state file by the serving process
+_STATE_CHECK_SECONDS = 1.0
+
+
+def candidate_path(model_path):
+    """Where the candidate for a serving model is kept"""
+    return Path(model_path).with_name('candidate_model.h5')
+
+
+def rollout_state_path(model_path):
+    """Rollout record of a serving model"""
+    return Path(model_path).with_name('rollout.json')
+
+
+def load_rollout_state(model_path):
+    """Rollout record, or an empty dictionary before the first rollout"""
+    try:
+        with open(rollout_state_path(model_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def active_rollout(model_path):
+    """Rollout record if a candidate is being evaluated for model_path, else None"""
+    state = load_rollout_state(model_path)
+    if state.get('status') not in ACTIVE_STATUSES:
+        return None
+    if Path(state['serving']).resolve() != Path(model_path).resolve():
+        return None
+    if not Path(state['candidate']).exists():
+        return None
+    return state
+
+
+class _StateLock:
+    """Exclusive lock around read-modify-write of the rollout record"""
+
+    def __init__(self, model_path):
+        self.path = rollout_state_path(model_path).with_suffix('.lock')
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def _save_state(model_path, state):
+    path = rollout_state_path(model_path)
+    temporary = path.with_suffix('.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(temporary, path)
+
+
+def start_rollout(new_model_path, model_path, summary=None):
+    """
+    Make a freshly trained model the candidate for model_path
+
+    Args:
+        new_model_path: Retrained model file
+        model_path: Serving model it may replace
+        summary: Retrain summary kept with the record
+
+    Returns:
+        The new rollout record
+    """
+    with _StateLock(model_path):
+        candidate = candidate_path(model_path)
+        temporary = candidate.with_suffix('.tmp')
+        shutil.copy(new_model_path, temporary)
+        os.replace(temporary, candidate)
+
+        now = datetime.now()
+        state = {
+            'id': now.strftime('%Y%m%dT%H%M%S'),
+            'status': 'shadow',
+            'candidate': str(candidate),
+            'serving': str(model_path),
+            'canary_percent': 0,
+            'step': 0,
+            'step_started_at': now.isoformat(),
+            'created_at': now.isoformat(),
+            'retrain': summary,
+            'history': []
+        }
+        _save_state(model_path, state)
+    print(f"Candidate model {state['id']} is in shadow")
+    return state
+
+
+def evaluate(stats, min_samples=ROLLOUT_MIN_SAMPLES, min_agreement=ROLLOUT_MIN_AGREEMENT,
+             max_confidence_drop=ROLLOUT_MAX_CONFIDENCE_DROP,
+             max_latency_ratio=ROLLOUT_MAX_LATENCY_RATIO):
+    """
+    Judge the current step from the live comparison statistics
+
+    Returns:
+        Tuple of ('hold', 'pass' or 'fail', list of reasons)
+    """
+    if stats['compared'] < min_samples:
+        return 'hold', [f"{stats['compared']}/{min_samples} images compared"]
+
+    failures = []
+    if stats['agreement'] < min_agreement:
+        failures.append(f"agreement {stats['agreement']:.3f} < {min_agreement}")
+    if stats['mean_confidence_delta'] < -max_confidence_drop:
+        failures.append(f"confidence delta {stats['mean_confidence_delta']:+.3f} < -{max_confidence_drop}")
+    if stats['latency_ratio'] is not None and stats['latency_ratio'] > max_latency_ratio:
+        failures.append(f"latency ratio {stats['latency_ratio']:.2f} > {max_latency_ratio}")
+    return ('fail', failures) if failures else ('pass', [])
+
+
+def apply_decision(model_path, rollout_id, step, decision, stats=None, reasons=None,
+                   percent=None):
+    """
+    Advance, promote or reject the candidate
+
+    The record is only changed if it is still at rollout_id and step, so
+    several API workers judging the same statistics act once.
+
+    Args:
+        model_path: Serving model path
+        rollout_id: Rollout the decision was made for
+        step: Step the decision was made for
+        decision: 'pass' (next canary step, or promote after the last),
+            'fail' (reject), 'promote', 'reject' or 'canary' (set percent)
+        stats: Statistics the decision was based on, kept in the history
+        reasons: Explanation kept in the history
+        percent: Canary percentage for decision 'canary'
+
+    Returns:
+        New status ('shadow', 'canary', 'promoted', 'rejected'), or None if
+        the record had moved on
+    """
+    with _StateLock(model_path):
+        state = load_rollout_state(model_path)
+        if state.get('id') != rollout_id or state.get('step') != step \
+                or state.get('status') not in ACTIVE_STATUSES:
+            return None
+
+        state['history'].append({
+            'step': step, 'canary_percent': state['canary_percent'], 'decision': decision,
+            'reasons': reasons or [], 'stats': stats, 'at': datetime.now().isoformat()
+        })
+
+        if decision == 'pass':
+            later = [p for p in ROLLOUT_CANARY_STEPS if p > state['canary_percent']]
+            decision = 'canary' if later else 'promote'
+            percent = later[0] if later else None
+        elif decision == 'fail':
+            decision = 'reject'
+
+        if decision == 'canary':
+            state['canary_percent'] = max(0, min(int(percent), 100))
+            state['status'] = 'canary' if state['canary_percent'] else 'shadow'
+            state['step'] += 1
+            state['step_started_at'] = datetime.now().isoformat()
+        elif decision == 'promote':
+            serving = Path(state['serving'])
+            if serving.exists():
+                shutil.copy(serving, serving.with_name('previous_model.h5'))
+            temporary = serving.with_suffix('.tmp')
+            shutil.copy(state['candidate'], temporary)
+            os.replace(temporary, serving)
+            Path(state['candidate']).unlink()
+            state['status'] = 'promoted'
+        elif decision == 'reject':
+            # Kept for inspection until the next candidate
+            os.replace(state['candidate'], Path(state['candidate']).with_name('rejected_model.h5'))
+            state['status'] = 'rejected'
+        else:
+            raise ValueError(f"Unknown rollout decision: {decision}")
+
+        if state['status'] in ('promoted', 'rejected'):
+            state['finished_at'] = datetime.now().isoformat()
+        _save_state(model_path, state)
+
+    print(f"Candidate model {rollout_id}: {state['status']}"
+          + (f" at {state['canary_percent']}%" if state['status'] == 'canary' else ''))
+    return state['status']
+
+
+class ShadowPredictor:
+    """
+    Serving predictor paired with a candidate under evaluation
+
+    A sampled batch is scored by the candidate on a background thread once
+    the serving predictor has answered it. Without canary images in the
+    batch the response does not wait for the candidate, and a batch is only
+    shadowed when no earlier candidate call is still running, so the extra
+    work is bounded by one forward pass at a time. Anything other than
+    predict_staged is answered by the serving predictor.
+
+    The candidate is a full model, so it is compared with the serving full
+    model: behind a cascade, the shadow thread scores the batch with the
+    cascade's full stage as well. Forward-pass times only count towards the
+    latency ratio when the serving and candidate passes did not overlap.
+    """
+
+    def __init__(self, primary, candidate, state, model_path,
+                 shadow_fraction=ROLLOUT_SHADOW_FRACTION, seed=None):
+        """
+        Initialize shadow predictor
+
+        Args:
+            primary: Serving Predictor or CascadePredictor
+            candidate: Predictor for the candidate model
+            state: Active rollout record
+            model_path: Serving model path (locates the rollout record)
+            shadow_fraction: Share of batches the candidate scores
+            seed: Seed for batch and canary sampling
+        """
+        self.primary = primary
+        # A cascade answers most images from its small model; the candidate
+        # is judged against the full model it would replace
+        self.reference = getattr(primary, 'full', primary)
+        self.candidate = candidate
+        self.model_path = model_path
+        self.rollout_id = state['id']
+        self.shadow_fraction = shadow_fraction
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        # [running, started] forward passes of the serving and shadow sides
+        self._activity = {'serving': [0, 0], 'shadow': [0, 0]}
+        self._state = state
+        self._state_checked = time.monotonic()
+        self._reset(state)
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def _reset(self, state):
+        self.step = state['step']
+        self.canary_percent = state['canary_percent']
+        self.stats = {'batches': 0, 'compared': 0, 'agreed': 0, 'abs_delta_sum': 0.0,
+                      'confidence_delta_sum': 0.0, 'timed_batches': 0, 'primary_seconds': 0.0,
+                      'candidate_seconds': 0.0, 'canary_images': 0, 'skipped_busy': 0,
+                      'errors': 0}
+
+    def _refresh_state(self):
+        """Follow step changes written by the API (at most once a second)"""
+        now = time.monotonic()
+        if now - self._state_checked < _STATE_CHECK_SECONDS:
+            return
+        self._state_checked = now
+        state = load_rollout_state(self.model_path)
+        if state.get('id') == self.rollout_id and state.get('step') != self.step:
+            with self._lock:
+                self._reset(state)
+
+    def _timed(self, side, function, image_batch):
+        """
+        Run one forward pass on the serving or shadow side
+
+        Returns:
+            Tuple of (result, seconds, whether no pass of the other side
+            ran or started meanwhile)
+        """
+        other = 'shadow' if side == 'serving' else 'serving'
+        with self._lock:
+            self._activity[side][0] += 1
+            self._activity[side][1] += 1
+            before = tuple(self._activity[other])
+        start = time.perf_counter()
+        try:
+            result = function(image_batch)
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._activity[side][0] -= 1
+                after = tuple(self._activity[other])
+        return result, seconds, before[0] == 0 and after == before
+
+    def _shadow(self, step, image_batch, primary_probabilities, primary_timing, candidate_ready):
+        """Score a batch with the candidate (and the serving full model) and compare them"""
+        try:
+            candidate_probabilities, candidate_seconds, candidate_clean = self._timed(
+                'shadow', self.candidate.predict_proba, image_batch
+            )
+            candidate_ready.set_result(candidate_probabilities)
+            if self.reference is not self.primary:
+                primary_probabilities, *primary_timing = self._timed(
+                    'shadow', self.reference.predict_proba, image_batch
+                )
+        except Exception as e:
+            print(f"Shadow comparison failed: {e}")
+            if not candidate_ready.done():
+                candidate_ready.set_exception(e)
+            with self._lock:
+                self.stats['errors'] += 1
+            return
+
+        primary_seconds, primary_clean = primary_timing
+        agreed = (candidate_probabilities > 0.5) == (primary_probabilities > 0.5)
+        primary_confidence = np.maximum(primary_probabilities, 1 - primary_probabilities)
+        candidate_confidence = np.maximum(candidate_probabilities, 1 - candidate_probabilities)
+        with self._lock:
+            if step != self.step:
+                return
+            self.stats['batches'] += 1
+            self.stats['compared'] += len(agreed)
+            self.stats['agreed'] += int(agreed.sum())
+            self.stats['abs_delta_sum'] += float(np.abs(candidate_probabilities - primary_probabilities).sum())
+            self.stats['confidence_delta_sum'] += float((candidate_confidence - primary_confidence).sum())
+            if primary_clean and candidate_clean:
+                self.stats['timed_batches'] += 1
+                self.stats['primary_seconds'] += primary_seconds
+                self.stats['candidate_seconds'] += candidate_seconds
+
+    def predict_staged(self, image_batch):
+        """
+        Score a batch with the serving model, the candidate answering canary images
+
+        Returns:
+            Tuple of (N probabilities, list of N stage names; 'canary' marks
+            images answered by the candidate)
+        """
+        self._refresh_state()
+        count = len(image_batch)
+        canary_share = self.canary_percent / 100
+        batch_share = max(self.shadow_fraction, canary_share)
+
+        shadowed = False
+        canary = None
+        if batch_share > 0 and self._rng.random() < batch_share:
+            # Canary images are drawn within shadowed batches so that their
+            # overall share is canary_percent
+            canary = np.flatnonzero(self._rng.random(count) < canary_share / batch_share)
+            busy = self._pending is not None and not self._pending.done()
+            if busy and not len(canary):
+                with self._lock:
+                    self.stats['skipped_busy'] += 1
+            else:
+                shadowed = True
+                # The candidate gets its own copy; the batch may be a view of a reused buffer
+                shadow_batch = np.array(image_batch)
+
+        (probabilities, stages), primary_seconds, primary_clean = self._timed(
+            'serving', self.primary.predict_staged, image_batch
+        )
+        if not shadowed:
+            return probabilities, stages
+
+        # Started after the serving pass so that the two models do not share the cores
+        primary_probabilities = np.array(probabilities, dtype=np.float32)
+        candidate_ready = Future()
+        self._pending = self._executor.submit(
+            self._shadow, self.step, shadow_batch, primary_probabilities,
+            (primary_seconds, primary_clean), candidate_ready
+        )
+        if not len(canary):
+            return probabilities, stages
+
+        try:
+            candidate_probabilities = candidate_ready.result()
+        except Exception:
+            return probabilities, stages
+        probabilities = primary_probabilities.copy()
+        probabilities[canary] = candidate_probabilities[canary]
+        stages = list(stages)
+        for index in canary:
+            stages[index] = 'canary'
+        with self._lock:
+            self.stats['canary_images'] += len(canary)
+        return probabilities, stages
+
+    def rollout_statistics(self):
+        """Comparison of candidate and serving model in the current step"""
+        with self._lock:
+            stats = dict(self.stats)
+            step, percent = self.step, self.canary_percent
+        compared = stats['compared']
+        return {
+            'id': self.rollout_id,
+            'step': step,
+            'canary_percent': percent,
+            'shadow_fraction': self.shadow_fraction,
+            'batches': stats['batches'],
+            'compared': compared,
+            'agreement': stats['agreed'] / compared if compared else None,
+            'mean_abs_delta': stats['abs_delta_sum'] / compared if compared else None,
+            'mean_confidence_delta': stats['confidence_delta_sum'] / compared if compared else None,
+            'timed_batches': stats['timed_batches'],
+            'primary_ms_per_batch': (stats['primary_seconds'] / stats['timed_batches'] * 1000
+                                     if stats['timed_batches'] else None),
+            'candidate_ms_per_batch': (stats['candidate_seconds'] / stats['timed_batches'] * 1000
+                                       if stats['timed_batches'] else None),
+            'latency_ratio': (stats['candidate_seconds'] / stats['primary_seconds']
+                              if stats['primary_seconds'] else None),
+            'canary_images': stats['canary_images'],
+            'skipped_busy': stats['skipped_busy'],
+            'errors': stats['errors']
+        }
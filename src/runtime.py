@@ -0,0 +1,306 @@
+"""
+TensorFlow Runtime Profile for Cats vs Dogs Training and Serving
+Thread pools, oneDNN, bfloat16 mixed precision and XLA, configured explicitly
+from the environment, plus a benchmark of the combinations on this machine
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+
+# Profile settings. TF_ENABLE_ONEDNN_OPTS is read by TensorFlow itself when it
+# is first imported, so it must be in the environment before that happens.
+PROFILE_ENV = {
+    'intra_op_threads': 'TF_INTRA_OP_THREADS',    # 0 = TensorFlow default
+    'inter_op_threads': 'TF_INTER_OP_THREADS',    # 0 = TensorFlow default
+    'onednn': 'TF_ENABLE_ONEDNN_OPTS',            # '1' on, '0' off
+    'mixed_precision': 'MIXED_PRECISION',         # 'off', 'bf16' or 'auto'
+    'xla': 'XLA_JIT',                             # '1' to JIT-compile with XLA
+}
+
+_configured = None
+
+
+def cpu_supports_bf16():
+    """Check /proc/cpuinfo for native bfloat16 instructions (AVX512-BF16 or AMX)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = set(line.split(':', 1)[1].split())
+                    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+    except OSError:
+        pass
+    return False
+
+
+def profile_from_env():
+    """
+    Read the runtime profile from the environment
+
+    Returns:
+        Dictionary with intra_op_threads, inter_op_threads, onednn,
+        mixed_precision and xla
+    """
+    mixed_precision = os.getenv(PROFILE_ENV['mixed_precision'], 'off')
+    if mixed_precision == 'auto':
+        mixed_precision = 'bf16' if cpu_supports_bf16() else 'off'
+
+    return {
+        'intra_op_threads': int(os.getenv(PROFILE_ENV['intra_op_threads'], '0')),
+        'inter_op_threads': int(os.getenv(PROFILE_ENV['inter_op_threads'], '0')),
+        'onednn': os.getenv(PROFILE_ENV['onednn'], '1') != '0',
+        'mixed_precision': mixed_precision == 'bf16',
+        'xla': os.getenv(PROFILE_ENV['xla'], '0') == '1',
+    }
+
+
+def profile_env(profile):
+    """Environment variables that select a profile"""
+    return {
+        PROFILE_ENV['intra_op_threads']: str(profile['intra_op_threads']),
+        PROFILE_ENV['inter_op_threads']: str(profile['inter_op_threads']),
+        PROFILE_ENV['onednn']: '1' if profile['onednn'] else '0',
+        PROFILE_ENV['mixed_precision']: 'bf16' if profile['mixed_precision'] else 'off',
+        PROFILE_ENV['xla']: '1' if profile['xla'] else '0',
+    }
+
+
+def configure_runtime():
+    """
+    Apply the environment's runtime profile to TensorFlow
+
+    Safe to call repeatedly; only the first call has an effect. Thread
+    counts can only be set before TensorFlow runs its first operation, so
+    call this before building or loading a model.
+
+    Returns:
+        The applied profile
+    """
+    global _configured
+    if _configured is not None:
+        return _configured
+
+    profile = profile_from_env()
+    import tensorflow as tf
+    from tensorflow import keras
+
+    try:
+        if profile['intra_op_threads']:
+            tf.config.threading.set_intra_op_parallelism_threads(profile['intra_op_threads'])
+        if profile['inter_op_threads']:
+            tf.config.threading.set_inter_op_parallelism_threads(profile['inter_op_threads'])
+    except RuntimeError as e:
+        print(f"Thread settings not applied (TensorFlow already initialized): {e}")
+
+    if profile['mixed_precision']:
+        keras.mixed_precision.set_global_policy('mixed_bfloat16')
+
+    _configured = profile
+    print(f"TensorFlow runtime profile: {profile}")
+    return profile
+
+
+def to_mixed_precision(model):
+    """
+    Clone a float32 model so its layers compute in bfloat16
+
+    Variables stay float32 and the output layer keeps computing in float32,
+    as with keras' mixed_bfloat16 policy for newly built models.
+
+    Args:
+        model: Loaded Keras model
+
+    Returns:
+        Equivalent model using the mixed_bfloat16 policy
+    """
+    from tensorflow import keras
+
+    output_layer = model.layers[-1].name
+
+    def clone(layer):
+        if isinstance(layer, keras.Model):
+            return keras.models.clone_model(layer, clone_function=clone)
+        config = layer.get_config()
+        if layer.name != output_layer:
+            config['dtype'] = 'mixed_bfloat16'
+        return type(layer).from_config(config)
+
+    mixed = keras.models.clone_model(model, clone_function=clone)
+    mixed.set_weights(model.get_weights())
+    return mixed
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _load_benchmark_model(model_path, backbone):
+    """The serving model if it exists, else the architecture with random weights"""
+    from tensorflow import keras
+    from src.model import CatsDogsModel
+
+    if model_path and Path(model_path).exists():
+        return keras.models.load_model(model_path, compile=False)
+    return CatsDogsModel(backbone=backbone).build_model(backbone_weights=None)
+
+
+def measure(model_path='models/cats_dogs_model.h5', backbone='vgg16', batch_size=32,
+            inference_batch_size=1, steps=10, warmup=3):
+    """
+    Time training steps and inference under the current environment's profile
+
+    Args:
+        model_path: Model to benchmark (random weights are used if missing)
+        backbone: Backbone for the random-weight fallback
+        batch_size: Training batch size
+        inference_batch_size: Images per inference call
+        steps: Timed steps per measurement
+        warmup: Untimed steps first (includes XLA compilation)
+
+    Returns:
+        Dictionary of seconds per training step and per inference call
+    """
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow import keras
+
+    profile = configure_runtime()
+    model = _load_benchmark_model(model_path, backbone)
+    if profile['mixed_precision']:
+        model = to_mixed_precision(model)
+
+    model.compile(optimizer=keras.optimizers.Adam(1e-4), loss='binary_crossentropy',
+                  jit_compile=profile['xla'])
+
+    shape = model.inputs[0].shape[1:]
+    images = np.random.rand(batch_size, *shape).astype(np.float32)
+    labels = np.random.randint(0, 2, size=(batch_size, 1)).astype(np.float32)
+
+    for _ in range(warmup):
+        model.train_on_batch(images, labels)
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(images, labels)
+    train_seconds = (time.perf_counter() - start) / steps
+
+    forward = tf.function(model, jit_compile=profile['xla'])
+    batch = images[:inference_batch_size]
+    for _ in range(warmup):
+        forward(batch, training=False)
+    start = time.perf_counter()
+    for _ in range(steps):
+        np.asarray(forward(batch, training=False))
+    inference_seconds = (time.perf_counter() - start) / steps
+
+    return {
+        'profile': profile,
+        'train_step_seconds': train_seconds,
+        'train_images_per_second': batch_size / train_seconds,
+        'inference_seconds': inference_seconds,
+        'inference_batch_size': inference_batch_size
+    }
+
+
+def candidate_profiles():
+    """Profiles worth comparing on this machine"""
+    cores = os.cpu_count() or 1
+    intra_options = sorted({cores, max(1, cores // 2)})
+    inter_options = [1, 2] if cores > 1 else [1]
+    precision_options = [False, True] if cpu_supports_bf16() else [False]
+
+    for intra, inter, onednn, mixed, xla in itertools.product(
+            intra_options, inter_options, (True, False), precision_options, (False, True)):
+        yield {'intra_op_threads': intra, 'inter_op_threads': inter, 'onednn': onednn,
+               'mixed_precision': mixed, 'xla': xla}
+
+
+def benchmark(model_path='models/cats_dogs_model.h5', backbone='vgg16', batch_size=32,
+              inference_batch_size=1, steps=10, report_path='models/runtime_benchmark.json',
+              timeout=900):
+    """
+    Measure every candidate profile, each in a fresh interpreter
+
+    oneDNN and thread pools are fixed once TensorFlow starts, so every
+    profile needs its own process.
+
+    Returns:
+        Report dictionary with all results and the fastest profiles
+    """
+    results = []
+    for profile in candidate_profiles():
+        env = dict(os.environ, **profile_env(profile), TF_CPP_MIN_LOG_LEVEL='3')
+        command = [
+            sys.executable, '-m', 'src.runtime', 'measure',
+            '--model-path', model_path or '', '--backbone', backbone,
+            '--batch-size', str(batch_size), '--inference-batch-size', str(inference_batch_size),
+            '--steps', str(steps)
+        ]
+        try:
+            completed = subprocess.run(command, env=env, capture_output=True, text=True,
+                                       timeout=timeout, check=True)
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (subprocess.SubprocessError, ValueError, IndexError) as e:
+            result = {'profile': profile, 'error': str(e)[-500:]}
+        print(json.dumps(result))
+        results.append(result)
+
+    measured = [r for r in results if 'error' not in r]
+    report = {
+        'cpu_count': os.cpu_count(),
+        'bf16_supported': cpu_supports_bf16(),
+        'results': results,
+        'fastest_training': min(measured, key=lambda r: r['train_step_seconds'], default=None),
+        'fastest_inference': min(measured, key=lambda r: r['inference_seconds'], default=None),
+        'created_at': datetime.now().isoformat()
+    }
+
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Runtime benchmark saved to {report_path}")
+
+    return report
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark TensorFlow runtime profiles")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('benchmark', 'measure'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--model-path', default='models/cats_dogs_model.h5')
+        sub.add_argument('--backbone', default='vgg16')
+        sub.add_argument('--batch-size', type=int, default=32)
+        sub.add_argument('--inference-batch-size', type=int, default=1)
+        sub.add_argument('--steps', type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == 'measure':
+        # Single profile from the environment; the last stdout line is the result
+        result = measure(args.model_path, args.backbone, args.batch_size,
+                         args.inference_batch_size, args.steps)
+        print(json.dumps(result))
+        return
+
+    report = benchmark(args.model_path, args.backbone, args.batch_size,
+                       args.inference_batch_size, args.steps)
+    for label, key in (('training', 'fastest_training'), ('inference', 'fastest_inference')):
+        best = report[key]
+        if best is not None:
+            settings = ' '.join(f"{k}={v}" for k, v in profile_env(best['profile']).items())
+            print(f"Fastest for {label}: {settings}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
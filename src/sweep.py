@@ -0,0 +1,431 @@
+"""
+Hyperparameter Sweep for Cats vs Dogs Classification
+Runs trials in parallel processes pinned to their own cores, trains them on a
+decoded dataset cached once per image size, and stops weak configurations
+early with asynchronous successive halving (ASHA)
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import random
+import hashlib
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+# TensorFlow is only imported inside trial processes, after each one has
+# been pinned to its cores and given matching thread counts
+
+
+SWEEP_CACHE_DIR = 'models/sweep_cache'
+SWEEP_RESULTS_PATH = 'models/sweep_results.json'
+SWEEP_TRIALS_DIR = 'models/sweep_trials'
+
+# Search space: choices are sampled uniformly, (low, high) log-uniformly.
+# 'custom_cnn' is accepted as a backbone for the small from-scratch network.
+DEFAULT_SPACE = {
+    'learning_rate': (1e-5, 1e-3),
+    'img_size': [128, 160, 224],
+    'batch_size': [16, 32, 64],
+    'backbone': ['vgg16', 'mobilenet_v2'],
+}
+
+
+def sample_config(space, rng):
+    """Draw one configuration from a search space"""
+    config = {}
+    for name, values in space.items():
+        if isinstance(values, tuple):
+            low, high = values
+            config[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+        else:
+            config[name] = rng.choice(values)
+    return config
+
+
+# ----------------------------------------------------------------------
+# Decoded dataset cache
+# ----------------------------------------------------------------------
+
+def _decode_into(cache_path, start, paths, img_size):
+    """Decode a chunk of images straight into the shared uint8 cache file"""
+    images = np.lib.format.open_memmap(cache_path, mode='r+')
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            # Same resampling as the Keras training generators
+            img = img.convert('RGB').resize((img_size, img_size), Image.NEAREST)
+            images[start + i] = np.asarray(img, dtype=np.uint8)
+    images.flush()
+    return len(paths)
+
+
+def build_dataset_cache(files, img_size, cache_dir=SWEEP_CACHE_DIR, workers=None):
+    """
+    Decode and resize every image once into a memory-mapped uint8 array
+
+    The cache is keyed by the file list, so adding images rebuilds it. Trial
+    processes map the same file and share it through the page cache.
+
+    Args:
+        files: List of (path, label index)
+        img_size: Square image side
+        cache_dir: Directory for the cache files
+        workers: Decoding processes (default: CPU count)
+
+    Returns:
+        Tuple of (images memmap, labels array)
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    images_path = cache_dir / f"images_{img_size}.npy"
+    labels_path = cache_dir / f"labels_{img_size}.npy"
+    meta_path = cache_dir / f"meta_{img_size}.json"
+
+    key = hashlib.sha256('\n'.join(f"{p}|{l}" for p, l in files).encode()).hexdigest()
+    try:
+        with open(meta_path, 'r') as f:
+            if json.load(f)['key'] == key:
+                return np.load(images_path, mmap_mode='r'), np.load(labels_path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    print(f"Caching {len(files)} images at {img_size}x{img_size}...")
+    start = time.time()
+    shape = (len(files), img_size, img_size, 3)
+    np.lib.format.open_memmap(images_path, mode='w+', dtype=np.uint8, shape=shape).flush()
+
+    paths = [path for path, _ in files]
+    chunk = 256
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+        futures = [pool.submit(_decode_into, str(images_path), i, paths[i:i + chunk], img_size)
+                   for i in range(0, len(paths), chunk)]
+        for future in futures:
+            future.result()
+
+    np.save(labels_path, np.array([label for _, label in files], dtype=np.float32))
+    with open(meta_path, 'w') as f:
+        json.dump({'key': key, 'count': len(files), 'img_size': img_size}, f)
+    print(f"Cached in {time.time() - start:.1f}s")
+
+    return np.load(images_path, mmap_mode='r'), np.load(labels_path)
+
+
+def sweep_files(train_dir='data/train', store_dir='data/retrain', max_images=None, seed=0):
+    """Shuffled (path, label) list from the training data and the image store"""
+    from src.image_store import ImageStore, is_image_store
+    from src.model import _distillation_files
+
+    store = ImageStore(store_dir) if store_dir and is_image_store(store_dir) else None
+    files = _distillation_files(train_dir, store)
+    random.Random(seed).shuffle(files)
+    return files[:max_images] if max_images else files
+
+
+# ----------------------------------------------------------------------
+# Trial processes
+# ----------------------------------------------------------------------
+
+def _pin_worker(core_slices):
+    """Pool initializer: take a core slice and size TensorFlow's threads to it"""
+    cores = core_slices.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    os.environ['TF_INTRA_OP_THREADS'] = str(len(cores))
+    os.environ['TF_INTER_OP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+
+def _run_trial_step(trial, target_epochs, cache_dir, trials_dir, validation_split, seed):
+    """
+    Train one trial up to a rung and score it on the validation split
+
+    Runs in a pinned worker process. Weights and optimizer state are kept
+    between rungs so a promoted trial continues where it stopped.
+    """
+    from tensorflow import keras
+    from src.model import CatsDogsModel
+
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    config = trial['config']
+    img_size = config['img_size']
+
+    images = np.load(Path(cache_dir) / f"images_{img_size}.npy", mmap_mode='r')
+    labels = np.load(Path(cache_dir) / f"labels_{img_size}.npy")
+    split = int(len(labels) * (1 - validation_split))
+
+    class CachedBatches(keras.utils.PyDataset):
+        """Batches from the cache with random horizontal flips for training"""
+
+        def __init__(self, indices, batch_size, augment):
+            super().__init__()
+            self.indices = indices
+            self.batch_size = batch_size
+            self.augment = augment
+            self.rng = np.random.default_rng(seed)
+
+        def __len__(self):
+            return max(1, math.ceil(len(self.indices) / self.batch_size))
+
+        def __getitem__(self, index):
+            batch = np.sort(self.indices[index * self.batch_size:(index + 1) * self.batch_size])
+            x = images[batch].astype(np.float32) / 255.0
+            if self.augment:
+                flip = self.rng.random(len(batch)) < 0.5
+                x[flip] = x[flip, :, ::-1]
+            return x, labels[batch]
+
+        def on_epoch_end(self):
+            if self.augment:
+                self.rng.shuffle(self.indices)
+
+    train_data = CachedBatches(np.arange(split), config['batch_size'], augment=True)
+    val_data = CachedBatches(np.arange(split, len(labels)), 64, augment=False)
+
+    pretrained = config['backbone'] != 'custom_cnn'
+    trainer = CatsDogsModel(img_size=(img_size, img_size), learning_rate=config['learning_rate'],
+                            backbone=config['backbone'] if pretrained else None)
+    model = trainer.build_model(use_pretrained=pretrained)
+    weights_path = Path(trials_dir) / f"trial_{trial['id']}.weights.h5"
+    if trial['epochs'] and weights_path.exists():
+        model.optimizer.build(model.trainable_variables)
+        model.load_weights(weights_path)
+
+    model.fit(train_data, initial_epoch=trial['epochs'],
+              epochs=target_epochs, verbose=0)
+    val_loss, val_accuracy = model.evaluate(val_data, verbose=0)[:2]
+    model.save_weights(weights_path)
+
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'epochs': target_epochs,
+        'val_accuracy': float(val_accuracy),
+        'val_loss': float(val_loss),
+        'seconds': time.time() - start,
+        'cpu_seconds': (cpu_end.ru_utime - cpu_start.ru_utime) + (cpu_end.ru_stime - cpu_start.ru_stime)
+    }
+
+
+# ----------------------------------------------------------------------
+# ASHA
+# ----------------------------------------------------------------------
+
+class ASHA:
+    """
+    Asynchronous successive halving
+
+    Rung k trains a trial to min_epochs * eta**k epochs. Whenever a worker
+    frees up, the best unpromoted trial in the top 1/eta of the highest
+    possible rung moves up; otherwise a new trial starts at rung 0.
+    """
+
+    def __init__(self, min_epochs=1, max_epochs=9, eta=3):
+        self.eta = eta
+        self.rung_epochs = []
+        epochs = min_epochs
+        while epochs < max_epochs:
+            self.rung_epochs.append(epochs)
+            epochs *= eta
+        self.rung_epochs.append(max_epochs)
+        self.rungs = [dict() for _ in self.rung_epochs]    # trial id -> score
+        self.promoted = [set() for _ in self.rung_epochs]
+
+    def record(self, trial_id, rung, score):
+        self.rungs[rung][trial_id] = score
+
+    def next_promotion(self):
+        """(trial id, next rung) to promote, or None"""
+        for rung in range(len(self.rung_epochs) - 2, -1, -1):
+            scores = self.rungs[rung]
+            top = sorted(scores, key=scores.get, reverse=True)[:len(scores) // self.eta]
+            for trial_id in top:
+                if trial_id not in self.promoted[rung]:
+                    self.promoted[rung].add(trial_id)
+                    return trial_id, rung + 1
+        return None
+
+
+def run_sweep(trials=16, workers=None, cores_per_trial=None, min_epochs=1, max_epochs=9, eta=3,
+              space=None, train_dir='data/train', store_dir='data/retrain', max_images=4000,
+              validation_split=0.2, seed=0, cache_dir=SWEEP_CACHE_DIR,
+              trials_dir=SWEEP_TRIALS_DIR, results_path=SWEEP_RESULTS_PATH):
+    """
+    Search learning rate, image size, batch size and backbone with ASHA
+
+    Args:
+        trials: Number of configurations to sample
+        workers: Trials trained at once (default: cores // cores_per_trial)
+        cores_per_trial: Cores pinned to each worker (default: an even share)
+        min_epochs: Epochs at the first rung
+        max_epochs: Epochs at the last rung (the full training budget)
+        eta: Reduction factor; the top 1/eta of a rung is promoted
+        space: Search space (default: DEFAULT_SPACE)
+        train_dir: Directory of class folders
+        store_dir: Image store with retraining data ('' to skip)
+        max_images: Subsample of the data used by the sweep (None for all)
+        validation_split: Fraction of the cached data used for scoring
+        seed: Seed for sampling configurations and data order
+        cache_dir: Decoded dataset cache directory
+        trials_dir: Per-trial weights between rungs
+        results_path: Where to save the JSON results
+
+    Returns:
+        Results dictionary
+    """
+    space = space or DEFAULT_SPACE
+    rng = random.Random(seed)
+    configs = [sample_config(space, rng) for _ in range(trials)]
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+    if workers is None:
+        workers = max(1, len(cores) // cores_per_trial) if cores_per_trial else min(len(cores), trials)
+    cores_per_trial = cores_per_trial or max(1, len(cores) // workers)
+    core_slices = [{cores[(i * cores_per_trial + j) % len(cores)] for j in range(cores_per_trial)}
+                   for i in range(workers)]
+
+    files = sweep_files(train_dir, store_dir, max_images, seed)
+    for img_size in sorted({config['img_size'] for config in configs}):
+        build_dataset_cache(files, img_size, cache_dir)
+    Path(trials_dir).mkdir(parents=True, exist_ok=True)
+
+    asha = ASHA(min_epochs, max_epochs, eta)
+    records = {i: {'id': i, 'config': config, 'epochs': 0, 'rungs': [], 'cpu_seconds': 0.0}
+               for i, config in enumerate(configs)}
+    unstarted = list(records)
+    print(f"Sweeping {trials} trials on {workers} workers x {cores_per_trial} cores, "
+          f"rungs at {asha.rung_epochs} epochs")
+
+    context = multiprocessing.get_context('spawn')
+    slice_queue = context.Queue()
+    for core_slice in core_slices:
+        slice_queue.put(core_slice)
+
+    start = time.time()
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_pin_worker, initargs=(slice_queue,)) as pool:
+
+        def submit():
+            job = asha.next_promotion()
+            if job is None:
+                if not unstarted:
+                    return False
+                job = (unstarted.pop(0), 0)
+            trial_id, rung = job
+            future = pool.submit(_run_trial_step, records[trial_id], asha.rung_epochs[rung],
+                                 cache_dir, trials_dir, validation_split, seed)
+            running[future] = job
+            return True
+
+        while len(running) < workers and submit():
+            pass
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial_id, rung = running.pop(future)
+                record = records[trial_id]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    record['error'] = str(e)
+                    print(f"Trial {trial_id} failed: {e}")
+                    continue
+                record['epochs'] = result['epochs']
+                record['cpu_seconds'] += result['cpu_seconds']
+                record['rungs'].append(dict(result, rung=rung))
+                asha.record(trial_id, rung, result['val_accuracy'])
+                print(f"Trial {trial_id} rung {rung} ({result['epochs']} epochs): "
+                      f"val_accuracy={result['val_accuracy']:.4f} {record['config']}")
+            while len(running) < workers and submit():
+                pass
+
+    scored = [r for r in records.values() if r['rungs']]
+    best = max(scored, key=lambda r: (r['epochs'], r['rungs'][-1]['val_accuracy']), default=None)
+    cpu_hours = sum(r['cpu_seconds'] for r in records.values()) / 3600
+    epochs_trained = sum(r['epochs'] for r in records.values())
+
+    results = {
+        'search_space': {k: list(v) for k, v in space.items()},
+        'rung_epochs': asha.rung_epochs,
+        'eta': eta,
+        'workers': workers,
+        'cores_per_trial': cores_per_trial,
+        'images': len(files),
+        'trials': list(records.values()),
+        'best': best,
+        'epochs_trained': epochs_trained,
+        # What training every configuration for the full budget would cost
+        'full_budget_epochs': trials * asha.rung_epochs[-1],
+        'cpu_hours': cpu_hours,
+        'wall_seconds': time.time() - start,
+        'created_at': datetime.now().isoformat()
+    }
+
+    results_path = Path(results_path)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Sweep results saved to {results_path}")
+
+    return results
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep with ASHA")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run a sweep")
+    run_parser.add_argument('--trials', type=int, default=16)
+    run_parser.add_argument('--workers', type=int, default=None)
+    run_parser.add_argument('--cores-per-trial', type=int, default=None)
+    run_parser.add_argument('--min-epochs', type=int, default=1)
+    run_parser.add_argument('--max-epochs', type=int, default=9)
+    run_parser.add_argument('--eta', type=int, default=3)
+    run_parser.add_argument('--max-images', type=int, default=4000,
+                            help="Images used by the sweep (0 for all)")
+    run_parser.add_argument('--train-dir', default='data/train')
+    run_parser.add_argument('--store-dir', default='data/retrain')
+    run_parser.add_argument('--seed', type=int, default=0)
+
+    cache_parser = subparsers.add_parser('cache', help="Build the decoded dataset cache")
+    cache_parser.add_argument('--img-size', type=int, nargs='+', default=DEFAULT_SPACE['img_size'])
+    cache_parser.add_argument('--max-images', type=int, default=4000)
+    cache_parser.add_argument('--train-dir', default='data/train')
+    cache_parser.add_argument('--store-dir', default='data/retrain')
+    cache_parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == 'cache':
+        files = sweep_files(args.train_dir, args.store_dir, args.max_images or None, args.seed)
+        for img_size in args.img_size:
+            build_dataset_cache(files, img_size)
+        return
+
+    results = run_sweep(args.trials, args.workers, args.cores_per_trial, args.min_epochs,
+                        args.max_epochs, args.eta, train_dir=args.train_dir,
+                        store_dir=args.store_dir, max_images=args.max_images or None,
+                        seed=args.seed)
+    best = results['best']
+    if best is not None:
+        print(f"Best: {best['config']} val_accuracy={best['rungs'][-1]['val_accuracy']:.4f} "
+              f"after {best['epochs']} epochs")
+    print(f"{results['epochs_trained']} epochs trained instead of {results['full_budget_epochs']} "
+          f"({results['cpu_hours']:.2f} CPU-hours)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
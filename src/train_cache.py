@@ -0,0 +1,463 @@
+"""
+Pre-resized Training Image Cache for Cats vs Dogs Retraining
+Keeps every retraining image decoded once at TRAIN_CACHE_SIDE pixels (a
+little larger than the model input, so rotations and zooms resample from
+more detail), built by a parallel batch job and synced with the image store
+and replay folders before each retrain. Training batches are then read from
+the cache and augmented with one vectorized affine transform per batch,
+drawing the same random transforms as the ImageDataGenerator it replaces.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+# TensorFlow is only imported where batches are built, so syncing the cache
+# (and its worker processes) stays lightweight
+
+
+TRAIN_CACHE = os.getenv('TRAIN_CACHE', '1') == '1'
+TRAIN_CACHE_DIR = os.getenv('TRAIN_CACHE_DIR', 'models/train_cache')
+TRAIN_CACHE_SIDE = int(os.getenv('TRAIN_CACHE_SIDE', '256'))
+TRAIN_CACHE_WORKERS = int(os.getenv('TRAIN_CACHE_WORKERS', '0')) or os.cpu_count() or 1
+
+# The ImageDataGenerator settings used for training (see src/preprocessing.py)
+AUGMENTATION = {
+    'rotation_range': 40,
+    'width_shift_range': 0.2,
+    'height_shift_range': 0.2,
+    'shear_range': 0.2,
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+}
+
+_DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+def cache_key(path):
+    """
+    Cache key of an image file
+
+    Store objects are named by their SHA-256 and never change, so that name
+    is the key; other files are keyed by path, size and modification time.
+    """
+    path = Path(path)
+    if _DIGEST.fullmatch(path.stem):
+        return path.stem
+    stat = path.stat()
+    return hashlib.sha256(f"{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def _build_thumbnails(root, items, side):
+    """Decode and resize a chunk of images into the cache; runs in a worker process"""
+    built, failed = 0, []
+    for path, key in items:
+        destination = Path(root) / key[:2] / f"{key}.npy"
+        try:
+            with Image.open(path) as img:
+                if img.format == 'JPEG':
+                    img.draft('RGB', (side * 2, side * 2))
+                # Squashed to a square like the Keras generators' resize
+                thumbnail = np.asarray(img.convert('RGB').resize((side, side), reducing_gap=3.0),
+                                       dtype=np.uint8)
+        except Exception as e:
+            failed.append((path, str(e)))
+            continue
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        temporary = destination.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temporary, 'wb') as f:
+            np.save(f, thumbnail)
+        os.replace(temporary, destination)
+        built += 1
+    return built, failed
+
+
+class ThumbnailCache:
+    """
+    Directory of uint8 thumbnails, one .npy per image
+
+    Files live at root/<side>/<key[:2]>/<key>.npy, so caches of different
+    sizes can coexist and a partial build is still usable.
+    """
+
+    def __init__(self, root=TRAIN_CACHE_DIR, side=TRAIN_CACHE_SIDE, workers=TRAIN_CACHE_WORKERS):
+        """
+        Initialize cache
+
+        Args:
+            root: Cache directory
+            side: Side of the square thumbnails
+            workers: Processes used to build missing thumbnails
+        """
+        self.side = side
+        self.root = Path(root) / str(side)
+        self.workers = workers
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        return self.root / key[:2] / f"{key}.npy"
+
+    def keys(self):
+        """Keys of every cached thumbnail"""
+        return {path.stem for path in self.root.glob('*/*.npy')}
+
+    def sync(self, files, prune=False):
+        """
+        Build thumbnails missing for files; optionally delete all others
+
+        Args:
+            files: (path, label) pairs; only the paths are used
+            prune: Delete thumbnails of images not in files (pass every
+                image that may be trained on, e.g. the whole store)
+
+        Returns:
+            Dictionary of counts (images, built, failed, pruned) and seconds
+        """
+        start = time.time()
+        keyed = {}
+        for path, _ in files:
+            try:
+                keyed[str(path)] = cache_key(path)
+            except OSError:
+                continue
+        cached = self.keys()
+        missing = sorted({(path, key) for path, key in keyed.items() if key not in cached},
+                         key=lambda item: item[1])
+
+        built, failed = 0, []
+        if missing:
+            print(f"Caching {len(missing)} training images at {self.side}x{self.side}...")
+            chunk = max(16, math.ceil(len(missing) / (self.workers * 4)))
+            chunks = [missing[i:i + chunk] for i in range(0, len(missing), chunk)]
+            if self.workers > 1 and len(chunks) > 1:
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                    results = list(pool.map(_build_thumbnails, [str(self.root)] * len(chunks),
+                                            chunks, [self.side] * len(chunks)))
+            else:
+                results = [_build_thumbnails(str(self.root), items, self.side) for items in chunks]
+            for count, errors in results:
+                built += count
+                failed.extend(errors)
+            for path, error in failed[:10]:
+                print(f"Could not cache {path}: {error}")
+
+        pruned = 0
+        if prune:
+            live = set(keyed.values())
+            for key in cached - live:
+                self.path(key).unlink(missing_ok=True)
+                pruned += 1
+
+        return {'images': len(keyed), 'built': built, 'failed': len(failed), 'pruned': pruned,
+                'seconds': time.time() - start}
+
+    def load(self, keys, out=None):
+        """
+        Read thumbnails into one uint8 array
+
+        Args:
+            keys: Cache keys
+            out: Optional (len(keys), side, side, 3) uint8 array to fill
+
+        Returns:
+            uint8 array of shape (len(keys), side, side, 3)
+        """
+        if out is None:
+            out = np.empty((len(keys), self.side, self.side, 3), dtype=np.uint8)
+        for i, key in enumerate(keys):
+            out[i] = np.load(self.path(key))
+        return out
+
+
+def random_transforms(count, rng, size, source_side, augmentation=AUGMENTATION):
+    """
+    Draw ImageDataGenerator-style random transforms for a batch
+
+    Parameters are drawn like ImageDataGenerator.get_random_transform()
+    (rotation and shear in degrees, shifts as fractions of the image, zoom
+    per axis, horizontal flip) and composed like apply_affine_transform(),
+    followed by the flip and a scaling from the size x size output grid to
+    the source_side thumbnail.
+
+    Args:
+        count: Images in the batch
+        rng: NumPy Generator
+        size: Output side (the model input)
+        source_side: Side of the images being transformed
+        augmentation: Ranges as passed to ImageDataGenerator
+
+    Returns:
+        (count, 8) float32 projective transforms mapping output (x, y) to
+        input coordinates, for ImageProjectiveTransformV3
+    """
+    theta = np.deg2rad(rng.uniform(-augmentation['rotation_range'],
+                                   augmentation['rotation_range'], count))
+    tx = rng.uniform(-augmentation['height_shift_range'],
+                     augmentation['height_shift_range'], count) * size
+    ty = rng.uniform(-augmentation['width_shift_range'],
+                     augmentation['width_shift_range'], count) * size
+    shear = np.deg2rad(rng.uniform(-augmentation['shear_range'],
+                                   augmentation['shear_range'], count))
+    zoom = rng.uniform(1 - augmentation['zoom_range'], 1 + augmentation['zoom_range'], (count, 2))
+    flip = rng.random(count) < 0.5 if augmentation['horizontal_flip'] else np.zeros(count, bool)
+
+    def matrices(rows):
+        stacked = np.zeros((count, 3, 3))
+        stacked[:, 2, 2] = 1
+        for (i, j), value in rows.items():
+            stacked[:, i, j] = value
+        return stacked
+
+    # rotation @ shift @ shear @ zoom, as apply_affine_transform() composes them
+    matrix = matrices({(0, 0): np.cos(theta), (0, 1): -np.sin(theta),
+                       (1, 0): np.sin(theta), (1, 1): np.cos(theta)})
+    matrix = matrix @ matrices({(0, 0): 1, (1, 1): 1, (0, 2): tx, (1, 2): ty})
+    matrix = matrix @ matrices({(0, 0): 1, (0, 1): -np.sin(shear), (1, 1): np.cos(shear)})
+    matrix = matrix @ matrices({(0, 0): zoom[:, 0], (1, 1): zoom[:, 1]})
+
+    # About the image centre, then swapped into (row, column) order as Keras does
+    centre = size / 2 - 0.5
+    offset = matrices({(0, 0): 1, (1, 1): 1, (0, 2): centre, (1, 2): centre})
+    reset = matrices({(0, 0): 1, (1, 1): 1, (0, 2): -centre, (1, 2): -centre})
+    matrix = offset @ matrix @ reset
+    matrix = matrix[:, [1, 0, 2]][:, :, [1, 0, 2]]
+
+    # The horizontal flip is applied to the transformed image
+    flipped = matrices({(0, 0): 1, (1, 1): np.where(flip, -1, 1),
+                        (1, 2): np.where(flip, size - 1, 0)})
+    # Output pixels of the size grid sample the larger thumbnail
+    scale = source_side / size
+    resize = matrices({(0, 0): scale, (1, 1): scale, (0, 2): (scale - 1) / 2,
+                       (1, 2): (scale - 1) / 2})
+    matrix = resize @ matrix @ flipped
+
+    # (row, column) matrix to the (x, y) layout of projective transforms
+    transforms = np.stack([matrix[:, 1, 1], matrix[:, 1, 0], matrix[:, 1, 2],
+                           matrix[:, 0, 1], matrix[:, 0, 0], matrix[:, 0, 2],
+                           np.zeros(count), np.zeros(count)], axis=1)
+    return transforms.astype(np.float32)
+
+
+def augment_batch(images, rng, size, augmentation=AUGMENTATION):
+    """
+    Randomly transform a batch in one op and scale it to [0, 1]
+
+    Bilinear sampling with edge pixels repeated outside the image, as
+    ImageDataGenerator does with fill_mode='nearest'.
+
+    Args:
+        images: uint8 array (N, side, side, 3)
+        rng: NumPy Generator
+        size: Output side
+        augmentation: Random transform ranges; None only resizes
+
+    Returns:
+        float32 tensor (N, size, size, 3)
+    """
+    import tensorflow as tf
+
+    count, side = len(images), images.shape[1]
+    if augmentation is None:
+        scale = side / size
+        transforms = np.tile(np.array([scale, 0, (scale - 1) / 2, 0, scale, (scale - 1) / 2, 0, 0],
+                                      dtype=np.float32), (count, 1))
+    else:
+        transforms = random_transforms(count, rng, size, side, augmentation)
+    batch = tf.cast(images, tf.float32) * (1.0 / 255)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=batch, transforms=transforms, output_shape=tf.constant([size, size]),
+        fill_value=tf.constant(0.0), interpolation='BILINEAR', fill_mode='NEAREST'
+    )
+
+
+def create_cached_generators(cache, labeled_files, class_names=('cats', 'dogs'),
+                             img_size=(224, 224), batch_size=32, validation_split=0.2, seed=42,
+                             augmentation=AUGMENTATION):
+    """
+    Training and validation batches read from a ThumbnailCache
+
+    A drop-in for ImagePreprocessor.create_data_generators_from_files():
+    the same seeded shuffle and split (validation is the first
+    validation_split of the shuffled list, as with flow_from_dataframe),
+    the same augmentation on both subsets, and `samples`, `batch_size`,
+    `classes` and `class_indices` attributes.
+
+    Args:
+        cache: ThumbnailCache already synced with labeled_files
+        labeled_files: List of (path, class name) tuples
+        class_names: Class names in label order
+        img_size: Model input (height, width); must be square
+        batch_size: Images per batch
+        validation_split: Fraction of images used for validation
+        seed: Shuffle seed for the train/validation split
+        augmentation: Random transform ranges
+
+    Returns:
+        train_generator, validation_generator
+    """
+    from tensorflow import keras
+
+    order = np.random.RandomState(seed).permutation(len(labeled_files))
+    entries = []
+    for index in order:
+        path, class_name = labeled_files[index]
+        try:
+            key = cache_key(path)
+        except OSError:
+            continue
+        if cache.path(key).exists():
+            entries.append((key, float(class_names.index(class_name))))
+    split = int(validation_split * len(entries))
+    class_indices = {name: i for i, name in enumerate(class_names)}
+
+    class CachedBatches(keras.utils.PyDataset):
+        """Augmented batches of cached thumbnails"""
+
+        def __init__(self, subset, shuffle):
+            super().__init__()
+            self.keys = [key for key, _ in subset]
+            self.classes = np.array([label for _, label in subset], dtype=np.float32)
+            self.samples = len(subset)
+            self.batch_size = batch_size
+            self.class_indices = class_indices
+            self.shuffle = shuffle
+            self.rng = np.random.default_rng()
+            self.indices = np.arange(self.samples)
+            self.buffer = np.empty((batch_size, cache.side, cache.side, 3), dtype=np.uint8)
+            if shuffle:
+                self.rng.shuffle(self.indices)
+
+        def __len__(self):
+            return math.ceil(self.samples / self.batch_size)
+
+        def __getitem__(self, index):
+            batch = self.indices[index * self.batch_size:(index + 1) * self.batch_size]
+            images = cache.load([self.keys[i] for i in batch], self.buffer[:len(batch)])
+            return augment_batch(images, self.rng, img_size[0], augmentation), self.classes[batch]
+
+        def on_epoch_end(self):
+            if self.shuffle:
+                self.rng.shuffle(self.indices)
+
+    if entries:
+        print(f"Found {len(entries) - split} cached images for training "
+              f"and {split} for validation")
+    return CachedBatches(entries[split:], shuffle=True), CachedBatches(entries[:split], shuffle=False)
+
+
+# ----------------------------------------------------------------------
+# Batch job and benchmark
+# ----------------------------------------------------------------------
+
+def training_files(store_dir='data/retrain', replay_dirs=None, class_names=('cats', 'dogs')):
+    """Every image retraining may use: the store and the replay folders"""
+    from src.image_store import ImageStore, is_image_store
+    from src.retraining import REPLAY_DIRS, _directory_files
+
+    files = []
+    if store_dir and is_image_store(store_dir):
+        files.extend(ImageStore(store_dir).labeled_files())
+    files.extend(_directory_files(REPLAY_DIRS if replay_dirs is None else replay_dirs,
+                                  class_names))
+    return files
+
+
+def benchmark(files, batch_size=32, epochs=2, cache=None):
+    """
+    Seconds per epoch of the ImageDataGenerator and the cached batches
+
+    Both run the same files with the same split and augmentation; the
+    consumer only touches each batch, so the figures isolate the input
+    pipeline. Pixel mean and standard deviation over the epochs are
+    reported as a check that the augmented images look alike.
+
+    Args:
+        files: (path, class name) pairs
+        batch_size: Images per batch
+        epochs: Passes timed per pipeline (after one untimed batch)
+        cache: ThumbnailCache (default settings if None)
+
+    Returns:
+        Report dictionary
+    """
+    from src.preprocessing import ImagePreprocessor
+
+    cache = cache or ThumbnailCache()
+    report = {'images': len(files), 'batch_size': batch_size, 'epochs': epochs,
+              'cache_side': cache.side, 'cache_sync': cache.sync(files)}
+    preprocessor = ImagePreprocessor(batch_size=batch_size)
+    pipelines = {
+        'image_data_generator': preprocessor.create_data_generators_from_files(files)[0],
+        'cached': create_cached_generators(cache, files, batch_size=batch_size)[0]
+    }
+    for name, generator in pipelines.items():
+        generator[0]
+        total, squares, pixels = 0.0, 0.0, 0
+        start = time.perf_counter()
+        for _ in range(epochs):
+            for index in range(len(generator)):
+                x = np.asarray(generator[index][0], dtype=np.float64)
+                total += x.sum()
+                squares += np.square(x).sum()
+                pixels += x.size
+            generator.on_epoch_end()
+        mean = total / pixels
+        report[name] = {'epoch_seconds': (time.perf_counter() - start) / epochs,
+                        'pixel_mean': mean, 'pixel_std': math.sqrt(squares / pixels - mean ** 2)}
+    report['speedup'] = (report['image_data_generator']['epoch_seconds']
+                         / report['cached']['epoch_seconds'])
+    report['created_at'] = datetime.now().isoformat()
+    return report
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Pre-resized training image cache")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('sync', 'benchmark'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--store', default='data/retrain')
+        sub.add_argument('--replay-dirs', default=None,
+                         help="Comma-separated class-folder directories (default REPLAY_DIRS)")
+        sub.add_argument('--side', type=int, default=TRAIN_CACHE_SIDE)
+        sub.add_argument('--workers', type=int, default=TRAIN_CACHE_WORKERS)
+    subparsers.choices['benchmark'].add_argument('--limit', type=int, default=1024)
+    subparsers.choices['benchmark'].add_argument('--epochs', type=int, default=2)
+    subparsers.choices['benchmark'].add_argument('--output',
+                                                 default='models/train_cache_benchmark.json')
+
+    args = parser.parse_args()
+
+    replay_dirs = args.replay_dirs.split(',') if args.replay_dirs is not None else None
+    files = training_files(args.store, replay_dirs)
+    cache = ThumbnailCache(side=args.side, workers=args.workers)
+
+    if args.command == 'sync':
+        print(json.dumps(cache.sync(files, prune=True), indent=4))
+        return
+
+    if not files:
+        print("No training images found")
+        return 1
+    files = [files[i] for i in np.random.RandomState(0).permutation(len(files))[:args.limit]]
+    report = benchmark(files, epochs=args.epochs, cache=cache)
+    print(json.dumps(report, indent=4))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    sys.exit(main())